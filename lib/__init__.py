@@ -16,6 +16,14 @@ __all__ = [
     "rank_epitopes",
     "utils",
     "post_processor",
+    "pre_prediction_filter",
+    "incremental_run",
+    "reference_proteome",
+    "peptide_registry",
+    "parquet_report",
+    "intermediate_table",
+    "bgzip_report",
+    "annotation_cache",
 ]
 
 import os
@@ -1,43 +1,67 @@
-import csv
-import sys
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
 from lib.prediction_class import *
+from lib.filter import Filter
+import lib.parquet_report
 
 class AlleleSpecificBindingFilter:
-    def __init__(self, input_file, output_file, default_threshold, minimum_fold_change, top_score_metric, exclude_nas):
+    #.tsv reports are filtered in batches of this many rows if no chunk size
+    #is given. Their values are kept as strings, so each batch is filtered
+    #independently and the passing rows are written unchanged.
+    default_chunk_size = 100000
+
+    def __init__(self, input_file, output_file, default_threshold, minimum_fold_change, top_score_metric, exclude_nas, chunk_size=None):
         self.input_file = input_file
         self.output_file = output_file
         self.default_threshold = default_threshold
         self.minimum_fold_change = minimum_fold_change
         self.top_score_metric = top_score_metric
         self.exclude_nas = exclude_nas
+        self.chunk_size = chunk_size
 
     def execute(self):
-        with open(self.input_file, 'r') as input_fh:
-            reader = csv.DictReader(input_fh, delimiter='\t')
-            fieldnames = reader.fieldnames
-            output_fh = open(self.output_file, 'w')
-            writer = csv.DictWriter(output_fh, fieldnames, delimiter = '\t', lineterminator = '\n')
-            writer.writeheader()
-
-            for entry in reader:
-                if self.top_score_metric == 'median':
-                    score = float(entry['Median MT Score'])
-                    if self.exclude_nas and entry['Median Fold Change'] == 'NA':
-                        continue
-                    else:
-                        fold_change = sys.maxsize if entry['Median Fold Change'] == 'NA' else float(entry['Median Fold Change'])
-                elif self.top_score_metric == 'lowest':
-                    score = float(entry['Best MT Score'])
-                    if self.exclude_nas and entry['Corresponding Fold Change'] == 'NA':
-                        continue
-                    else:
-                        fold_change = sys.maxsize if entry['Corresponding Fold Change'] == 'NA' else float(entry['Corresponding Fold Change'])
-
-                threshold = PredictionClass.cutoff_for_allele(entry['HLA Allele'])
-                threshold = self.default_threshold if threshold is None else float(threshold)
-
-                if score > threshold or fold_change < self.minimum_fold_change:
-                    continue
-
-                writer.writerow(entry)
-            output_fh.close()
+        if lib.parquet_report.is_parquet(self.output_file):
+            if self.chunk_size is not None:
+                raise Exception("Filtering in chunks only supports writing .tsv output files")
+            data = pd.concat(self.read_report_chunks())
+            Filter.write_report(self.filter_data(data), self.output_file)
+        else:
+            header = pd.DataFrame(columns=Filter.read_header(self.input_file))
+            header.to_csv(self.output_file, sep='\t', index=False)
+            for chunk in self.read_report_chunks():
+                chunk = self.filter_data(chunk)
+                chunk.to_csv(self.output_file, sep='\t', index=False, na_rep='NA', header=False, mode='a')
+
+    def read_report_chunks(self):
+        if lib.parquet_report.is_parquet(self.input_file):
+            if self.chunk_size is None:
+                return [Filter.read_report(self.input_file)]
+            return Filter.read_report_chunks(self.input_file, self.chunk_size)
+        chunk_size = self.default_chunk_size if self.chunk_size is None else self.chunk_size
+        return pd.read_csv(self.input_file, delimiter='\t', dtype=str, keep_default_na=False, chunksize=chunk_size)
+
+    def thresholds(self, alleles):
+        cutoffs = pd.Series(PredictionClass.allele_cutoffs(), dtype=float)
+        return alleles.map(cutoffs).fillna(float(self.default_threshold))
+
+    def filter_data(self, data):
+        if self.top_score_metric == 'median':
+            score_column = 'Median MT Score'
+            fold_change_column = 'Median Fold Change'
+        elif self.top_score_metric == 'lowest':
+            score_column = 'Best MT Score'
+            fold_change_column = 'Corresponding Fold Change'
+
+        mask = numeric_values(data[score_column]) <= self.thresholds(data['HLA Allele'])
+        if self.minimum_fold_change is not None:
+            fold_changes = numeric_values(data[fold_change_column])
+            if self.exclude_nas:
+                mask &= fold_changes.notna() & (fold_changes >= self.minimum_fold_change)
+            else:
+                mask &= fold_changes.isna() | (fold_changes >= self.minimum_fold_change)
+        return data[mask]
+
+def numeric_values(values):
+    if is_numeric_dtype(values):
+        return values
+    return pd.to_numeric(values.mask(values == 'NA'))
@@ -0,0 +1,53 @@
+import sqlite3
+import json
+
+class AnnotationCache:
+    #NetChop and NetMHCstab predictions only depend on the peptide and the
+    #prediction settings. The cache is an SQLite database that can be shared
+    #between runs and samples. Each tool stores its predictions in its own
+    #table, keyed by the peptide and the settings, so that they only need to
+    #be requested once.
+    batch_size = 500
+
+    def __init__(self, path, table):
+        self.table = table
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, value TEXT NOT NULL)" % self.table
+            )
+
+    @classmethod
+    def key(cls, *values):
+        return "\t".join(str(value) for value in values)
+
+    def get(self, keys):
+        #Returns the cached values of the given keys. Keys that aren't cached
+        #are left out.
+        keys = list(keys)
+        values = {}
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start:start+self.batch_size]
+            rows = self.connection.execute(
+                "SELECT key, value FROM %s WHERE key IN (%s)" % (self.table, ','.join('?' * len(batch))),
+                batch
+            )
+            for (key, value) in rows:
+                values[key] = json.loads(value)
+        return values
+
+    def update(self, values):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO %s (key, value) VALUES (?, ?)" % self.table,
+                [(key, json.dumps(value)) for (key, value) in values.items()]
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,107 @@
+import os
+import gzip
+import heapq
+import itertools
+import tempfile
+from contextlib import ExitStack
+import pysam
+
+extension = '.gz'
+
+#Reports with these columns are sorted by chromosome and start position
+#before they are compressed and get a tabix index for region queries. The
+#Start column holds zero-based positions.
+index_columns = ['Chromosome', 'Start', 'Stop']
+
+#Number of lines that are sorted in memory at a time
+sort_batch_size = 500000
+
+def is_bgzipped(path):
+    return str(path).endswith(extension)
+
+def bgzip_path(tsv_path):
+    return tsv_path + extension
+
+def index_path(bgzip_file):
+    return bgzip_file + '.tbi'
+
+def report_path(tsv_path):
+    #Reports may have been compressed after they were written
+    if not os.path.exists(tsv_path) and os.path.exists(bgzip_path(tsv_path)):
+        return bgzip_path(tsv_path)
+    return tsv_path
+
+def report_exists(tsv_path):
+    return os.path.exists(report_path(tsv_path))
+
+def open_report(path, mode='r'):
+    if is_bgzipped(path):
+        return gzip.open(path, mode + 't')
+    return open(path, mode)
+
+def line_key(line, column_indexes):
+    fields = line.split('\t')
+    return (fields[column_indexes[0]], int(fields[column_indexes[1]]))
+
+def sorted_batches(input_fh, column_indexes, batch_directory):
+    #Sorts the lines in batches of sort_batch_size lines and writes each batch
+    #to its own file
+    batch_files = []
+    while True:
+        lines = list(itertools.islice(input_fh, sort_batch_size))
+        if len(lines) == 0:
+            return batch_files
+        if not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        lines.sort(key=lambda line: line_key(line, column_indexes))
+        batch_file = os.path.join(batch_directory, str(len(batch_files)))
+        with open(batch_file, 'w', newline='') as batch_fh:
+            batch_fh.writelines(lines)
+        batch_files.append(batch_file)
+
+def sort_report(tsv_file, sorted_file, column_indexes):
+    #Sorts the report by chromosome and start position without loading it
+    #into memory. The sorted batches are merged like the parsed outputs in
+    #combine_parsed_outputs. Returns False if the positions aren't integers,
+    #e.g. for fusions.
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(tsv_file))) as batch_directory:
+        with open(tsv_file, 'r', newline='') as input_fh:
+            header = input_fh.readline()
+            try:
+                batch_files = sorted_batches(input_fh, column_indexes, batch_directory)
+            except (IndexError, ValueError):
+                return False
+        with ExitStack() as stack:
+            batches = [stack.enter_context(open(batch_file, 'r', newline='')) for batch_file in batch_files]
+            with open(sorted_file, 'w', newline='') as sorted_fh:
+                sorted_fh.write(header)
+                sorted_fh.writelines(heapq.merge(*batches, key=lambda line: line_key(line, column_indexes)))
+    return True
+
+def compress(tsv_file, output_file=None):
+    #Replaces the report with a BGZF compressed copy and, if possible, indexes it
+    if output_file is None:
+        output_file = bgzip_path(tsv_file)
+    with open(tsv_file, 'r', newline='') as input_fh:
+        header = input_fh.readline()
+    columns = header.rstrip('\r\n').split('\t')
+    column_indexes = [columns.index(column) for column in index_columns if column in columns]
+    sorted_file = tsv_file + '.sorted'
+    if len(column_indexes) == len(index_columns) and sort_report(tsv_file, sorted_file, column_indexes):
+        pysam.tabix_compress(sorted_file, output_file, force=True)
+        os.remove(sorted_file)
+        pysam.tabix_index(
+            output_file,
+            force=True,
+            seq_col=column_indexes[0],
+            start_col=column_indexes[1],
+            end_col=column_indexes[2],
+            line_skip=1,
+            zerobased=True,
+        )
+    else:
+        pysam.tabix_compress(tsv_file, output_file, force=True)
+        if os.path.exists(index_path(output_file)):
+            os.remove(index_path(output_file))
+    os.remove(tsv_file)
+    return output_file
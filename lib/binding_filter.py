@@ -6,7 +6,7 @@ from lib.filter import *
 from lib.allele_specific_binding_filter import *
 
 class BindingFilter:
-    def __init__(self, input_file, output_file, binding_threshold, minimum_fold_change, top_score_metric, exclude_nas, allele_specific_cutoffs):
+    def __init__(self, input_file, output_file, binding_threshold, minimum_fold_change, top_score_metric, exclude_nas, allele_specific_cutoffs, chunk_size=None):
         self.input_file = input_file
         self.output_file = output_file
         self.binding_threshold = binding_threshold
@@ -14,27 +14,40 @@ class BindingFilter:
         self.top_score_metric = top_score_metric
         self.exclude_nas = exclude_nas
         self.allele_specific_cutoffs = allele_specific_cutoffs
+        self.chunk_size = chunk_size
 
     def execute(self):
-        filter_criteria = []
+        if self.allele_specific_cutoffs:
+            self.allele_specific_binding_filter().execute()
+        else:
+            self.threshold_filter().execute()
 
+    def filter_data(self, data):
         if self.allele_specific_cutoffs:
-            AlleleSpecificBindingFilter(self.input_file, self.output_file, self.binding_threshold, self.minimum_fold_change, self.top_score_metric, self.exclude_nas).execute()
+            return self.allele_specific_binding_filter().filter_data(data)
         else:
+            return self.threshold_filter().filter_data(data)
+
+    def allele_specific_binding_filter(self):
+        return AlleleSpecificBindingFilter(self.input_file, self.output_file, self.binding_threshold, self.minimum_fold_change, self.top_score_metric, self.exclude_nas, chunk_size=self.chunk_size)
+
+    def threshold_filter(self):
+        filter_criteria = []
+
+        if self.top_score_metric == 'median':
+            column = 'Median MT Score'
+        elif self.top_score_metric == 'lowest':
+            column = 'Best MT Score'
+        filter_criteria.append({'column': column, 'operator': '<=', 'threshold': self.binding_threshold})
+
+        if self.minimum_fold_change is not None:
             if self.top_score_metric == 'median':
-                column = 'Median MT Score'
+                column = 'Median Fold Change'
             elif self.top_score_metric == 'lowest':
-                column = 'Best MT Score'
-            filter_criteria.append({'column': column, 'operator': '<=', 'threshold': self.binding_threshold})
-
-            if self.minimum_fold_change is not None:
-                if self.top_score_metric == 'median':
-                    column = 'Median Fold Change'
-                elif self.top_score_metric == 'lowest':
-                    column = 'Corresponding Fold Change'
-                filter_criteria.append({'column': column, 'operator': '>=', 'threshold': self.minimum_fold_change})
+                column = 'Corresponding Fold Change'
+            filter_criteria.append({'column': column, 'operator': '>=', 'threshold': self.minimum_fold_change})
 
-            Filter(self.input_file, self.output_file, filter_criteria, self.exclude_nas).execute()
+        return Filter(self.input_file, self.output_file, filter_criteria, self.exclude_nas, chunk_size=self.chunk_size)
 
     @classmethod
     def parser(cls, tool):
@@ -84,4 +97,9 @@ class BindingFilter:
             default=False,
             action='store_true',
         )
+        parser.add_argument(
+            '--chunk-size', type=int,
+            help="Filter the report in batches of this many rows instead of loading the whole report into memory. "
+                 + "With allele-specific binding thresholds, .tsv reports are always filtered in batches.",
+        )
         return parser
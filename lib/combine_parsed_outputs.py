@@ -1,17 +1,106 @@
 import argparse
 import sys
+import os
 import csv
+import heapq
+import itertools
+import tempfile
+from contextlib import ExitStack
+from math import inf
+try:
+    from lib import intermediate_table, bgzip_report
+except ImportError:
+    #Run as a script from within the lib directory
+    import intermediate_table
+    import bgzip_report
+
+#Number of rows of an input that are sorted in memory at a time with
+#--sort-inputs
+sort_batch_size = 500000
+
+class UnsortedInputError(Exception):
+    pass
+
+def sort_key(top_score_metric):
+    #Rows are ordered by gene, mutation, and score, then by descending fold
+    #change and ascending position
+    score_column = 'Median MT Score' if top_score_metric == 'median' else 'Best MT Score'
+    def key(row):
+        fold_change = str(row['Corresponding Fold Change'])
+        return (
+            row['Gene Name'],
+            row['Mutation'],
+            float(row[score_column]),
+            -float(fold_change) if fold_change.isdigit() else -inf,
+            int(row['Sub-peptide Position']),
+        )
+    return key
+
+def read_rows(input_file):
+    if intermediate_table.is_intermediate(input_file):
+        yield from intermediate_table.read_rows(input_file)
+    else:
+        with bgzip_report.open_report(input_file) as input_file_handle:
+            yield from csv.DictReader(input_file_handle, delimiter='\t')
+
+def checked_rows(input_file, key):
+    #Parsed outputs written by the pipeline are already sorted and are
+    #streamed. Their order is checked while they are merged.
+    previous_key = None
+    for row in read_rows(input_file):
+        row_key = key(row)
+        if previous_key is not None and row_key < previous_key:
+            raise UnsortedInputError(
+                "%s isn't sorted in the order of the combined output. Use --sort-inputs to combine unsorted files." % input_file
+            )
+        previous_key = row_key
+        yield row
+
+def merged_batches(batch_files, key):
+    with ExitStack() as stack:
+        readers = [
+            csv.DictReader(stack.enter_context(open(batch_file, 'r', newline='')), delimiter='\t')
+            for batch_file in batch_files
+        ]
+        yield from heapq.merge(*readers, key=key)
+
+def sorted_rows(input_file, key, batch_directory):
+    #Sorts an input that isn't sorted, e.g. a previous all_epitopes report, in
+    #batches of sort_batch_size rows. The sorted batches are written to
+    #temporary files and merged, so that only one batch is in memory at a time.
+    fieldnames = input_fieldnames(input_file)
+    rows = read_rows(input_file)
+    batch_files = []
+    while True:
+        batch = sorted(itertools.islice(rows, sort_batch_size), key=key)
+        if len(batch) == 0:
+            break
+        batch_file = os.path.join(batch_directory, '%d.tsv' % len(os.listdir(batch_directory)))
+        with open(batch_file, 'w', newline='') as batch_file_handle:
+            writer = csv.DictWriter(batch_file_handle, fieldnames, delimiter='\t', lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(batch)
+        batch_files.append(batch_file)
+    return merged_batches(batch_files, key)
+
+def input_fieldnames(input_file):
+    if intermediate_table.is_intermediate(input_file):
+        return intermediate_table.fieldnames(input_file)
+    with bgzip_report.open_report(input_file) as input_file_handle:
+        return next(csv.reader(input_file_handle, delimiter='\t'), [])
 
 def main(args_input = sys.argv[1:]):
     parser = argparse.ArgumentParser('pvacseq combine_parsed_outputs', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument(
         'input_files',
         nargs="+",
-        help="List of parsed epitope files for different allele-length combinations (same sample)."
+        help="List of parsed epitope files for different allele-length combinations (same sample). "
+             + "Files ending in .arrow are read as Arrow intermediate files."
     )
     parser.add_argument(
-        'output_file', type=argparse.FileType('w'),
-        help="Combined output .tsv file."
+        'output_file',
+        help="Combined output .tsv file. "
+             + "If the file name ends in .gz the output is BGZF compressed, sorted by chromosome and start position and tabix indexed."
     )
     parser.add_argument(
         '--top-score-metric',
@@ -21,55 +110,45 @@ def main(args_input = sys.argv[1:]):
              + "lowest: Use the best MT Score and Corresponding Fold Change (i.e. the lowest MT ic50 binding score and corresponding fold change of all chosen prediction methods). "
              + "median: Use the median MT Score and Median Fold Change (i.e. the median MT ic50 binding score and fold change of all chosen prediction methods).",
     )
+    parser.add_argument(
+        '--sort-inputs',
+        default=False,
+        action='store_true',
+        help="Sort each input file before it is combined. Without this option the input files have to be sorted "
+             + "in the order of the combined output, like the parsed files written by the pipeline.",
+    )
     args = parser.parse_args(args_input)
 
     fieldnames = []
     for input_file in args.input_files:
-        with open(input_file, 'r') as input_file_handle:
-            reader = csv.DictReader(input_file_handle, delimiter='\t')
-            if len(fieldnames) == 0:
-                fieldnames = reader.fieldnames
-            else:
-                for fieldname in reader.fieldnames:
-                    if fieldname not in fieldnames:
-                        fieldnames.append(fieldname)
-
-    rows = []
-    for input_file in args.input_files:
-        with open(input_file, 'r') as input_file_handle:
-            reader = csv.DictReader(input_file_handle, delimiter='\t')
-            for row in reader:
-                for fieldname in fieldnames:
-                    if fieldname not in row:
-                        row[fieldname] = 'NA'
-                rows.append(row)
-
-    sorted_rows = sorted(rows, key=lambda row: (int(row['Sub-peptide Position'])))
-    sorted_rows = sorted(sorted_rows, key=lambda row: (float(row['Corresponding Fold Change']) if row['Corresponding Fold Change'].isdigit() else float('inf')), reverse=True)
-    if args.top_score_metric == 'median':
-        sorted_rows = sorted(
-            sorted_rows,
-            key=lambda row: (
-                row['Gene Name'],
-                row['Mutation'],
-                float(row['Median MT Score']),
-            )
-        )
-    elif args.top_score_metric == 'lowest':
-        sorted_rows = sorted(
-            sorted_rows,
-            key=lambda row: (
-                row['Gene Name'],
-                row['Mutation'],
-                float(row['Best MT Score']),
-            )
-        )
+        for fieldname in input_fieldnames(input_file):
+            if fieldname not in fieldnames:
+                fieldnames.append(fieldname)
 
-    tsv_writer = csv.DictWriter(args.output_file, list(fieldnames), delimiter = '\t', lineterminator = '\n')
-    tsv_writer.writeheader()
-    tsv_writer.writerows(sorted_rows)
+    key = sort_key(args.top_score_metric)
 
-    args.output_file.close()
+    if bgzip_report.is_bgzipped(args.output_file):
+        tsv_output_file = args.output_file + '.tsv'
+    else:
+        tsv_output_file = args.output_file
+    with ExitStack() as stack:
+        if args.sort_inputs:
+            batch_directory = stack.enter_context(tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(tsv_output_file))))
+            sorted_inputs = [sorted_rows(input_file, key, batch_directory) for input_file in args.input_files]
+        else:
+            sorted_inputs = [checked_rows(input_file, key) for input_file in args.input_files]
+        with open(tsv_output_file, 'w') as output_file_handle:
+            tsv_writer = csv.DictWriter(output_file_handle, fieldnames, restval='NA', delimiter = '\t', lineterminator = '\n')
+            tsv_writer.writeheader()
+            #heapq.merge keeps rows with equal keys in the order of the input files
+            try:
+                tsv_writer.writerows(heapq.merge(*sorted_inputs, key=key))
+            except UnsortedInputError as e:
+                output_file_handle.close()
+                os.remove(tsv_output_file)
+                sys.exit(str(e))
+    if tsv_output_file != args.output_file:
+        bgzip_report.compress(tsv_output_file, args.output_file)
 
 if __name__ == "__main__":
     main()
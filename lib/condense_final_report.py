@@ -1,4 +1,7 @@
 import csv
+from lib.filter import Filter
+import lib.parquet_report
+import lib.bgzip_report
 
 class CondenseFinalReport:
     def __init__(self, input_file, output_file, top_score_metric):
@@ -25,8 +28,21 @@ class CondenseFinalReport:
             'Gene Expression',
         ]
 
+    def score_columns(self):
+        if self.top_score_metric == 'median':
+            return ['Median MT Score', 'Median WT Score', 'Median Fold Change']
+        elif self.top_score_metric == 'lowest':
+            return ['Best MT Score', 'Corresponding WT Score', 'Corresponding Fold Change']
+
     def execute(self):
-        with open(self.input_file) as input_fh, open(self.output_file, 'w') as output_fh:
+        if lib.parquet_report.is_parquet(self.input_file):
+            #Only the columns of the condensed report are read
+            header = Filter.read_header(self.input_file)
+            columns = [column for column in self.condensed_header() + self.score_columns() if column in header]
+            data = self.condense_data(Filter.read_report(self.input_file, columns))
+            Filter.write_report(data, self.output_file)
+            return
+        with lib.bgzip_report.open_report(self.input_file) as input_fh, open(self.output_file, 'w') as output_fh:
             reader = csv.DictReader(input_fh, delimiter = "\t")
             writer = csv.DictWriter(output_fh, delimiter = "\t", fieldnames=self.condensed_header(), extrasaction='ignore')
             writer.writeheader()
@@ -41,3 +57,15 @@ class CondenseFinalReport:
                     line['WT IC50'] = line['Corresponding WT Score']
                     line['Fold Change'] = line['Corresponding Fold Change']
                 writer.writerow(line)
+
+    def condense_data(self, data):
+        condensed_data = data.reindex(columns=self.condensed_header())
+        if self.top_score_metric == 'median':
+            condensed_data['MT IC50'] = data['Median MT Score']
+            condensed_data['WT IC50'] = data['Median WT Score']
+            condensed_data['Fold Change'] = data['Median Fold Change']
+        elif self.top_score_metric == 'lowest':
+            condensed_data['MT IC50'] = data['Best MT Score']
+            condensed_data['WT IC50'] = data['Corresponding WT Score']
+            condensed_data['Fold Change'] = data['Corresponding Fold Change']
+        return condensed_data
@@ -7,6 +7,7 @@ from abc import ABCMeta
 from Bio import SeqIO
 import itertools
 from lib.proximal_variant import ProximalVariant
+import lib.intermediate_table
 
 csv.field_size_limit(sys.maxsize)
 
@@ -31,6 +32,12 @@ class FastaGenerator(metaclass=ABCMeta):
         self.downstream_sequence_length = kwargs.pop('downstream_sequence_length', None)
         self.proximal_variants_file     = kwargs.pop('proximal_variants_file', None)
         self.proximal_variants          = self.parse_proximal_variants_file()
+        self.reference_proteome         = kwargs.pop('reference_proteome', None)
+        self.overlapping_epitopes_only  = kwargs.pop('overlapping_epitopes_only', False)
+        #Entries with shorter subsequences are skipped. When the epitopes of
+        #each length are generated separately this is the longest epitope
+        #length so that the same entries are skipped as for a single FASTA.
+        self.minimum_subsequence_length = kwargs.pop('minimum_subsequence_length', self.epitope_length)
 
     def position_out_of_bounds(self, position, sequence):
         return position > len(sequence)-1
@@ -143,10 +150,23 @@ class FastaGenerator(metaclass=ABCMeta):
                 wildtype_subsequence_with_proximal_variants = wildtype_subsequence_with_proximal_variants[:proximal_variant_position] + proximal_variant_mutant_amino_acid + wildtype_subsequence_with_proximal_variants[proximal_variant_position+1:]
         return wildtype_subsequence_with_proximal_variants
 
+    def mutation_overlapping_epitopes(self, wildtype_subsequence, mutant_subsequence):
+        #Only epitopes that differ from the wildtype epitope at the same
+        #position are reported so those are the only ones we need to predict
+        epitopes = []
+        for offset in range(min(len(wildtype_subsequence), len(mutant_subsequence)) - self.epitope_length + 1):
+            wildtype_epitope = wildtype_subsequence[offset:offset + self.epitope_length]
+            mutant_epitope   = mutant_subsequence[offset:offset + self.epitope_length]
+            if wildtype_epitope == mutant_epitope:
+                continue
+            if self.reference_proteome is not None and self.reference_proteome.contains(mutant_epitope):
+                continue
+            epitopes.append((offset, wildtype_epitope, mutant_epitope))
+        return epitopes
+
     def execute(self):
         peptide_sequence_length = self.peptide_sequence_length
-        reader                  = open(self.input_file, 'r')
-        tsvin                   = csv.DictReader(reader, delimiter='\t')
+        tsvin                   = lib.intermediate_table.read_tsv_or_intermediate(self.input_file)
         fasta_sequences         = OrderedDict()
         for line in tsvin:
             variant_type = line['variant_type']
@@ -253,10 +273,24 @@ class FastaGenerator(metaclass=ABCMeta):
                 #This is not a novel peptide
                 continue
 
-            if len(wildtype_subsequence) < self.epitope_length or len(mutant_subsequence) < self.epitope_length:
+            if self.reference_proteome is not None and self.reference_proteome.contains_all_kmers(mutant_subsequence):
+                #All of the mutant epitopes occur elsewhere in the reference proteome
+                continue
+
+            if len(wildtype_subsequence) < self.minimum_subsequence_length or len(mutant_subsequence) < self.minimum_subsequence_length:
                 continue
 
             variant_id = line['index']
+            if self.overlapping_epitopes_only and variant_type == 'missense':
+                #The WT epitopes are matched to the MT epitopes by position so
+                #the offset of each epitope in its subsequence is kept in the key.
+                #Indels and frameshifts are matched using the neighboring
+                #epitopes as well so those still use the full subsequences.
+                for (offset, wildtype_epitope, mutant_epitope) in self.mutation_overlapping_epitopes(wildtype_subsequence, mutant_subsequence):
+                    for designation, epitope in zip(['WT', 'MT'], [wildtype_epitope, mutant_epitope]):
+                        key = '%s.%s|%s' % (designation, variant_id, offset)
+                        fasta_sequences.setdefault(epitope, []).append(key)
+                continue
             for designation, subsequence in zip(['WT', 'MT'], [wildtype_subsequence, mutant_subsequence]):
                 key = '%s.%s' % (designation, variant_id)
                 fasta_sequences.setdefault(subsequence, []).append(key)
@@ -270,15 +304,13 @@ class FastaGenerator(metaclass=ABCMeta):
             yaml.dump({count: keys}, key_writer, default_flow_style=False)
             count += 1
 
-        reader.close()
         writer.close()
         key_writer.close()
 
 class FusionFastaGenerator(FastaGenerator):
     def execute(self):
         peptide_sequence_length = self.peptide_sequence_length
-        reader                  = open(self.input_file, 'r')
-        tsvin                   = csv.DictReader(reader, delimiter='\t')
+        tsvin                   = lib.intermediate_table.read_tsv_or_intermediate(self.input_file)
         fasta_sequences         = OrderedDict()
         for line in tsvin:
             variant_type = line['variant_type']
@@ -321,7 +353,6 @@ class FusionFastaGenerator(FastaGenerator):
             yaml.dump({count: keys}, key_writer, default_flow_style=False)
             count += 1
 
-        reader.close()
         writer.close()
         key_writer.close()
 
@@ -1,32 +1,158 @@
+import operator
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
+import lib.parquet_report
 
 pd.options.mode.chained_assignment = None
 
 class Filter:
-    def __init__(self, input_file, output_file, filter_criteria, exclude_nas, int_filter_columns=[]):
+    #Report columns that are always written as text. They are read as strings
+    #without type inference. The numeric columns are still inferred because
+    #their output formatting, e.g. "200" or "200.0", depends on the parsed type.
+    text_columns = [
+        'Chromosome',
+        'Reference',
+        'Variant',
+        'Transcript',
+        'Ensembl Gene ID',
+        'Variant Type',
+        'Mutation',
+        'Gene Name',
+        'HGVSc',
+        'HGVSp',
+        'HLA Allele',
+        'MT Epitope Seq',
+        'WT Epitope Seq',
+        'Best MT Score Method',
+    ]
+
+    operators = {
+        '<' : operator.lt,
+        '<=': operator.le,
+        '>' : operator.gt,
+        '>=': operator.ge,
+        '==': operator.eq,
+        '!=': operator.ne,
+    }
+
+    def __init__(self, input_file, output_file, filter_criteria, exclude_nas, int_filter_columns=[], chunk_size=None):
         self.input_file = input_file
         self.output_file = output_file
         self.filter_criteria = filter_criteria
         self.exclude_nas = exclude_nas
         self.int_filter_columns = int_filter_columns
+        #If set, the report is processed in batches of this many rows
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def column_types(cls, header):
+        return dict((column, str) for column in header if column in cls.text_columns)
+
+    @classmethod
+    def read_header(cls, input_file):
+        if lib.parquet_report.is_parquet(input_file):
+            return pd.Index(lib.parquet_report.columns(input_file))
+        return pd.read_csv(input_file, delimiter='\t', nrows=0).columns
+
+    @classmethod
+    def read_report(cls, input_file, columns=None, parquet_filter=None):
+        #Parquet reports are already typed. Only the requested columns and
+        #the row groups that can match the parquet_filter are read.
+        if lib.parquet_report.is_parquet(input_file):
+            return lib.parquet_report.read(input_file, columns, parquet_filter)
+        header = pd.read_csv(input_file, delimiter='\t', nrows=0).columns
+        return pd.read_csv(input_file, delimiter='\t', dtype=cls.column_types(header), float_precision='high', low_memory=False)
+
+    @classmethod
+    def chunked_column_types(cls, input_file, chunk_size):
+        #The types the columns would be inferred as if the whole report was
+        #read at once, so that all batches are read and written the same way
+        header = pd.read_csv(input_file, delimiter='\t', nrows=0).columns
+        column_types = cls.column_types(header)
+        kinds = dict((column, set()) for column in header if column not in column_types)
+        if len(kinds) == 0:
+            return column_types
+        for chunk in pd.read_csv(input_file, delimiter='\t', dtype=column_types, usecols=list(kinds.keys()), chunksize=chunk_size):
+            for column in kinds.keys():
+                kinds[column].add(chunk[column].dtype.kind)
+        for (column, column_kinds) in kinds.items():
+            if column_kinds == {'i'}:
+                column_types[column] = 'int64'
+            elif column_kinds == {'b'}:
+                column_types[column] = bool
+            elif column_kinds <= {'i', 'f'}:
+                column_types[column] = float
+            else:
+                column_types[column] = str
+        return column_types
+
+    @classmethod
+    def read_report_chunks(cls, input_file, chunk_size, parquet_filter=None):
+        if lib.parquet_report.is_parquet(input_file):
+            return lib.parquet_report.read_batches(input_file, chunk_size, filter=parquet_filter)
+        column_types = cls.chunked_column_types(input_file, chunk_size)
+        return pd.read_csv(input_file, delimiter='\t', dtype=column_types, float_precision='high', chunksize=chunk_size)
+
+    @classmethod
+    def write_report(cls, data, output_file):
+        if lib.parquet_report.is_parquet(output_file):
+            lib.parquet_report.write(data, output_file)
+        else:
+            data.to_csv(output_file, sep='\t', index=False, na_rep='NA')
 
     def execute(self):
-        data = pd.read_csv(self.input_file, delimiter='\t', float_precision='high', low_memory=False)
-        header = data.columns
-        clean_header = header.map(lambda x: x.replace(' ', '_') if isinstance(x, str) else x)
-        data.columns = clean_header
+        if self.chunk_size is None:
+            data = self.read_report(self.input_file, parquet_filter=self.parquet_filter())
+            data = self.filter_data(data)
+            self.write_report(data, self.output_file)
+        else:
+            if lib.parquet_report.is_parquet(self.output_file):
+                raise Exception("Filtering in chunks only supports writing .tsv output files")
+            header = pd.DataFrame(columns=self.read_header(self.input_file))
+            header.to_csv(self.output_file, sep='\t', index=False)
+            for chunk in self.read_report_chunks(self.input_file, self.chunk_size, self.parquet_filter()):
+                chunk = self.filter_data(chunk)
+                chunk.to_csv(self.output_file, sep='\t', index=False, na_rep='NA', header=False, mode='a')
+
+    @classmethod
+    def clean_column(cls, column):
+        return column.replace(' ', '_') if isinstance(column, str) else column
+
+    def parquet_filter(self):
+        if not lib.parquet_report.is_parquet(self.input_file) or len(self.filter_criteria) == 0:
+            return None
+        columns = dict((self.clean_column(column), column) for column in self.read_header(self.input_file))
+        filter_criteria = [dict(criteria, column=columns[self.clean_column(criteria['column'])]) for criteria in self.filter_criteria]
+        return lib.parquet_report.filter_expression(filter_criteria, self.exclude_nas)
+
+    def mask(self, data):
+        #The criteria may name the columns with underscores instead of spaces
+        columns = dict((self.clean_column(column), column) for column in data.columns)
+        mask = pd.Series(True, index=data.index)
         for criteria in self.filter_criteria:
-            clean_column = criteria['column'].replace(' ', '_')
-#           #clean_column != clean_column is a hacky way to keep all NA values
-            if self.exclude_nas:
-                expression = "(%s %s %s)" % (clean_column, criteria['operator'], criteria['threshold'])
-            else:
-                expression = "(%s %s %s) | (%s != %s)" % (clean_column, criteria['operator'], criteria['threshold'], clean_column, clean_column)
-            data = data.query(expression)
+            values = data[columns[self.clean_column(criteria['column'])]]
+            threshold = criteria['threshold']
+            if isinstance(threshold, str):
+                threshold = pd.to_numeric(threshold)
+            criteria_mask = self.operators[criteria['operator']](values, threshold)
+            if not self.exclude_nas:
+                criteria_mask |= values.isna()
+            mask &= criteria_mask
+        return mask
+
+    def filter_data(self, data):
+        if len(self.filter_criteria) > 0:
+            data = data[self.mask(data)]
+        columns = dict((self.clean_column(column), column) for column in data.columns)
         for column in self.int_filter_columns:
-            clean_column = column.replace(' ', '_')
-            data[clean_column] = data[clean_column].astype(str).apply(trim_fraction)
-        data.to_csv(self.output_file, sep='\t', header=header, index=False, na_rep='NA')
+            column = columns[self.clean_column(column)]
+            data[column] = format_integers(data[column])
+        return data
+
+def format_integers(values):
+    if is_numeric_dtype(values):
+        return values.astype('Int64').astype(str).replace('<NA>', 'NA')
+    return values.astype(str).apply(trim_fraction)
 
 def trim_fraction(text):
     if '.0' in text:
@@ -0,0 +1,108 @@
+import csv
+import sys
+import os
+import hashlib
+from collections import defaultdict
+from lib.output_parser import OutputParser
+import lib.bgzip_report
+
+csv.field_size_limit(sys.maxsize)
+
+class IncrementalRun:
+    #TSV columns that determine the peptide sequences generated for a variant
+    protein_sequence_columns = [
+        'variant_type',
+        'protein_position',
+        'amino_acid_change',
+        'wildtype_amino_acid_sequence',
+        'downstream_amino_acid_sequence',
+    ]
+
+    proximal_variant_columns = [
+        'protein_position',
+        'amino_acid_change',
+        'codon_change',
+        'type',
+    ]
+
+    def __init__(self, **kwargs):
+        self.tsv_file                         = kwargs['tsv_file']
+        self.proximal_variants_file           = kwargs.pop('proximal_variants_file', None)
+        self.previous_tsv_file                = kwargs['previous_tsv_file']
+        self.previous_proximal_variants_file  = kwargs.pop('previous_proximal_variants_file', None)
+        self.previous_all_epitopes_file       = kwargs['previous_all_epitopes_file']
+        self.unchanged_variants               = self.find_unchanged_variants()
+
+    @classmethod
+    def variant_key(cls, chromosome, start, stop, reference, variant, transcript):
+        return (chromosome, start, stop, reference, variant, transcript)
+
+    def parse_proximal_variants_file(self, proximal_variants_file):
+        proximal_variants = defaultdict(list)
+        if proximal_variants_file is not None and os.path.exists(proximal_variants_file):
+            with open(proximal_variants_file, 'r') as fh:
+                for line in csv.DictReader(fh, delimiter='\t'):
+                    proximal_variants[line['main_somatic_variant']].append(
+                        "|".join(line[column] for column in self.proximal_variant_columns)
+                    )
+        return proximal_variants
+
+    def protein_sequence_hash(self, line, proximal_variants):
+        values = [line[column] for column in self.protein_sequence_columns]
+        #The TSV index is not stable between runs so the proximal variants
+        #are hashed by their content instead
+        values.extend(sorted(proximal_variants[line['index']]))
+        return hashlib.sha1("\t".join(values).encode('utf-8')).hexdigest()
+
+    def variant_identities(self, tsv_file, proximal_variants_file):
+        proximal_variants = self.parse_proximal_variants_file(proximal_variants_file)
+        identities = {}
+        ambiguous_keys = set()
+        with open(tsv_file, 'r') as fh:
+            for line in csv.DictReader(fh, delimiter='\t'):
+                key = self.variant_key(line['chromosome_name'], line['start'], line['stop'], line['reference'], line['variant'], line['transcript_name'])
+                if key in identities:
+                    ambiguous_keys.add(key)
+                identities[key] = (self.protein_sequence_hash(line, proximal_variants), line)
+        #Epitopes of the previous run can't be attributed to one of several
+        #entries for the same transcript so those are always predicted again
+        for key in ambiguous_keys:
+            del identities[key]
+        return identities
+
+    def find_unchanged_variants(self):
+        current_identities = self.variant_identities(self.tsv_file, self.proximal_variants_file)
+        previous_identities = self.variant_identities(self.previous_tsv_file, self.previous_proximal_variants_file)
+        unchanged_variants = {}
+        for (key, (protein_sequence_hash, line)) in current_identities.items():
+            if key in previous_identities and previous_identities[key][0] == protein_sequence_hash:
+                unchanged_variants[key] = line
+        return unchanged_variants
+
+    def write_changed_variants(self, output_file):
+        unchanged_variants = self.unchanged_variants
+        with open(self.tsv_file, 'r') as input_fh, open(output_file, 'w') as output_fh:
+            reader = csv.DictReader(input_fh, delimiter='\t')
+            writer = csv.DictWriter(output_fh, delimiter='\t', fieldnames=reader.fieldnames)
+            writer.writeheader()
+            for line in reader:
+                key = self.variant_key(line['chromosome_name'], line['start'], line['stop'], line['reference'], line['variant'], line['transcript_name'])
+                if key not in unchanged_variants:
+                    writer.writerow(line)
+
+    def write_reused_epitopes(self, output_file):
+        unchanged_variants = self.unchanged_variants
+        with lib.bgzip_report.open_report(self.previous_all_epitopes_file) as input_fh, open(output_file, 'w') as output_fh:
+            reader = csv.DictReader(input_fh, delimiter='\t')
+            writer = csv.DictWriter(output_fh, delimiter='\t', fieldnames=reader.fieldnames, lineterminator='\n')
+            writer.writeheader()
+            for row in reader:
+                key = self.variant_key(row['Chromosome'], row['Start'], row['Stop'], row['Reference'], row['Variant'], row['Transcript'])
+                if key not in unchanged_variants:
+                    continue
+                #Coverage, expression and annotations may have changed even
+                #if the protein sequence didn't
+                tsv_entry = unchanged_variants[key]
+                row['Gene Name'] = tsv_entry['gene_name']
+                row.update(OutputParser.tsv_entry_annotations(tsv_entry))
+                writer.writerow(row)
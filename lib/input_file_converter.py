@@ -6,7 +6,7 @@ from abc import ABCMeta
 from collections import OrderedDict
 from lib.csq_parser import CsqParser
 import lib.utils
-from lib.proximal_variant import ProximalVariant
+from lib.proximal_variant import ProximalVariant, SortedVcfWindow
 import lib.utils
 import binascii
 import re
@@ -83,9 +83,11 @@ class VcfConverter(InputFileConverter):
             self.proximal_variants_tsv_fh = open(self.proximal_variants_tsv, 'w')
             self.proximal_variants_writer = csv.DictWriter(self.proximal_variants_tsv_fh, delimiter='\t', fieldnames=['chromosome_name', 'start', 'stop', 'reference', 'variant', 'amino_acid_change', 'codon_change', 'protein_position', 'type', 'main_somatic_variant'])
             self.proximal_variants_writer.writeheader()
-            self.proximal_variant_parser = ProximalVariant(self.proximal_variants_vcf, self.pass_only)
+            #The input VCF is read in sorted order so both VCFs can be swept alongside it
+            self.proximal_variant_parser = ProximalVariant(self.proximal_variants_vcf, self.pass_only, sweep=True)
             self.somatic_vcf_fh = open(self.input_file, mode)
             self.somatic_vcf_reader = vcf.Reader(self.somatic_vcf_fh)
+            self.somatic_vcf_window = SortedVcfWindow(self.somatic_vcf_reader)
         self.reader = open(self.input_file, mode)
         self.vcf_reader = vcf.Reader(self.reader)
         if len(self.vcf_reader.samples) > 1:
@@ -305,8 +307,16 @@ class VcfConverter(InputFileConverter):
 
     def write_proximal_variant_entries(self, entry, alt, transcript_name, index):
         proximal_variants = self.proximal_variant_parser.extract(entry, alt, transcript_name, self.peptide_length)
+        if len(proximal_variants) == 0:
+            return
+        #Look up the somatic variants around all proximal variants at once instead of one fetch per proximal variant
+        somatic_variants = self.somatic_vcf_window.fetch(
+            proximal_variants[0][0].CHROM,
+            min([proximal_variant.POS - 1 for (proximal_variant, csq_entry) in proximal_variants]),
+            max([proximal_variant.POS for (proximal_variant, csq_entry) in proximal_variants]),
+        )
         for (proximal_variant, csq_entry) in proximal_variants:
-            if len(list(self.somatic_vcf_reader.fetch(proximal_variant.CHROM, proximal_variant.POS - 1 , proximal_variant.POS))) > 0:
+            if any(somatic_variant.start < proximal_variant.POS and self.somatic_vcf_window.record_end(somatic_variant) > proximal_variant.POS - 1 for (somatic_variant, cache) in somatic_variants):
                 proximal_variant_type = 'somatic'
             else:
                 proximal_variant_type = 'germline'
@@ -336,12 +346,50 @@ class VcfConverter(InputFileConverter):
         hex_string = string.group(0).replace('%', '')
         return binascii.unhexlify(hex_string).decode('utf-8')
 
+    def decode_hgvs(self, string):
+        if '%' in string:
+            return re.sub(r'%[0-9|A-F][0-9|A-F]', self.decode_hex, string)
+        else:
+            return string
+
+    def sum_gene_fpkms(self, gene_expns):
+        gene_fpkms = {}
+        for gene, gene_expn_entries in gene_expns.items():
+            gene_fpkm = 0
+            for locus, gene_expn_entry in gene_expn_entries.items():
+                gene_fpkm += float(gene_expn_entry['FPKM'])
+            gene_fpkms[gene] = gene_fpkm
+        return gene_fpkms
+
+    def parse_genotype_expressions(self, genotype, tag):
+        #Returns the (position, value) of the last entry for each ID in a
+        #TX or GX genotype field that holds ID|value pairs
+        expressions = {}
+        if tag not in self.vcf_reader.formats or tag not in genotype.data._fields:
+            return expressions
+        values = genotype[tag]
+        if values is None:
+            return expressions
+        if not isinstance(values, list):
+            values = [values]
+        for (position, expression) in enumerate(values):
+            (identifier, value) = expression.split('|')
+            expressions[identifier] = (position, value)
+        return expressions
+
+    def parse_genotype_transcript_expressions(self, genotype):
+        return {transcript: value for (transcript, (position, value)) in self.parse_genotype_expressions(genotype, 'TX').items()}
+
+    def parse_genotype_gene_expressions(self, genotype):
+        return self.parse_genotype_expressions(genotype, 'GX')
+
     def execute(self):
         gene_expns = self.parse_gene_expns_file()
+        gene_fpkms = self.sum_gene_fpkms(gene_expns)
         transcript_expns = self.parse_transcript_expns_file()
         coverage = self.parse_coverage_files()
 
-        indexes = []
+        indexes = set()
         count = 1
         for entry in self.vcf_reader:
             chromosome = entry.CHROM
@@ -362,6 +410,9 @@ class VcfConverter(InputFileConverter):
             if 'CSQ' not in entry.INFO:
                 continue
 
+            genotype_transcript_expressions = self.parse_genotype_transcript_expressions(genotype)
+            genotype_gene_expressions = self.parse_genotype_gene_expressions(genotype)
+
             alleles_dict = self.csq_parser.resolve_alleles(entry)
             for alt in alts:
                 alt = str(alt)
@@ -399,15 +450,15 @@ class VcfConverter(InputFileConverter):
                     if index in indexes:
                         sys.exit("Warning: TSV index already exists: {}".format(index))
                     else:
-                        indexes.append(index)
+                        indexes.add(index)
                         count += 1
 
                     if self.proximal_variants_vcf:
                         self.write_proximal_variant_entries(entry, alt, transcript_name, index)
 
                     ensembl_gene_id = transcript['Gene']
-                    hgvsc = re.sub(r'%[0-9|A-F][0-9|A-F]', self.decode_hex, transcript['HGVSc']) if 'HGVSc' in transcript else 'NA'
-                    hgvsp = re.sub(r'%[0-9|A-F][0-9|A-F]', self.decode_hex, transcript['HGVSp']) if 'HGVSp' in transcript else 'NA'
+                    hgvsc = self.decode_hgvs(transcript['HGVSc']) if 'HGVSc' in transcript else 'NA'
+                    hgvsp = self.decode_hgvs(transcript['HGVSp']) if 'HGVSp' in transcript else 'NA'
                     if 'TSL' in transcript and transcript['TSL'] is not None and transcript['TSL'] != '':
                         tsl = transcript['TSL']
                     else:
@@ -440,40 +491,19 @@ class VcfConverter(InputFileConverter):
                     else:
                         output_row['codon_change'] = 'NA'
 
-                    if transcript_name in transcript_expns.keys():
+                    if transcript_name in transcript_expns:
                         transcript_expn_entry = transcript_expns[transcript_name]
                         output_row['transcript_expression'] = transcript_expn_entry['FPKM']
-                    elif 'TX' in self.vcf_reader.formats:
-                        if 'TX' in genotype.data._asdict():
-                            transcript_expressions = genotype['TX']
-                            if isinstance(transcript_expressions, list):
-                                for transcript_expression in transcript_expressions:
-                                    (transcript, value) = transcript_expression.split('|')
-                                    if transcript == transcript_name:
-                                        output_row['transcript_expression'] = value
-                            elif transcript_expressions is not None:
-                                (transcript, value) = transcript_expressions.split('|')
-                                if transcript == transcript_name:
-                                    output_row['transcript_expression'] = value
-
-                    if ensembl_gene_id in gene_expns.keys():
-                        gene_expn_entries = gene_expns[ensembl_gene_id]
-                        gene_fpkm = 0
-                        for locus, gene_expn_entry in gene_expn_entries.items():
-                            gene_fpkm += float(gene_expn_entry['FPKM'])
-                        output_row['gene_expression'] = gene_fpkm
-                    elif 'GX' in self.vcf_reader.formats:
-                        if 'GX' in genotype.data._asdict():
-                            gene_expressions = genotype['GX']
-                            if isinstance(gene_expressions, list):
-                                for gene_expression in gene_expressions:
-                                    (gene, value) = gene_expression.split('|')
-                                    if ensembl_gene_id == gene or gene_name == gene:
-                                        output_row['gene_expression'] = value
-                            elif gene_expressions is not None:
-                                (gene, value) = gene_expressions.split('|')
-                                if ensembl_gene_id == gene or gene_name == gene:
-                                    output_row['gene_expression'] = value
+                    elif transcript_name in genotype_transcript_expressions:
+                        output_row['transcript_expression'] = genotype_transcript_expressions[transcript_name]
+
+                    if ensembl_gene_id in gene_fpkms:
+                        output_row['gene_expression'] = gene_fpkms[ensembl_gene_id]
+                    else:
+                        #If both the gene ID and the gene name are annotated the one listed last wins
+                        gene_expression_matches = [genotype_gene_expressions[gene] for gene in (ensembl_gene_id, gene_name) if gene in genotype_gene_expressions]
+                        if gene_expression_matches:
+                            output_row['gene_expression'] = max(gene_expression_matches)[1]
 
                     output_row.update(coverage_for_entry)
 
@@ -0,0 +1,97 @@
+import csv
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+intermediate_formats = ['tsv', 'arrow']
+
+#Intermediate tables are uncompressed Arrow IPC files. They are memory
+#mapped when read and the numbers are stored in binary so that they don't
+#need to be parsed again.
+extension = '.arrow'
+batch_size = 10000
+
+def available():
+    return pyarrow is not None
+
+def check_available():
+    if not available():
+        raise Exception("Reading and writing Arrow intermediate files requires pyarrow. Install it with `pip install pvactools[parquet]`.")
+
+def is_intermediate(path):
+    return str(path).endswith(extension)
+
+def column_type(values):
+    #Columns that only hold ints or only hold floats, apart from NA values,
+    #are stored as numbers. All other columns are stored as the text the csv
+    #module would have written for their values.
+    types = set()
+    for value in values:
+        if isinstance(value, str) and value == 'NA':
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return pyarrow.string()
+        types.add(float if isinstance(value, float) else int)
+    if types == {int}:
+        return pyarrow.int64()
+    if types == {float}:
+        return pyarrow.float64()
+    return pyarrow.string()
+
+def write(rows, fieldnames, output_file):
+    check_available()
+    arrays = []
+    for fieldname in fieldnames:
+        values = [row.get(fieldname, '') for row in rows]
+        arrow_type = column_type(values)
+        if arrow_type == pyarrow.string():
+            values = ['' if value is None else str(value) for value in values]
+        else:
+            values = [None if isinstance(value, str) else value for value in values]
+        arrays.append(pyarrow.array(values, type=arrow_type))
+    table = pyarrow.Table.from_arrays(arrays, names=fieldnames)
+    with pyarrow.OSFile(output_file, 'wb') as sink:
+        with pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=batch_size)
+
+def fieldnames(input_file):
+    check_available()
+    with pyarrow.memory_map(input_file) as source:
+        return pyarrow.ipc.open_file(source).schema.names
+
+def read_rows(input_file):
+    #Missing numbers are returned as NA, like they were written
+    check_available()
+    with pyarrow.memory_map(input_file) as source:
+        reader = pyarrow.ipc.open_file(source)
+        names = reader.schema.names
+        numeric = [not pyarrow.types.is_string(field.type) for field in reader.schema]
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            columns = []
+            for (column, is_numeric) in zip(batch.columns, numeric):
+                values = column.to_pylist()
+                if is_numeric:
+                    values = ['NA' if value is None else value for value in values]
+                columns.append(values)
+            for values in zip(*columns):
+                yield dict(zip(names, values))
+
+def read_tsv_or_intermediate(input_file):
+    if is_intermediate(input_file):
+        yield from read_rows(input_file)
+    else:
+        with open(input_file, 'r') as input_file_handle:
+            yield from csv.DictReader(input_file_handle, delimiter='\t')
+
+def tsv_path(intermediate_path):
+    return intermediate_path[:-len(extension)]
+
+def write_tsv(input_file, output_file):
+    #Used to keep a readable copy of an intermediate file for debugging
+    with open(output_file, 'w') as output_file_handle:
+        writer = csv.DictWriter(output_file_handle, fieldnames(input_file), delimiter='\t', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(read_rows(input_file))
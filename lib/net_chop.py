@@ -5,27 +5,128 @@ import csv
 import tempfile
 import re
 import os
+import subprocess
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+try:
+    from lib import bgzip_report
+    from lib.annotation_cache import AnnotationCache
+except ImportError:
+    #Run as a script from within the lib directory
+    import bgzip_report
+    from annotation_cache import AnnotationCache
 import collections
 
-cycle = ['|', '/', '-', '\\']
 methods = ['cterm', '20s']
+url = "http://www.cbs.dtu.dk/cgi-bin/webface2.fcgi"
 
-def split_file(reader, lines=400):
-    from itertools import islice, chain
-    tmp = next(reader)
-    while tmp!="":
-        yield chain([tmp], islice(reader, lines-1))
-        try:
-            tmp = next(reader)
-        except StopIteration:
-            return
+jobid_searcher = re.compile(r'<!-- jobid: [0-9a-fA-F]*? status: (queued|active)')
+result_delimiter = re.compile(r'-{20,}')
+fail_searcher = re.compile(r'(Failed run|Problematic input:)')
+
+class NetChopError(Exception):
+    pass
+
+def unique_peptides(rows):
+    #Each distinct MT epitope sequence is submitted once, in the order it
+    #first occurs in, and its results are shared by all of its rows
+    sequence_ids = collections.OrderedDict()
+    for row in rows:
+        peptide = row['MT Epitope Seq']
+        if peptide not in sequence_ids:
+            sequence_ids[peptide] = ('%010x'%len(sequence_ids))[-10:]
+    return sequence_ids
+
+def cache_key(peptide, method, threshold):
+    return AnnotationCache.key(peptide, method, '%f' % threshold)
+
+def split_peptides(sequence_ids, chunk_size):
+    peptides = list(sequence_ids.items())
+    for start in range(0, len(peptides), chunk_size):
+        yield peptides[start:start+chunk_size]
+
+def parse_results(content):
+    cleavage_results = {}
+    results = [item.strip() for item in result_delimiter.split(content)]
+    for i in range(2, len(results), 4): #examine only the parts we want, skipping all else
+        sequence_name = False
+        cleavage_scores = {}
+        for line in results[i].split('\n'):
+            data = [word for word in line.strip().split(' ') if len(word)]
+            if not sequence_name:
+                sequence_name = data[4]
+            currentPosition = data[0]
+            isCleavage = data[2]
+            if isCleavage != 'S':
+                continue
+            currentScore = float(data[3])
+            cleavage_scores[currentPosition] = currentScore
+        if len(cleavage_scores) == 0:
+            best_cleavage_position = 'NA'
+            best_cleavage_score = 'NA'
+            cleavage_sites = 'NA'
+        else:
+            max_cleavage_score = max(cleavage_scores.items(), key=lambda x: x[1])
+            best_cleavage_position = max_cleavage_score[0]
+            best_cleavage_score = max_cleavage_score[1]
+            sorted_cleavage_scores = collections.OrderedDict(sorted(cleavage_scores.items()))
+            cleavage_sites = ','.join(['%s:%s' % (key, value) for (key, value) in sorted_cleavage_scores.items()])
+        cleavage_results[sequence_name] = {
+            'Best Cleavage Position': best_cleavage_position,
+            'Best Cleavage Score'   : best_cleavage_score,
+            'Cleavage Sites'        : cleavage_sites,
+        }
+    return cleavage_results
+
+def write_fasta(peptides):
+    staging_file = tempfile.NamedTemporaryFile(mode='w+')
+    for (peptide, sequence_id) in peptides:
+        staging_file.write('>'+sequence_id+'\n')
+        staging_file.write(peptide+'\n')
+    staging_file.seek(0)
+    return staging_file
+
+def submit_chunk(peptides, chosen_method, threshold, poll_interval):
+    staging_file = write_fasta(peptides)
+    response = requests.post(
+        url,
+        files={'SEQSUB':(staging_file.name, staging_file, 'text/plain')},
+        data = {
+            'configfile':'/usr/opt/www/pub/CBS/services/NetChop-3.1/NetChop.cf',
+            'SEQPASTE':'',
+            'method':chosen_method,
+            'thresh':'%0f'%threshold
+        }
+    )
+    staging_file.close()
+    while jobid_searcher.search(response.content.decode()):
+        sleep(poll_interval)
+        response = requests.get(response.url)
+    if fail_searcher.search(response.content.decode()):
+        raise NetChopError("NetChop encountered an error during processing")
+    return parse_results(response.content.decode())
+
+def run_chunk(peptides, executable, method, threshold):
+    #The local netchop executable prints the same result tables as the web
+    #server. Like the web server, it picks the method by its index (-v);
+    #its -s option only shortens the output.
+    staging_file = write_fasta(peptides)
+    arguments = [executable, '-v', str(methods.index(method)), '-t', '%f' % threshold, staging_file.name]
+    try:
+        result = subprocess.run(arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    except OSError as e:
+        raise NetChopError("NetChop couldn't be run: %s" % e)
+    finally:
+        staging_file.close()
+    if result.returncode != 0 or fail_searcher.search(result.stdout):
+        raise NetChopError("NetChop encountered an error during processing: %s" % result.stderr.strip())
+    return parse_results(result.stdout)
 
 def main(args_input = sys.argv[1:]):
     parser = argparse.ArgumentParser("pvacseq net_chop", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument(
         'input_file',
-        type=argparse.FileType('r'),
+        type=bgzip_report.open_report,
         help="Input filtered file with predicted epitopes."
     )
     parser.add_argument(
@@ -45,11 +146,41 @@ def main(args_input = sys.argv[1:]):
         help="NetChop prediction threshold.",
         default=0.5
     )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        help="Number of distinct epitope sequences submitted to NetChop in one request.",
+        default=100
+    )
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        help="Number of seconds to wait between checks for the results of a submitted request.",
+        default=10
+    )
+    parser.add_argument(
+        '-t', '--n-threads',
+        type=int,
+        help="Maximum number of requests submitted to NetChop, or of local NetChop processes, at the same time.",
+        default=4
+    )
+    parser.add_argument(
+        '--netchop-executable',
+        help="Path to a local netchop executable. If set, NetChop is run locally instead of on the web server.",
+        default=None
+    )
+    parser.add_argument(
+        '--annotation-cache',
+        help="Path to an SQLite database of previous NetChop predictions. Cached peptides aren't submitted again "
+             + "and new predictions are added to it. The database is created if it doesn't exist.",
+        default=None
+    )
     args = parser.parse_args(args_input)
+    if args.chunk_size < 1:
+        sys.exit("The chunk size must be at least 1")
+    if args.n_threads < 1:
+        sys.exit("The number of threads must be at least 1")
     chosen_method = str(methods.index(args.method))
-    jobid_searcher = re.compile(r'<!-- jobid: [0-9a-fA-F]*? status: (queued|active)')
-    result_delimiter = re.compile(r'-{20,}')
-    fail_searcher = re.compile(r'(Failed run|Problematic input:)')
     reader = csv.DictReader(args.input_file, delimiter='\t')
     writer = csv.DictWriter(
         args.output_file,
@@ -58,78 +189,63 @@ def main(args_input = sys.argv[1:]):
         lineterminator='\n'
     )
     writer.writeheader()
-    x = 0
-    i=1
-    print("Waiting for results from NetChop... |", end='')
+    rows = list(reader)
+    sequence_ids = unique_peptides(rows)
+    cleavage_results = {}
+    cache = None
+    if args.annotation_cache is not None:
+        cache = AnnotationCache(args.annotation_cache, 'net_chop')
+        cached_results = cache.get(cache_key(peptide, args.method, args.threshold) for peptide in sequence_ids)
+        for (peptide, sequence_id) in sequence_ids.items():
+            key = cache_key(peptide, args.method, args.threshold)
+            if key in cached_results:
+                cleavage_results[sequence_id] = cached_results[key]
+        print("Found %d of %d epitope sequences in the NetChop cache" % (len(cleavage_results), len(sequence_ids)))
+    uncached_sequence_ids = collections.OrderedDict(
+        (peptide, sequence_id) for (peptide, sequence_id) in sequence_ids.items() if sequence_id not in cleavage_results
+    )
+    if args.netchop_executable is None:
+        print("Waiting for results from NetChop...")
+        executor = ThreadPoolExecutor(max_workers=args.n_threads)
+        submit = lambda peptides: executor.submit(submit_chunk, peptides, chosen_method, args.threshold, args.poll_interval)
+    else:
+        print("Running NetChop locally...")
+        executor = ProcessPoolExecutor(max_workers=args.n_threads)
+        submit = lambda peptides: executor.submit(run_chunk, peptides, args.netchop_executable, args.method, args.threshold)
     sys.stdout.flush()
-    for chunk in split_file(reader, 100):
-        staging_file = tempfile.NamedTemporaryFile(mode='w+')
-        current_buffer = {}
-        for line in chunk:
-            sequence_id = ('%010x'%x)[-10:]
-            staging_file.write('>'+sequence_id+'\n')
-            staging_file.write(line['MT Epitope Seq']+'\n')
-            current_buffer[sequence_id] = {k:line[k] for k in line}
-            x+=1
-        staging_file.seek(0)
-        response = requests.post(
-            "http://www.cbs.dtu.dk/cgi-bin/webface2.fcgi",
-            files={'SEQSUB':(staging_file.name, staging_file, 'text/plain')},
-            data = {
-                'configfile':'/usr/opt/www/pub/CBS/services/NetChop-3.1/NetChop.cf',
-                'SEQPASTE':'',
-                'method':chosen_method,
-                'thresh':'%0f'%args.threshold
-            }
-        )
-        while jobid_searcher.search(response.content.decode()):
-            for _ in range(10):
-                sys.stdout.write('\b'+cycle[i%4])
-                sys.stdout.flush()
-                sleep(1)
-                i+=1
-            response = requests.get(response.url)
-        mode=0
-        if fail_searcher.search(response.content.decode()):
-            sys.stdout.write('\b\b')
+    with executor:
+        submissions = {
+            submit(peptides): peptides
+            for peptides in split_peptides(uncached_sequence_ids, args.chunk_size)
+        }
+        try:
+            #Each chunk is added to the cache as soon as it's done so that a
+            #failed run doesn't lose the predictions it already received
+            for submission in as_completed(submissions):
+                chunk_results = submission.result()
+                cleavage_results.update(chunk_results)
+                if cache is not None:
+                    cache.update({
+                        cache_key(peptide, args.method, args.threshold): chunk_results[sequence_id]
+                        for (peptide, sequence_id) in submissions[submission]
+                        if sequence_id in chunk_results
+                    })
+        except NetChopError as e:
+            for submission in submissions:
+                submission.cancel()
             print('Failed!')
-            print("NetChop encountered an error during processing")
+            print(str(e))
             sys.exit(1)
-
-        results = [item.strip() for item in result_delimiter.split(response.content.decode())]
-        for i in range(2, len(results), 4): #examine only the parts we want, skipping all else
-            score = -1
-            pos = 0
-            sequence_name = False
-            cleavage_scores = {}
-            for line in results[i].split('\n'):
-                data = [word for word in line.strip().split(' ') if len(word)]
-                if not sequence_name:
-                    sequence_name = data[4]
-                currentPosition = data[0]
-                isCleavage = data[2]
-                if isCleavage is not 'S':
-                    continue
-                currentScore = float(data[3])
-                cleavage_scores[currentPosition] = currentScore
-            if len(cleavage_scores) == 0:
-                best_cleavage_position = 'NA'
-                best_cleavage_score = 'NA'
-                cleavage_sites = 'NA'
-            else:
-                max_cleavage_score = max(cleavage_scores.items(), key=lambda x: x[1])
-                best_cleavage_position = max_cleavage_score[0]
-                best_cleavage_score = max_cleavage_score[1]
-                sorted_cleavage_scores = collections.OrderedDict(sorted(cleavage_scores.items()))
-                cleavage_sites = ','.join(['%s:%s' % (key, value) for (key, value) in sorted_cleavage_scores.items()])
-            line = current_buffer[sequence_name]
-            line.update({
-                'Best Cleavage Position': best_cleavage_position,
-                'Best Cleavage Score'   : best_cleavage_score,
-                'Cleavage Sites'        : cleavage_sites,
-            })
-            writer.writerow(line)
-    sys.stdout.write('\b\b')
+        finally:
+            if cache is not None:
+                cache.close()
+    #Rows are written in their input order. Rows that NetChop didn't return
+    #results for are dropped.
+    for row in rows:
+        sequence_id = sequence_ids[row['MT Epitope Seq']]
+        if sequence_id in cleavage_results:
+            row.update(cleavage_results[sequence_id])
+            writer.writerow(row)
     print("OK")
     args.output_file.close()
     args.input_file.close()
@@ -5,26 +5,128 @@ import csv
 import tempfile
 import re
 import os
+import subprocess
 from time import sleep
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+try:
+    from lib import bgzip_report
+    from lib.annotation_cache import AnnotationCache
+except ImportError:
+    #Run as a script from within the lib directory
+    import bgzip_report
+    from annotation_cache import AnnotationCache
 
-cycle = ['|', '/', '-', '\\']
-methods = ['cterm', '20s']
+url = "http://www.cbs.dtu.dk/cgi-bin/webface2.fcgi"
 
-def split_file(reader, lines=400):
-    from itertools import islice, chain
-    tmp = next(reader)
-    while tmp!="":
-        yield chain([tmp], islice(reader, lines-1))
-        try:
-            tmp = next(reader)
-        except StopIteration:
-            return
+jobid_searcher = re.compile(r'<!-- jobid: [0-9a-fA-F]*? status: (queued|active)')
+fail_searcher = re.compile(r'(Failed run|Problematic input:)')
+allele_searcher = re.compile(r'^(.*?) : Distance to trai?ning data .*? nearest neighbor (.*?)\)$', re.MULTILINE)
+
+class NetMHCStabError(Exception):
+    pass
+
+def parse_predictions(content):
+    #The web server and the local executable print the same prediction
+    #tables. Predictions are keyed by allele and peptide.
+    allele_map = {item[0]:item[1] for item in allele_searcher.findall(content)}
+    predictions = {}
+    for line in content.split('\n'):
+        data = line.split()
+        if len(data) < 7 or not data[0].isdigit():
+            continue
+        predictions[(data[1], data[2])] = {
+            'Predicted Stability':data[4],
+            'Half Life':data[5],
+            'Stability Rank':data[6],
+        }
+    return (predictions, allele_map)
+
+def annotations(predictions, allele_map):
+    #Combines the predictions with the NetMHCstab allele they were made for,
+    #keyed by peptide, allele and peptide length
+    result = {}
+    for ((allele, peptide), prediction) in predictions.items():
+        netmhcstab_allele = allele_map.get(allele.replace('*', '', 1))
+        if netmhcstab_allele is None:
+            continue
+        annotation = dict(prediction)
+        annotation['NetMHCstab allele'] = netmhcstab_allele
+        result[(peptide, allele, len(peptide))] = annotation
+    return result
+
+def row_key(row):
+    return (row['MT Epitope Seq'], row['HLA Allele'], int(row['Peptide Length']))
+
+def submit_chunk(allele, length, peptides, poll_interval):
+    #Each request is for one allele and one peptide length so that the server
+    #only predicts what is needed
+    staging_file = tempfile.NamedTemporaryFile(mode='w+')
+    for (x, peptide) in enumerate(peptides):
+        sequence_id = ('%010x'%x)[-10:]
+        staging_file.write('>'+sequence_id+'\n')
+        staging_file.write(peptide+'\n')
+    staging_file.seek(0)
+    netmhcstab_allele = allele.replace('*', '')
+    response = requests.post(
+        url,
+        files={'SEQSUB':(staging_file.name, staging_file, 'text/plain')},
+        data = {
+            'configfile':'/usr/opt/www/pub/CBS/services/NetMHCstabpan-1.0/NetMHCstabpan.cf',
+            'inp':'0',
+            'len': str(length),
+            'master':'1',
+            'slave0':netmhcstab_allele,
+            'allele':netmhcstab_allele,
+            'thrs':'0.5',
+            'thrw': '2',
+            'incaff': '0',
+            'sort1':'-1',
+            'waff':'0.8',
+            'sort2':'-1'
+        }
+    )
+    staging_file.close()
+    while jobid_searcher.search(response.content.decode()):
+        sleep(poll_interval)
+        response = requests.get(response.url)
+    if fail_searcher.search(response.content.decode()):
+        raise NetMHCStabError("NetMHCStabPan encountered an error during processing")
+    return parse_predictions(response.content.decode())
+
+def group_peptides(rows):
+    #NetMHCStabPan is run for one allele and one peptide length at a time.
+    #Each distinct peptide of a group is predicted once.
+    groups = OrderedDict()
+    for row in rows:
+        group = groups.setdefault((row['HLA Allele'], int(row['Peptide Length'])), OrderedDict())
+        group[row['MT Epitope Seq']] = None
+    return [(allele, length, list(peptides)) for ((allele, length), peptides) in groups.items()]
+
+def run_group(allele, length, peptides, executable):
+    staging_file = tempfile.NamedTemporaryFile(mode='w+')
+    staging_file.write('\n'.join(peptides)+'\n')
+    staging_file.flush()
+    try:
+        result = subprocess.run(
+            [executable, '-a', allele.replace('*', ''), '-l', str(length), '-p', staging_file.name],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+    except OSError as e:
+        raise NetMHCStabError("NetMHCStabPan couldn't be run: %s" % e)
+    finally:
+        staging_file.close()
+    if result.returncode != 0:
+        raise NetMHCStabError("NetMHCStabPan encountered an error during processing: %s" % result.stderr.strip())
+    return parse_predictions(result.stdout)
 
 def main(args_input = sys.argv[1:]):
     parser = argparse.ArgumentParser("pvacseq net_chop", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument(
         'input_file',
-        type=argparse.FileType('r'),
+        type=bgzip_report.open_report,
         help="Input filtered file with predicted epitopes"
     )
     parser.add_argument(
@@ -32,11 +134,26 @@ def main(args_input = sys.argv[1:]):
         type=argparse.FileType('w'),
         help="Output TSV filename for putative neoepitopes"
     )
+    parser.add_argument(
+        '--netmhcstabpan-executable',
+        help="Path to a local netMHCstabpan executable. If set, NetMHCStabPan is run locally instead of on the web server.",
+        default=None
+    )
+    parser.add_argument(
+        '-t', '--n-threads',
+        type=int,
+        help="Number of local NetMHCStabPan processes to run at the same time.",
+        default=4
+    )
+    parser.add_argument(
+        '--annotation-cache',
+        help="Path to an SQLite database of previous NetMHCStabPan predictions. Cached peptides aren't submitted again "
+             + "and new predictions are added to it. The database is created if it doesn't exist.",
+        default=None
+    )
     args = parser.parse_args(args_input)
-    jobid_searcher = re.compile(r'<!-- jobid: [0-9a-fA-F]*? status: (queued|active)')
-    result_delimiter = re.compile(r'-{20,}')
-    fail_searcher = re.compile(r'(Failed run|Problematic input:)')
-    allele_searcher = re.compile(r'^(.*?) : Distance to trai?ning data .*? nearest neighbor (.*?)\)$', re.MULTILINE)
+    if args.n_threads < 1:
+        sys.exit("The number of threads must be at least 1")
     reader = csv.DictReader(args.input_file, delimiter='\t')
     writer = csv.DictWriter(
         args.output_file,
@@ -45,73 +162,56 @@ def main(args_input = sys.argv[1:]):
         lineterminator='\n'
     )
     writer.writeheader()
-    x = 0
-    i=1
-    print("Waiting for results from NetMHCStabPan... |", end='')
-    sys.stdout.flush()
-    for chunk in split_file(reader, 100):
-        peptide_lengths = set()
-        staging_file = tempfile.NamedTemporaryFile(mode='w+')
-        current_buffer = {}
-        alleles_in_chunk = set()
-        for line in chunk:
-            sequence_id = ('%010x'%x)[-10:]
-            staging_file.write('>'+sequence_id+'\n')
-            staging_file.write(line['MT Epitope Seq']+'\n')
-            alleles_in_chunk.add(line['HLA Allele'])
-            peptide_lengths.add(line['Peptide Length'])
-            current_buffer[sequence_id] = {k:line[k] for k in line}
-            x+=1
-        staging_file.seek(0)
-        allele_list = [allele.replace('*', '') for allele in alleles_in_chunk]
-        allele_list.sort()
-        response = requests.post(
-            "http://www.cbs.dtu.dk/cgi-bin/webface2.fcgi",
-            files={'SEQSUB':(staging_file.name, staging_file, 'text/plain')},
-            data = {
-                'configfile':'/usr/opt/www/pub/CBS/services/NetMHCstabpan-1.0/NetMHCstabpan.cf',
-                'inp':'0',
-                'len': ','.join(peptide_lengths),
-                'master':'1',
-                'slave0':allele_list[-1],
-                'allele':','.join(allele_list),
-                'thrs':'0.5',
-                'thrw': '2',
-                'incaff': '0',
-                'sort1':'-1',
-                'waff':'0.8',
-                'sort2':'-1'
-            }
-        )
-        while jobid_searcher.search(response.content.decode()):
-            for _ in range(10):
-                sys.stdout.write('\b'+cycle[i%4])
-                sys.stdout.flush()
-                sleep(1)
-                i+=1
-            response = requests.get(response.url)
-        if fail_searcher.search(response.content.decode()):
-            sys.stdout.write('\b\b')
-            print('Failed!')
-            print("NetMHCStabPan encountered an error during processing")
-            sys.exit(1)
-        pending = []
-        allele_map = {item[0]:item[1] for item in allele_searcher.findall(response.content.decode())}
-        results = [item.strip() for item in result_delimiter.split(response.content.decode())]
-        for i in range(2, len(results), 4): #examine only the parts we want, skipping all else
-            for line in results[i].split('\n'):
-                data = [word for word in line.strip().split(' ') if len(word)]
-                line = current_buffer[data[3]]
-                if data[1] == line['HLA Allele'] and len(data[2]) == int(line['Peptide Length']):
-                    line.update({
-                        'Predicted Stability':data[4],
-                        'Half Life':data[5],
-                        'Stability Rank':data[6],
-                        'NetMHCstab allele':allele_map[line['HLA Allele'].replace('*', '', 1)]
-                    })
-                    pending.append([int(data[3], 16), {k:line[k] for k in line}])
-        writer.writerows([{k:entry[1][k] for k in entry[1]} for entry in sorted(pending, key=lambda x:x[0])])
-    sys.stdout.write('\b\b')
+    rows = list(reader)
+    stability_annotations = {}
+    cache = None
+    if args.annotation_cache is not None:
+        cache = AnnotationCache(args.annotation_cache, 'netmhc_stab')
+        keys = set(row_key(row) for row in rows)
+        cached_annotations = cache.get(AnnotationCache.key(*key) for key in keys)
+        for key in keys:
+            if AnnotationCache.key(*key) in cached_annotations:
+                stability_annotations[key] = cached_annotations[AnnotationCache.key(*key)]
+        print("Found %d of %d epitopes in the NetMHCStabPan cache" % (len(stability_annotations), len(keys)))
+    uncached_rows = [row for row in rows if row_key(row) not in stability_annotations]
+    def add_annotations(predictions, allele_map):
+        #Each chunk is added to the cache as soon as it's done so that a
+        #failed run doesn't lose the predictions it already received
+        new_annotations = annotations(predictions, allele_map)
+        stability_annotations.update(new_annotations)
+        if cache is not None:
+            cache.update({AnnotationCache.key(*key): value for (key, value) in new_annotations.items()})
+    try:
+        if args.netmhcstabpan_executable is None:
+            print("Waiting for results from NetMHCStabPan...")
+            sys.stdout.flush()
+            for (allele, length, peptides) in group_peptides(uncached_rows):
+                for start in range(0, len(peptides), 100):
+                    add_annotations(*submit_chunk(allele, length, peptides[start:start+100], 10))
+        else:
+            print("Running NetMHCStabPan locally...")
+            sys.stdout.flush()
+            with ProcessPoolExecutor(max_workers=args.n_threads) as executor:
+                submissions = [
+                    executor.submit(run_group, allele, length, peptides, args.netmhcstabpan_executable)
+                    for (allele, length, peptides) in group_peptides(uncached_rows)
+                ]
+                for submission in as_completed(submissions):
+                    add_annotations(*submission.result())
+    except NetMHCStabError as e:
+        print('Failed!')
+        print(str(e))
+        sys.exit(1)
+    finally:
+        if cache is not None:
+            cache.close()
+    #Rows are written in their input order. Rows without a prediction for
+    #their allele and epitope are dropped.
+    for line in rows:
+        key = row_key(line)
+        if key in stability_annotations:
+            line.update(stability_annotations[key])
+            writer.writerow(line)
     print("OK")
     args.output_file.close()
     args.input_file.close()
@@ -3,31 +3,146 @@ import csv
 import re
 import operator
 import os
-from math import ceil, inf
-from statistics import median
+from math import ceil, inf, nan, isnan
+import itertools
+from array import array
+import numpy as np
 from lib.prediction_class import *
+from lib.combine_parsed_outputs import sort_key
+import lib.intermediate_table
 import yaml
 
 csv.field_size_limit(sys.maxsize)
 
+class EpitopeResult:
+    #The parsed predictions of one MT epitope. A chunk can have millions of
+    #these so they use slots instead of a dict. Fields that aren't set are 'NA'.
+    __slots__ = (
+        'gene_name',
+        'amino_acid_change',
+        'variant_type',
+        'position',
+        'mutation_position',
+        'mt_scores',
+        'wt_scores',
+        'wt_epitope_seq',
+        'mt_epitope_seq',
+        'wt_epitope_position',
+        'match_direction',
+        'tsv_index',
+        'allele',
+        'peptide_length',
+        'best_mt_score',
+        'corresponding_wt_score',
+        'corresponding_fold_change',
+        'best_mt_score_method',
+        'median_mt_score',
+        'median_wt_score',
+        'median_fold_change',
+    )
+
+    def __init__(self, **kwargs):
+        for field in self.__slots__:
+            setattr(self, field, kwargs.get(field, 'NA'))
+
+class WildtypeResult:
+    __slots__ = ('wt_epitope_seq', 'wt_scores')
+
+    def __init__(self, wt_epitope_seq, wt_scores):
+        self.wt_epitope_seq = wt_epitope_seq
+        self.wt_scores      = wt_scores
+
 class OutputParser(metaclass=ABCMeta):
+    #Columns of the input TSV that are used in the report. The other columns,
+    #e.g. the protein sequences, can be thousands of characters long and are
+    #not loaded.
+    tsv_entry_columns = [
+        'index',
+        'chromosome_name',
+        'start',
+        'stop',
+        'reference',
+        'variant',
+        'gene_name',
+        'transcript_name',
+        'transcript_support_level',
+        'amino_acid_change',
+        'ensembl_gene_id',
+        'hgvsc',
+        'hgvsp',
+        'variant_type',
+        'protein_position',
+        'transcript_expression',
+        'gene_expression',
+        'normal_depth',
+        'normal_vaf',
+        'tdna_depth',
+        'tdna_vaf',
+        'trna_depth',
+        'trna_vaf',
+    ]
+
     def __init__(self, **kwargs):
         self.input_iedb_files        = kwargs['input_iedb_files']
         self.input_tsv_file          = kwargs['input_tsv_file']
         self.key_file                = kwargs['key_file']
         self.output_file             = kwargs['output_file']
         self.sample_name             = kwargs['sample_name']
-
-    def parse_input_tsv_file(self):
-        with open(self.input_tsv_file, 'r') as reader:
-            tsv_reader = csv.DictReader(reader, delimiter='\t')
+        self.reference_proteome      = kwargs.pop('reference_proteome', None)
+        #The entries of the input TSV if they were already loaded with load_tsv_entries
+        self.tsv_entries             = kwargs.pop('tsv_entries', None)
+        #If set, the rows are written in the order combine_parsed_outputs merges them in
+        self.top_score_metric        = kwargs.pop('top_score_metric', None)
+        #Maps input IEDB files predicted from a peptide registry FASTA to the
+        #registry IDs of the sequence numbers in that file
+        self.registry_ids            = kwargs.pop('registry_ids', {})
+        self.methods                 = self.score_methods()
+        #The registry entries of the methods, in report order, with their score columns
+        self.report_methods          = [(PredictionClass.prediction_method(method), self.methods[method]) for method in self.prediction_methods()]
+        #Shared by all epitopes without a score and never modified
+        self.missing_scores          = self.empty_scores()
+
+    def protein_labels(self, input_iedb_file):
+        #The sequences of each IEDB file are numbered from 1. These numbers are
+        #the labels of the key file unless a peptide registry renumbered them.
+        registry_ids = self.registry_ids.get(input_iedb_file)
+        if registry_ids is None:
+            return lambda seq_num: int(seq_num)
+        return lambda seq_num: registry_ids[int(seq_num)]
+
+    @classmethod
+    def load_tsv_entries(cls, input_tsv_file):
+        if lib.intermediate_table.is_intermediate(input_tsv_file):
+            return cls.load_intermediate_tsv_entries(input_tsv_file)
+        with open(input_tsv_file, 'r') as reader:
+            tsv_reader = csv.reader(reader, delimiter='\t')
+            header = next(tsv_reader, [])
+            columns = [column for column in cls.tsv_entry_columns if column in header]
+            column_indexes = [header.index(column) for column in columns]
             tsv_entries = {}
             for line in tsv_reader:
-                if line['index'] in tsv_entries:
+                tsv_entry = dict(zip(columns, (line[i] if i < len(line) else None for i in column_indexes)))
+                if tsv_entry['index'] in tsv_entries:
                     sys.exit('Duplicate TSV indexes')
-                tsv_entries[line['index']] = line
+                tsv_entries[tsv_entry['index']] = tsv_entry
             return tsv_entries
 
+    @classmethod
+    def load_intermediate_tsv_entries(cls, input_tsv_file):
+        columns = [column for column in cls.tsv_entry_columns if column in lib.intermediate_table.fieldnames(input_tsv_file)]
+        tsv_entries = {}
+        for row in lib.intermediate_table.read_rows(input_tsv_file):
+            tsv_entry = {column: row[column] for column in columns}
+            if tsv_entry['index'] in tsv_entries:
+                sys.exit('Duplicate TSV indexes')
+            tsv_entries[tsv_entry['index']] = tsv_entry
+        return tsv_entries
+
+    def parse_input_tsv_file(self):
+        if self.tsv_entries is None:
+            return self.load_tsv_entries(self.input_tsv_file)
+        return self.tsv_entries
+
     def min_match_count(self, peptide_length):
         return ceil(peptide_length / 2)
 
@@ -65,101 +180,101 @@ class OutputParser(metaclass=ABCMeta):
     def match_wildtype_and_mutant_entry_for_missense(self, result, mt_position, wt_results, previous_result):
         #The WT epitope at the same position is the match
         match_position = mt_position
-        mt_epitope_seq = result['mt_epitope_seq']
+        mt_epitope_seq = result.mt_epitope_seq
         wt_result      = wt_results[match_position]
-        wt_epitope_seq = wt_result['wt_epitope_seq']
-        result['wt_epitope_position'] = match_position
+        wt_epitope_seq = wt_result.wt_epitope_seq
+        result.wt_epitope_position = match_position
         total_matches  = self.determine_total_matches(mt_epitope_seq, wt_epitope_seq)
-        if total_matches >= self.min_match_count(int(result['peptide_length'])):
-            result['wt_epitope_seq'] = wt_epitope_seq
-            result['wt_scores']      = wt_result['wt_scores']
+        if total_matches >= self.min_match_count(int(result.peptide_length)):
+            result.wt_epitope_seq = wt_epitope_seq
+            result.wt_scores      = wt_result.wt_scores
         else:
-            result['wt_epitope_seq'] = 'NA'
-            result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
+            result.wt_epitope_seq = 'NA'
+            result.wt_scores      = self.missing_scores
 
         if mt_epitope_seq == wt_epitope_seq:
-            result['mutation_position'] = 'NA'
+            result.mutation_position = 'NA'
         else:
             if previous_result:
-                previous_mutation_position = previous_result['mutation_position']
+                previous_mutation_position = previous_result.mutation_position
                 if previous_mutation_position == 'NA':
-                    result['mutation_position'] = self.find_mutation_position(wt_epitope_seq, mt_epitope_seq)
+                    result.mutation_position = self.find_mutation_position(wt_epitope_seq, mt_epitope_seq)
                 elif previous_mutation_position > 0:
-                    result['mutation_position'] = previous_mutation_position - 1
+                    result.mutation_position = previous_mutation_position - 1
                 else:
-                    result['mutation_position'] = 0
+                    result.mutation_position = 0
             else:
-                result['mutation_position'] = self.find_mutation_position(wt_epitope_seq, mt_epitope_seq)
+                result.mutation_position = self.find_mutation_position(wt_epitope_seq, mt_epitope_seq)
 
     def match_wildtype_and_mutant_entry_for_frameshift(self, result, mt_position, wt_results, previous_result):
         #The WT epitope at the same position is the match
         match_position = mt_position
         #Since the MT sequence is longer than the WT sequence, not all MT epitopes have a match
         if match_position not in wt_results:
-            result['wt_epitope_seq'] = 'NA'
-            result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
-            result['wt_epitope_position'] = 'NA'
-            if previous_result['mutation_position'] == 'NA':
-                result['mutation_position'] = 'NA'
-            elif previous_result['mutation_position'] > 0:
-                result['mutation_position'] = previous_result['mutation_position'] - 1
+            result.wt_epitope_seq = 'NA'
+            result.wt_scores      = self.missing_scores
+            result.wt_epitope_position = 'NA'
+            if previous_result.mutation_position == 'NA':
+                result.mutation_position = 'NA'
+            elif previous_result.mutation_position > 0:
+                result.mutation_position = previous_result.mutation_position - 1
             else:
-                result['mutation_position'] = 0
+                result.mutation_position = 0
             return
 
-        mt_epitope_seq = result['mt_epitope_seq']
+        mt_epitope_seq = result.mt_epitope_seq
         wt_result      = wt_results[match_position]
-        wt_epitope_seq = wt_result['wt_epitope_seq']
+        wt_epitope_seq = wt_result.wt_epitope_seq
         if mt_epitope_seq == wt_epitope_seq:
             #The MT epitope does not overlap the frameshift mutation
-            result['wt_epitope_seq']    = wt_result['wt_epitope_seq']
-            result['wt_scores']         = wt_result['wt_scores']
-            result['mutation_position'] = 'NA'
-            result['wt_epitope_position'] = 'NA'
+            result.wt_epitope_seq    = wt_result.wt_epitope_seq
+            result.wt_scores         = wt_result.wt_scores
+            result.mutation_position = 'NA'
+            result.wt_epitope_position = 'NA'
         else:
             #Determine how many amino acids are the same between the MT epitope and its matching WT epitope
             total_matches = self.determine_total_matches(mt_epitope_seq, wt_epitope_seq)
-            if total_matches >= self.min_match_count(int(result['peptide_length'])):
+            if total_matches >= self.min_match_count(int(result.peptide_length)):
                 #The minimum amino acid match count is met
-                result['wt_epitope_seq'] = wt_result['wt_epitope_seq']
-                result['wt_scores']      = wt_result['wt_scores']
+                result.wt_epitope_seq = wt_result.wt_epitope_seq
+                result.wt_scores      = wt_result.wt_scores
             else:
                 #The minimum amino acid match count is not met
                 #Even though there is a matching WT epitope there are not enough overlapping amino acids
                 #We don't include the matching WT epitope in the output
-                result['wt_epitope_seq'] = 'NA'
-                result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
+                result.wt_epitope_seq = 'NA'
+                result.wt_scores      = self.missing_scores
             mutation_position = self.find_mutation_position(wt_epitope_seq, mt_epitope_seq)
-            if mutation_position == 1 and int(previous_result['mutation_position']) <= 1:
+            if mutation_position == 1 and int(previous_result.mutation_position) <= 1:
                 #The true mutation position is to the left of the current MT eptiope
                 mutation_position = 0
-            result['mutation_position'] = mutation_position
-            result['wt_epitope_position'] = match_position
+            result.mutation_position = mutation_position
+            result.wt_epitope_position = match_position
 
     def match_wildtype_and_mutant_entry_for_inframe_indel(self, result, mt_position, wt_results, previous_result, iedb_results_for_wt_iedb_result_key):
         #If the previous WT epitope was matched "from the right" we can just use that position to infer the mutation position and match direction
-        if previous_result is not None and previous_result['match_direction'] == 'right':
-            best_match_position           = previous_result['wt_epitope_position'] + 1
-            result['wt_epitope_position'] = best_match_position
-            result['match_direction']     = 'right'
-            if previous_result['mutation_position'] > 0:
-                result['mutation_position'] = previous_result['mutation_position'] - 1
+        if previous_result is not None and previous_result.match_direction == 'right':
+            best_match_position           = previous_result.wt_epitope_position + 1
+            result.wt_epitope_position = best_match_position
+            result.match_direction     = 'right'
+            if previous_result.mutation_position > 0:
+                result.mutation_position = previous_result.mutation_position - 1
             else:
-                result['mutation_position'] = 0
+                result.mutation_position = 0
 
             #We need to ensure that the matched WT eptiope has enough overlapping amino acids with the MT epitope
             best_match_wt_result = wt_results[str(best_match_position)]
-            total_matches        = self.determine_total_matches(result['mt_epitope_seq'], best_match_wt_result['wt_epitope_seq'])
-            if total_matches and total_matches >= self.min_match_count(int(result['peptide_length'])):
+            total_matches        = self.determine_total_matches(result.mt_epitope_seq, best_match_wt_result.wt_epitope_seq)
+            if total_matches and total_matches >= self.min_match_count(int(result.peptide_length)):
                 #The minimum amino acid match count is met
-                result['wt_epitope_seq'] = best_match_wt_result['wt_epitope_seq']
-                result['wt_scores']      = best_match_wt_result['wt_scores']
+                result.wt_epitope_seq = best_match_wt_result.wt_epitope_seq
+                result.wt_scores      = best_match_wt_result.wt_scores
             else:
                 #The minimum amino acid match count is not met
                 #Even though there is a matching WT epitope there are not enough overlapping amino acids
                 #We don't include the matching WT epitope in the output
-                result['wt_epitope_seq'] = 'NA'
-                result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
+                result.wt_epitope_seq = 'NA'
+                result.wt_scores      = self.missing_scores
 
             return
 
@@ -169,40 +284,40 @@ class OutputParser(metaclass=ABCMeta):
         #For an inframe insertion the MT sequence is longer than the WT sequence
         #In this case not all MT epitopes might have a baseline match
         if baseline_best_match_position not in wt_results:
-            result['wt_epitope_seq'] = 'NA'
-            result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
+            result.wt_epitope_seq = 'NA'
+            result.wt_scores      = self.missing_scores
             #We then infer the mutation position and match direction from the previous MT epitope
-            result['match_direction']= previous_result['match_direction']
-            if previous_result['mutation_position'] > 0:
-                result['mutation_position'] = previous_result['mutation_position'] - 1
+            result.match_direction= previous_result.match_direction
+            if previous_result.mutation_position > 0:
+                result.mutation_position = previous_result.mutation_position - 1
             else:
-                result['mutation_position'] = 0
+                result.mutation_position = 0
             return
 
-        mt_epitope_seq = result['mt_epitope_seq']
+        mt_epitope_seq = result.mt_epitope_seq
         baseline_best_match_wt_result      = wt_results[baseline_best_match_position]
-        baseline_best_match_wt_epitope_seq = baseline_best_match_wt_result['wt_epitope_seq']
+        baseline_best_match_wt_epitope_seq = baseline_best_match_wt_result.wt_epitope_seq
         #The MT epitope does not overlap the indel mutation
         if baseline_best_match_wt_epitope_seq == mt_epitope_seq:
-            result['wt_epitope_seq']      = baseline_best_match_wt_result['wt_epitope_seq']
-            result['wt_scores']           = baseline_best_match_wt_result['wt_scores']
-            result['wt_epitope_position'] = int(baseline_best_match_position)
-            result['mutation_position']   = 'NA'
-            result['match_direction']     = 'left'
+            result.wt_epitope_seq      = baseline_best_match_wt_result.wt_epitope_seq
+            result.wt_scores           = baseline_best_match_wt_result.wt_scores
+            result.wt_epitope_position = int(baseline_best_match_position)
+            result.mutation_position   = 'NA'
+            result.match_direction     = 'left'
 
         #If there is no previous result or the previous WT epitope was matched "from the left" we start by comparing to the baseline match
-        if previous_result is None or previous_result['match_direction'] == 'left':
+        if previous_result is None or previous_result.match_direction == 'left':
             best_match_count  = self.determine_consecutive_matches_from_left(mt_epitope_seq, baseline_best_match_wt_epitope_seq)
             #The alternate best match candidate "from the right" is inferred from the baseline best match position and the indel length
-            if result['variant_type'] == 'inframe_ins':
+            if result.variant_type == 'inframe_ins':
                 insertion_length              = len(iedb_results_for_wt_iedb_result_key.keys()) - len(wt_results.keys())
                 alternate_best_match_position = int(baseline_best_match_position) - insertion_length
-            elif result['variant_type'] == 'inframe_del':
+            elif result.variant_type == 'inframe_del':
                 deletion_length                 = len(wt_results.keys()) - len(iedb_results_for_wt_iedb_result_key.keys())
                 alternate_best_match_position   = int(baseline_best_match_position) + deletion_length
             if alternate_best_match_position > 0:
                 alternate_best_match_wt_result      = wt_results[str(alternate_best_match_position)]
-                alternate_best_match_wt_epitope_seq = alternate_best_match_wt_result['wt_epitope_seq']
+                alternate_best_match_wt_epitope_seq = alternate_best_match_wt_result.wt_epitope_seq
                 consecutive_matches_from_right      = self.determine_consecutive_matches_from_right(mt_epitope_seq, alternate_best_match_wt_epitope_seq)
                 #We then check if the alternate best match epitope has more matching amino acids than the baseline best match epitope
                 #If it does, we pick it as the best match
@@ -220,40 +335,46 @@ class OutputParser(metaclass=ABCMeta):
                 best_match_wt_result = baseline_best_match_wt_result
 
             #Now that we have found the matching WT epitope we still need to ensure that it has enough overlapping amino acids
-            total_matches = self.determine_total_matches(mt_epitope_seq, best_match_wt_result['wt_epitope_seq'])
-            if total_matches and total_matches >= self.min_match_count(int(result['peptide_length'])):
+            total_matches = self.determine_total_matches(mt_epitope_seq, best_match_wt_result.wt_epitope_seq)
+            if total_matches and total_matches >= self.min_match_count(int(result.peptide_length)):
                 #The minimum amino acid match count is met
-                result['wt_epitope_seq'] = best_match_wt_result['wt_epitope_seq']
-                result['wt_scores']      = best_match_wt_result['wt_scores']
+                result.wt_epitope_seq = best_match_wt_result.wt_epitope_seq
+                result.wt_scores      = best_match_wt_result.wt_scores
             else:
                 #The minimum amino acid match count is not met
                 #Even though there is a matching WT epitope there are not enough overlapping amino acids
                 #We don't include the matching WT epitope in the output
-                result['wt_epitope_seq'] = 'NA'
-                result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
+                result.wt_epitope_seq = 'NA'
+                result.wt_scores      = self.missing_scores
 
-            result['mutation_position']   = self.find_mutation_position(baseline_best_match_wt_epitope_seq, mt_epitope_seq)
-            result['match_direction']     = match_direction
-            result['wt_epitope_position'] = best_match_position
+            result.mutation_position   = self.find_mutation_position(baseline_best_match_wt_epitope_seq, mt_epitope_seq)
+            result.match_direction     = match_direction
+            result.wt_epitope_position = best_match_position
 
     def match_wildtype_and_mutant_entries(self, iedb_results, wt_iedb_results):
-        for key in sorted(iedb_results.keys(), key = lambda x: int(x.split('|')[-1])):
-            result = iedb_results[key]
+        #Group the results by variant once. The epitopes of a variant are
+        #matched in order of their position since each match depends on the
+        #match of the previous epitope.
+        iedb_results_by_wt_iedb_result_key = {}
+        for key, result in iedb_results.items():
             (wt_iedb_result_key, mt_position) = key.split('|', 1)
-            previous_mt_position = str(int(mt_position)-1)
-            previous_key = '|'.join([wt_iedb_result_key, previous_mt_position])
-            if previous_key in iedb_results:
-                previous_result = iedb_results[previous_key]
-            else:
-                previous_result = None
+            iedb_results_by_wt_iedb_result_key.setdefault(wt_iedb_result_key, {})[mt_position] = result
+
+        for (wt_iedb_result_key, iedb_results_for_wt_iedb_result_key) in iedb_results_by_wt_iedb_result_key.items():
             wt_results = wt_iedb_results[wt_iedb_result_key]
-            if result['variant_type'] == 'missense':
-                self.match_wildtype_and_mutant_entry_for_missense(result, mt_position, wt_results, previous_result)
-            elif result['variant_type'] == 'FS':
-                self.match_wildtype_and_mutant_entry_for_frameshift(result, mt_position, wt_results, previous_result)
-            elif result['variant_type'] == 'inframe_ins' or result['variant_type'] == 'inframe_del':
-                iedb_results_for_wt_iedb_result_key = dict([(key,value) for key, value in iedb_results.items() if key.startswith(wt_iedb_result_key)])
-                self.match_wildtype_and_mutant_entry_for_inframe_indel(result, mt_position, wt_results, previous_result, iedb_results_for_wt_iedb_result_key)
+            for mt_position in sorted(iedb_results_for_wt_iedb_result_key.keys(), key=int):
+                result = iedb_results_for_wt_iedb_result_key[mt_position]
+                previous_mt_position = str(int(mt_position)-1)
+                if previous_mt_position in iedb_results_for_wt_iedb_result_key:
+                    previous_result = iedb_results_for_wt_iedb_result_key[previous_mt_position]
+                else:
+                    previous_result = None
+                if result.variant_type == 'missense':
+                    self.match_wildtype_and_mutant_entry_for_missense(result, mt_position, wt_results, previous_result)
+                elif result.variant_type == 'FS':
+                    self.match_wildtype_and_mutant_entry_for_frameshift(result, mt_position, wt_results, previous_result)
+                elif result.variant_type == 'inframe_ins' or result.variant_type == 'inframe_del':
+                    self.match_wildtype_and_mutant_entry_for_inframe_indel(result, mt_position, wt_results, previous_result, iedb_results_for_wt_iedb_result_key)
 
         return iedb_results
 
@@ -261,57 +382,96 @@ class OutputParser(metaclass=ABCMeta):
     def parse_iedb_file(self, tsv_entries):
         pass
 
+    def score_methods(self):
+        #Scores are stored in arrays with one column per method, in the order
+        #the methods first occur in the input files
+        methods = dict.fromkeys(os.path.basename(input_iedb_file).split(".", 2)[1] for input_iedb_file in self.input_iedb_files)
+        return dict((method, column) for (column, method) in enumerate(methods))
+
+    def empty_scores(self):
+        return array('d', [nan]) * len(self.methods)
+
+    def score_matrix(self, iedb_results, score_key):
+        #One row per epitope and one column per method, NaN if there is no score
+        scores = b''.join(getattr(result, score_key) for result in iedb_results.values())
+        return np.frombuffer(scores, dtype=float).reshape(len(iedb_results), len(self.methods))
+
+    @classmethod
+    def best_scores(cls, scores):
+        #The first of the lowest scores of each row
+        columns = np.argmin(np.where(np.isnan(scores), np.inf, scores), axis=1)
+        return (scores[np.arange(len(scores)), columns], columns)
+
+    @classmethod
+    def median_scores(cls, scores):
+        #The median of the scores of each row that aren't NaN, calculated the
+        #same way as statistics.median
+        counts = np.count_nonzero(~np.isnan(scores), axis=1)
+        sorted_scores = np.sort(scores, axis=1)
+        rows = np.arange(len(scores))
+        lower = sorted_scores[rows, np.maximum(counts - 1, 0) // 2]
+        upper = sorted_scores[rows, np.minimum(counts // 2, scores.shape[1] - 1)]
+        return np.where(counts > 0, (lower + upper) / 2, np.nan)
+
+    @classmethod
+    def fold_changes(cls, wt_scores, mt_scores):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(mt_scores == 0, inf, wt_scores / mt_scores)
+
     def add_summary_metrics(self, iedb_results):
-        iedb_results_with_metrics = {}
-        for key, value in iedb_results.items():
-            mt_scores     = value['mt_scores']
-            best_mt_score = sys.maxsize
-            for method, score in mt_scores.items():
-                if score < best_mt_score:
-                    best_mt_score        = score
-                    best_mt_score_method = method
-            value['best_mt_score']          = best_mt_score
-            value['corresponding_wt_score'] = value['wt_scores'][best_mt_score_method]
-            value['best_mt_score_method']   = best_mt_score_method
-            value['median_mt_score']        = median(mt_scores.values())
-            wt_scores_with_value = [score for score in value['wt_scores'].values() if score != 'NA']
-            if not wt_scores_with_value:
-                value['median_wt_score']    = 'NA'
-            else:
-                value['median_wt_score']    = median(wt_scores_with_value)
-            iedb_results_with_metrics[key]  = value
+        if len(iedb_results) == 0:
+            return iedb_results
+        method_names = list(self.methods.keys())
+        mt_scores = self.score_matrix(iedb_results, 'mt_scores')
+        wt_scores = self.score_matrix(iedb_results, 'wt_scores')
+        (best_mt_scores, best_mt_score_columns) = self.best_scores(mt_scores)
+        corresponding_wt_scores = wt_scores[np.arange(len(wt_scores)), best_mt_score_columns]
+        median_mt_scores = self.median_scores(mt_scores)
+        median_wt_scores = self.median_scores(wt_scores)
+        metrics = zip(
+            best_mt_scores.tolist(),
+            best_mt_score_columns.tolist(),
+            corresponding_wt_scores.tolist(),
+            self.fold_changes(corresponding_wt_scores, best_mt_scores).tolist(),
+            median_mt_scores.tolist(),
+            median_wt_scores.tolist(),
+            self.fold_changes(median_wt_scores, median_mt_scores).tolist(),
+        )
+        for (result, (best_mt_score, best_mt_score_column, corresponding_wt_score, corresponding_fold_change, median_mt_score, median_wt_score, median_fold_change)) in zip(iedb_results.values(), metrics):
+            result.best_mt_score             = best_mt_score
+            result.best_mt_score_method      = method_names[best_mt_score_column]
+            result.corresponding_wt_score    = 'NA' if isnan(corresponding_wt_score) else corresponding_wt_score
+            result.corresponding_fold_change = corresponding_fold_change
+            result.median_mt_score           = median_mt_score
+            result.median_wt_score           = 'NA' if isnan(median_wt_score) else median_wt_score
+            result.median_fold_change        = median_fold_change
 
-        return iedb_results_with_metrics
+        return iedb_results
 
     def flatten_iedb_results(self, iedb_results):
-        #transform the iedb_results dictionary into a two-dimensional list
-        flattened_iedb_results = []
-        for value in iedb_results.values():
-            row = []
-            for key in (
-                'gene_name',
-                'amino_acid_change',
-                'position',
-                'mutation_position',
-                'mt_scores',
-                'wt_scores',
-                'wt_epitope_seq',
-                'mt_epitope_seq',
-                'tsv_index',
-                'allele',
-                'peptide_length',
-                'best_mt_score',
-                'corresponding_wt_score',
-                'best_mt_score_method',
-                'median_mt_score',
-                'median_wt_score',
-            ):
-                if key in value.keys():
-                    row.append(value[key])
-                else:
-                    row.append('NA')
-            flattened_iedb_results.append(row)
-        return flattened_iedb_results
+        #transform the iedb_results dictionary into rows, one at a time
+        row = operator.attrgetter(
+            'gene_name',
+            'amino_acid_change',
+            'position',
+            'mutation_position',
+            'mt_scores',
+            'wt_scores',
+            'wt_epitope_seq',
+            'mt_epitope_seq',
+            'tsv_index',
+            'allele',
+            'peptide_length',
+            'best_mt_score',
+            'corresponding_wt_score',
+            'corresponding_fold_change',
+            'best_mt_score_method',
+            'median_mt_score',
+            'median_wt_score',
+            'median_fold_change',
+        )
+        for result in iedb_results.values():
+            yield row(result)
 
     def process_input_iedb_file(self, tsv_entries):
         iedb_results = self.parse_iedb_file(tsv_entries)
@@ -362,32 +522,47 @@ class OutputParser(metaclass=ABCMeta):
 
     def output_headers(self):
         headers = self.base_headers()
-        for method in self.prediction_methods():
-            pretty_method = PredictionClass.prediction_class_name_for_iedb_prediction_method(method)
-            headers.append("%s WT Score" % pretty_method)
-            headers.append("%s MT Score" % pretty_method)
+        for (prediction_method, column) in self.report_methods:
+            headers.append(prediction_method.wt_score_column)
+            headers.append(prediction_method.mt_score_column)
         if self.sample_name:
             headers.append("Sample Name")
 
         return headers
 
-    def prediction_methods(self):
-        methods = set()
-        for input_iedb_file in self.input_iedb_files:
-            (sample, method, remainder) = os.path.basename(input_iedb_file).split(".", 2)
-            methods.add(method)
+    def pretty_prediction_methods(self):
+        return dict((prediction_method.iedb_method, prediction_method.class_name) for (prediction_method, column) in self.report_methods)
 
-        return sorted(list(methods))
+    def prediction_methods(self):
+        return sorted(self.methods)
+
+    @classmethod
+    def tsv_entry_annotations(cls, tsv_entry):
+        #Report columns that are copied from the TSV entry rather than
+        #calculated from the binding predictions
+        annotations = {
+            'Transcript Support Level': tsv_entry['transcript_support_level'],
+            'Ensembl Gene ID'         : tsv_entry['ensembl_gene_id'],
+            'HGVSc'                   : tsv_entry['hgvsc'],
+            'HGVSp'                   : tsv_entry['hgvsp'],
+        }
+        for (tsv_key, row_key) in zip(['gene_expression', 'transcript_expression', 'normal_vaf', 'tdna_vaf', 'trna_vaf'], ['Gene Expression', 'Transcript Expression', 'Normal VAF', 'Tumor DNA VAF', 'Tumor RNA VAF']):
+            if tsv_key in tsv_entry:
+                if tsv_entry[tsv_key] == 'NA':
+                    annotations[row_key] = 'NA'
+                else:
+                    annotations[row_key] = round(float(tsv_entry[tsv_key]), 3)
+        for (tsv_key, row_key) in zip(['normal_depth', 'tdna_depth', 'trna_depth'], ['Normal Depth', 'Tumor DNA Depth', 'Tumor RNA Depth']):
+            if tsv_key in tsv_entry:
+                annotations[row_key] = tsv_entry[tsv_key]
+        return annotations
 
     def execute(self):
         tsv_entries = self.parse_input_tsv_file()
         iedb_results = self.process_input_iedb_file(tsv_entries)
 
-        tmp_output_file = self.output_file + '.tmp'
-        tmp_output_filehandle = open(tmp_output_file, 'w')
-        tsv_writer = csv.DictWriter(tmp_output_filehandle, delimiter='\t', fieldnames=self.output_headers())
-        tsv_writer.writeheader()
-
+        pretty_methods = self.pretty_prediction_methods()
+        rows = []
         for (
             gene_name,
             variant_aa,
@@ -402,27 +577,26 @@ class OutputParser(metaclass=ABCMeta):
             peptide_length,
             best_mt_score,
             corresponding_wt_score,
+            corresponding_fold_change,
             best_mt_score_method,
             median_mt_score,
-            median_wt_score
+            median_wt_score,
+            median_fold_change,
         ) in iedb_results:
             tsv_entry = tsv_entries[tsv_index]
+            if self.reference_proteome is not None and self.reference_proteome.contains(mt_epitope_seq):
+                #This epitope occurs elsewhere in the reference proteome and is not novel
+                continue
             if mt_epitope_seq != wt_epitope_seq:
                 if wt_epitope_seq == 'NA':
                     corresponding_fold_change = 'NA'
-                elif best_mt_score == 0:
-                    corresponding_fold_change = inf
-                    corresponding_wt_score = round(corresponding_wt_score, 3)
                 else:
-                    corresponding_fold_change = round((corresponding_wt_score/best_mt_score), 3)
+                    corresponding_fold_change = round(corresponding_fold_change, 3)
                     corresponding_wt_score = round(corresponding_wt_score, 3)
                 if median_wt_score == 'NA':
                     median_fold_change = 'NA'
-                elif median_mt_score == 0:
-                    median_fold_change = inf
-                    median_wt_score = round(median_wt_score, 3)
                 else:
-                    median_fold_change = round((median_wt_score/median_mt_score), 3)
+                    median_fold_change = round(median_fold_change, 3)
                     median_wt_score = round(median_wt_score, 3)
                 row = {
                     'Chromosome'          : tsv_entry['chromosome_name'],
@@ -431,10 +605,6 @@ class OutputParser(metaclass=ABCMeta):
                     'Reference'           : tsv_entry['reference'],
                     'Variant'             : tsv_entry['variant'],
                     'Transcript'          : tsv_entry['transcript_name'],
-                    'Transcript Support Level': tsv_entry['transcript_support_level'],
-                    'Ensembl Gene ID'     : tsv_entry['ensembl_gene_id'],
-                    'HGVSc'               : tsv_entry['hgvsc'],
-                    'HGVSp'               : tsv_entry['hgvsp'],
                     'Variant Type'        : tsv_entry['variant_type'],
                     'Mutation'            : variant_aa,
                     'Protein Position'    : tsv_entry['protein_position'],
@@ -445,7 +615,7 @@ class OutputParser(metaclass=ABCMeta):
                     'Mutation Position'   : mutation_position,
                     'MT Epitope Seq'      : mt_epitope_seq,
                     'WT Epitope Seq'      : wt_epitope_seq,
-                    'Best MT Score Method': PredictionClass.prediction_class_name_for_iedb_prediction_method(best_mt_score_method),
+                    'Best MT Score Method': pretty_methods[best_mt_score_method],
                     'Best MT Score'       : round(best_mt_score, 3),
                     'Corresponding WT Score'    : corresponding_wt_score,
                     'Corresponding Fold Change' : corresponding_fold_change,
@@ -453,30 +623,27 @@ class OutputParser(metaclass=ABCMeta):
                     'Median WT Score'     : median_wt_score,
                     'Median Fold Change'  : median_fold_change,
                 }
-                for method in self.prediction_methods():
-                    pretty_method = PredictionClass.prediction_class_name_for_iedb_prediction_method(method)
-                    if method in wt_scores:
-                        row["%s WT Score" % pretty_method] = wt_scores[method]
-                    else:
-                        row["%s WT Score" % pretty_method] = 'NA'
-                    if method in mt_scores:
-                        row["%s MT Score" % pretty_method] = mt_scores[method]
-                    else:
-                        row["%s MT Score" % pretty_method] = 'NA'
-                for (tsv_key, row_key) in zip(['gene_expression', 'transcript_expression', 'normal_vaf', 'tdna_vaf', 'trna_vaf'], ['Gene Expression', 'Transcript Expression', 'Normal VAF', 'Tumor DNA VAF', 'Tumor RNA VAF']):
-                    if tsv_key in tsv_entry:
-                        if tsv_entry[tsv_key] == 'NA':
-                            row[row_key] = 'NA'
-                        else:
-                            row[row_key] = round(float(tsv_entry[tsv_key]), 3)
-                for (tsv_key, row_key) in zip(['normal_depth', 'tdna_depth', 'trna_depth'], ['Normal Depth', 'Tumor DNA Depth', 'Tumor RNA Depth']):
-                    if tsv_key in tsv_entry:
-                        row[row_key] = tsv_entry[tsv_key]
+                for (prediction_method, column) in self.report_methods:
+                    row[prediction_method.wt_score_column] = 'NA' if isnan(wt_scores[column]) else wt_scores[column]
+                    row[prediction_method.mt_score_column] = 'NA' if isnan(mt_scores[column]) else mt_scores[column]
+                row.update(self.tsv_entry_annotations(tsv_entry))
                 if self.sample_name:
                     row['Sample Name'] = self.sample_name
-                tsv_writer.writerow(row)
+                rows.append(row)
 
-        tmp_output_filehandle.close()
+        if self.top_score_metric is not None:
+            rows.sort(key=sort_key(self.top_score_metric))
+        self.write_output(rows)
+
+    def write_output(self, rows):
+        tmp_output_file = self.output_file + '.tmp'
+        if lib.intermediate_table.is_intermediate(self.output_file):
+            lib.intermediate_table.write(rows, self.output_headers(), tmp_output_file)
+        else:
+            with open(tmp_output_file, 'w') as tmp_output_filehandle:
+                tsv_writer = csv.DictWriter(tmp_output_filehandle, delimiter='\t', fieldnames=self.output_headers())
+                tsv_writer.writeheader()
+                tsv_writer.writerows(rows)
         os.replace(tmp_output_file, self.output_file)
 
 class DefaultOutputParser(OutputParser):
@@ -489,8 +656,10 @@ class DefaultOutputParser(OutputParser):
             with open(input_iedb_file, 'r') as reader:
                 iedb_tsv_reader = csv.DictReader(reader, delimiter='\t')
                 (sample, method, remainder) = os.path.basename(input_iedb_file).split(".", 2)
+                column = self.methods[method]
+                protein_label_of = self.protein_labels(input_iedb_file)
                 for line in iedb_tsv_reader:
-                    protein_label  = int(line['seq_num'])
+                    protein_label  = protein_label_of(line['seq_num'])
                     if 'core_peptide' in line and int(line['end']) - int(line['start']) == 8:
                         #Start and end refer to the position of the core peptide
                         #Infer the (start) position of the peptide from the positions of the core peptide
@@ -502,40 +671,42 @@ class DefaultOutputParser(OutputParser):
                     allele         = line['allele']
                     peptide_length = len(epitope)
 
+                    if protein_label not in protein_identifiers_from_label:
+                        #Predictions for peptides of other chunks
+                        continue
                     if protein_identifiers_from_label[protein_label] is not None:
                         protein_identifiers = protein_identifiers_from_label[protein_label]
 
                     for protein_identifier in protein_identifiers:
                         (protein_type, tsv_index) = protein_identifier.split('.', 1)
+                        if '|' in tsv_index:
+                            #The epitope was emitted on its own. Its offset in
+                            #the full subsequence is appended to the index.
+                            (tsv_index, offset) = tsv_index.rsplit('|', 1)
+                            epitope_position = str(int(position) + int(offset))
+                        else:
+                            epitope_position = position
                         if protein_type == 'MT':
                             tsv_entry = tsv_entries[tsv_index]
-                            key = "%s|%s" % (tsv_index, position)
+                            key = "%s|%s" % (tsv_index, epitope_position)
                             if key not in iedb_results:
-                                iedb_results[key]                      = {}
-                                iedb_results[key]['mt_scores']         = {}
-                                iedb_results[key]['mt_epitope_seq']    = epitope
-                                iedb_results[key]['gene_name']         = tsv_entry['gene_name']
-                                iedb_results[key]['amino_acid_change'] = tsv_entry['amino_acid_change']
-                                iedb_results[key]['variant_type']      = tsv_entry['variant_type']
-                                iedb_results[key]['position']          = position
-                                iedb_results[key]['tsv_index']         = tsv_index
-                                iedb_results[key]['allele']            = allele
-                                iedb_results[key]['peptide_length']    = peptide_length
-                            iedb_results[key]['mt_scores'][method] = float(score)
-
-                        results = {
-                            'WT': wt_iedb_results,
-                        }
-                        if protein_type == 'MT':
-                            continue
-                        result_set = results[protein_type]
-                        if tsv_index not in result_set:
-                            result_set[tsv_index] = {}
-                        if position not in result_set[tsv_index]:
-                            result_set[tsv_index][position] = {}
-                            result_set[tsv_index][position][protein_type.lower() + '_scores'] = {}
-                        result_set[tsv_index][position][protein_type.lower() + '_epitope_seq'] = epitope
-                        result_set[tsv_index][position][protein_type.lower() + '_scores'][method] = float(score)
+                                iedb_results[key] = EpitopeResult(
+                                    mt_scores         = self.empty_scores(),
+                                    mt_epitope_seq    = epitope,
+                                    gene_name         = tsv_entry['gene_name'],
+                                    amino_acid_change = tsv_entry['amino_acid_change'],
+                                    variant_type      = tsv_entry['variant_type'],
+                                    position          = epitope_position,
+                                    tsv_index         = tsv_index,
+                                    allele            = allele,
+                                    peptide_length    = peptide_length,
+                                )
+                            iedb_results[key].mt_scores[column] = float(score)
+                        elif protein_type == 'WT':
+                            wt_results = wt_iedb_results.setdefault(tsv_index, {})
+                            if epitope_position not in wt_results:
+                                wt_results[epitope_position] = WildtypeResult(epitope, self.empty_scores())
+                            wt_results[epitope_position].wt_scores[column] = float(score)
 
         return self.match_wildtype_and_mutant_entries(iedb_results, wt_iedb_results)
 
@@ -548,8 +719,10 @@ class FusionOutputParser(OutputParser):
             with open(input_iedb_file, 'r') as reader:
                 iedb_tsv_reader = csv.DictReader(reader, delimiter='\t')
                 (sample, method, remainder) = os.path.basename(input_iedb_file).split(".", 2)
+                column = self.methods[method]
+                protein_label_of = self.protein_labels(input_iedb_file)
                 for line in iedb_tsv_reader:
-                    protein_label  = int(line['seq_num'])
+                    protein_label  = protein_label_of(line['seq_num'])
                     if 'core_peptide' in line:
                         position   = str(int(line['start']) - line['peptide'].find(line['core_peptide']))
                     else:
@@ -559,6 +732,9 @@ class FusionOutputParser(OutputParser):
                     allele         = line['allele']
                     peptide_length = len(epitope)
 
+                    if protein_label not in tsv_indices_from_label:
+                        #Predictions for peptides of other chunks
+                        continue
                     if tsv_indices_from_label[protein_label] is not None:
                         tsv_indices = tsv_indices_from_label[protein_label]
 
@@ -566,21 +742,19 @@ class FusionOutputParser(OutputParser):
                         tsv_entry = tsv_entries[tsv_index]
                         key = "%s|%s" % (tsv_index, position)
                         if key not in iedb_results:
-                            iedb_results[key]                      = {}
-                            iedb_results[key]['mt_scores']         = {}
-                            iedb_results[key]['wt_scores']         = {}
-                            iedb_results[key]['mt_epitope_seq']    = epitope
-                            iedb_results[key]['wt_epitope_seq']    = 'NA'
-                            iedb_results[key]['gene_name']         = tsv_entry['gene_name']
-                            iedb_results[key]['amino_acid_change'] = tsv_entry['amino_acid_change']
-                            iedb_results[key]['variant_type']      = tsv_entry['variant_type']
-                            iedb_results[key]['position']          = position
-                            iedb_results[key]['tsv_index']         = tsv_index
-                            iedb_results[key]['allele']            = allele
-                            iedb_results[key]['peptide_length']    = peptide_length
-                            iedb_results[key]['mutation_position'] = 'NA'
-                        iedb_results[key]['mt_scores'][method] = float(score)
-                        iedb_results[key]['wt_scores'][method] = 'NA'
+                            iedb_results[key] = EpitopeResult(
+                                mt_scores         = self.empty_scores(),
+                                wt_scores         = self.missing_scores,
+                                mt_epitope_seq    = epitope,
+                                gene_name         = tsv_entry['gene_name'],
+                                amino_acid_change = tsv_entry['amino_acid_change'],
+                                variant_type      = tsv_entry['variant_type'],
+                                position          = position,
+                                tsv_index         = tsv_index,
+                                allele            = allele,
+                                peptide_length    = peptide_length,
+                            )
+                        iedb_results[key].mt_scores[column] = float(score)
 
         return iedb_results
 
@@ -593,8 +767,10 @@ class VectorOutputParser(OutputParser):
             with open(input_iedb_file, 'r') as reader:
                 iedb_tsv_reader = csv.DictReader(reader, delimiter='\t')
                 (sample, method, remainder) = os.path.basename(input_iedb_file).split(".", 2)
+                column = self.methods[method]
+                protein_label_of = self.protein_labels(input_iedb_file)
                 for line in iedb_tsv_reader:
-                    protein_label  = int(line['seq_num'])
+                    protein_label  = protein_label_of(line['seq_num'])
                     if 'core_peptide' in line:
                         position   = str(int(line['start']) - line['peptide'].find(line['core_peptide']))
                     else:
@@ -610,43 +786,47 @@ class VectorOutputParser(OutputParser):
                     for index in tsv_indices:
                         key = '|'.join([index, position])
                         if key not in iedb_results:
-                            iedb_results[key]                      = {}
-                            iedb_results[key]['mt_scores']         = {}
-                            iedb_results[key]['mt_epitope_seq']    = epitope
-                            iedb_results[key]['position']          = position
-                            iedb_results[key]['tsv_index']         = index
-                            iedb_results[key]['allele']            = allele
-                        iedb_results[key]['mt_scores'][method] = float(score)
+                            iedb_results[key] = EpitopeResult(
+                                mt_scores      = self.empty_scores(),
+                                mt_epitope_seq = epitope,
+                                position       = position,
+                                tsv_index      = index,
+                                allele         = allele,
+                            )
+                        iedb_results[key].mt_scores[column] = float(score)
         return iedb_results
 
     def add_summary_metrics(self, iedb_results):
-        iedb_results_with_metrics = {}
-        for key, value in iedb_results.items():
-            mt_scores     = value['mt_scores']
-            best_mt_score = sys.maxsize
-            for method, score in mt_scores.items():
-                if score < best_mt_score:
-                    best_mt_score        = score
-                    best_mt_score_method = method
-            value['best_mt_score']          = best_mt_score
-            value['best_mt_score_method']   = best_mt_score_method
-            value['median_mt_score']        = median(mt_scores.values())
-            iedb_results_with_metrics[key]  = value
-        return iedb_results_with_metrics
+        if len(iedb_results) == 0:
+            return iedb_results
+        method_names = list(self.methods.keys())
+        mt_scores = self.score_matrix(iedb_results, 'mt_scores')
+        (best_mt_scores, best_mt_score_columns) = self.best_scores(mt_scores)
+        metrics = zip(
+            best_mt_scores.tolist(),
+            best_mt_score_columns.tolist(),
+            self.median_scores(mt_scores).tolist(),
+        )
+        for (result, (best_mt_score, best_mt_score_column, median_mt_score)) in zip(iedb_results.values(), metrics):
+            result.best_mt_score        = best_mt_score
+            result.best_mt_score_method = method_names[best_mt_score_column]
+            result.median_mt_score      = median_mt_score
+        return iedb_results
 
     def flatten_iedb_results(self, iedb_results):
-        #transform the iedb_results dictionary into a two-dimensional list
-        flattened_iedb_results = list((
-            value['position'],
-            value['mt_scores'],
-            value['mt_epitope_seq'],
-            value['tsv_index'],
-            value['allele'],
-            value['best_mt_score'],
-            value['best_mt_score_method'],
-            value['median_mt_score'],
-        ) for value in iedb_results.values())
-        return flattened_iedb_results
+        #transform the iedb_results dictionary into rows, one at a time
+        row = operator.attrgetter(
+            'position',
+            'mt_scores',
+            'mt_epitope_seq',
+            'tsv_index',
+            'allele',
+            'best_mt_score',
+            'best_mt_score_method',
+            'median_mt_score',
+        )
+        for result in iedb_results.values():
+            yield row(result)
 
     def process_input_iedb_file(self):
         iedb_results              = self.parse_iedb_file()
@@ -672,6 +852,7 @@ class VectorOutputParser(OutputParser):
         tsv_writer.writeheader()
 
         iedb_results = self.process_input_iedb_file()
+        pretty_methods = self.pretty_prediction_methods()
         for (
             position,
             mt_scores,
@@ -686,17 +867,13 @@ class VectorOutputParser(OutputParser):
                 'HLA Allele'          : allele,
                 'Sub-peptide Position': position,
                 'MT Epitope Seq'      : mt_epitope_seq,
-                'Best MT Score Method': PredictionClass.prediction_class_name_for_iedb_prediction_method(best_mt_score_method),
+                'Best MT Score Method': pretty_methods[best_mt_score_method],
                 'Best MT Score'       : best_mt_score,
                 'Median MT Score'     : median_mt_score,
                 'Index'               : tsv_index,
             }
-            for method in self.prediction_methods():
-                pretty_method = PredictionClass.prediction_class_name_for_iedb_prediction_method(method)
-                if method in mt_scores:
-                    row["%s MT Score" % pretty_method] = mt_scores[method]
-                else:
-                    row["%s MT Score" % pretty_method] = 'NA'
+            for (prediction_method, column) in self.report_methods:
+                row[prediction_method.mt_score_column] = 'NA' if isnan(mt_scores[column]) else mt_scores[column]
             tsv_writer.writerow(row)
 
         tmp_output_filehandle.close()
@@ -0,0 +1,78 @@
+import os
+import operator
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+output_formats = ['tsv', 'parquet']
+
+#The reports keep their row order so that filtering a parquet report gives
+#the same output as filtering the TSV report. Row groups are skipped based on
+#the statistics of the filtered columns.
+row_group_size = 100000
+compression = 'zstd'
+
+expression_operators = {
+    '<' : operator.lt,
+    '<=': operator.le,
+    '>' : operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+def available():
+    return pyarrow is not None
+
+def check_available():
+    if not available():
+        raise Exception("Reading and writing Parquet reports requires pyarrow. Install it with `pip install pvactools[parquet]`.")
+
+def is_parquet(path):
+    return str(path).endswith('.parquet')
+
+def parquet_path(tsv_path):
+    (base, extension) = os.path.splitext(tsv_path)
+    return base + '.parquet'
+
+def write(data, output_file):
+    check_available()
+    table = pyarrow.Table.from_pandas(data, preserve_index=False)
+    pyarrow.parquet.write_table(table, output_file, row_group_size=row_group_size, compression=compression)
+
+def columns(input_file):
+    check_available()
+    return pyarrow.parquet.read_schema(input_file).names
+
+def filter_expression(filter_criteria, exclude_nas):
+    #The row groups whose statistics can't match the criteria are skipped
+    #without being read. Null values pass unless exclude_nas is set.
+    expression = None
+    for criteria in filter_criteria:
+        field = pyarrow.dataset.field(criteria['column'])
+        threshold = criteria['threshold']
+        if isinstance(threshold, str):
+            threshold = float(threshold)
+        criteria_expression = expression_operators[criteria['operator']](field, threshold)
+        if not exclude_nas:
+            criteria_expression = criteria_expression | field.is_null()
+        if expression is None:
+            expression = criteria_expression
+        else:
+            expression = expression & criteria_expression
+    return expression
+
+def read(input_file, columns=None, filter=None):
+    check_available()
+    dataset = pyarrow.dataset.dataset(input_file, format='parquet')
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+def read_batches(input_file, batch_size, columns=None, filter=None):
+    check_available()
+    dataset = pyarrow.dataset.dataset(input_file, format='parquet')
+    for batch in dataset.to_batches(columns=columns, filter=filter, batch_size=batch_size):
+        if batch.num_rows > 0:
+            yield batch.to_pandas()
@@ -0,0 +1,72 @@
+import yaml
+from Bio import SeqIO
+
+class PeptideRegistry:
+    #The FASTA generator only removes duplicate peptides within one chunk. The
+    #registry assigns each unique peptide of the run one ID so that every
+    #peptide only gets predicted once, in the first chunk it occurs in.
+    #The key file of each chunk maps the IDs of its peptides to their
+    #identifiers and the sources file lists the chunks whose predictions
+    #contain those peptides.
+    #The prediction tools number the sequences of each submitted file from 1,
+    #so the unique FASTA of each chunk is numbered from 1 as well and its IDs
+    #file maps these numbers back to the IDs of the run.
+    def __init__(self, split_fasta_files):
+        #A list of (fasta_chunk, split_fasta_file) tuples in chunk order
+        self.split_fasta_files = split_fasta_files
+
+    @classmethod
+    def unique_fasta_file_path(cls, split_fasta_file):
+        return split_fasta_file + '.unique'
+
+    @classmethod
+    def key_file_path(cls, split_fasta_file):
+        return split_fasta_file + '.unique.key'
+
+    @classmethod
+    def ids_file_path(cls, split_fasta_file):
+        return split_fasta_file + '.unique.ids'
+
+    @classmethod
+    def ids(cls, split_fasta_file):
+        with open(cls.ids_file_path(split_fasta_file), 'r') as ids_reader:
+            return yaml.load(ids_reader)
+
+    @classmethod
+    def sources_file_path(cls, split_fasta_file):
+        return split_fasta_file + '.unique.sources'
+
+    @classmethod
+    def sources(cls, split_fasta_file):
+        with open(cls.sources_file_path(split_fasta_file), 'r') as sources_reader:
+            return yaml.load(sources_reader)
+
+    def execute(self):
+        peptide_ids = {}
+        peptide_sources = []
+        for (fasta_chunk, split_fasta_file) in self.split_fasta_files:
+            with open(split_fasta_file + '.key', 'r') as key_reader:
+                keys = yaml.load(key_reader)
+            unique_keys = {}
+            unique_ids = {}
+            sources = []
+            with open(self.unique_fasta_file_path(split_fasta_file), 'w') as writer:
+                for record in SeqIO.parse(split_fasta_file, 'fasta'):
+                    peptide = str(record.seq)
+                    if peptide not in peptide_ids:
+                        peptide_ids[peptide] = len(peptide_ids) + 1
+                        peptide_sources.append(fasta_chunk)
+                        unique_ids[len(unique_ids) + 1] = peptide_ids[peptide]
+                        writer.writelines('>%s\n' % len(unique_ids))
+                        writer.writelines('%s\n' % peptide)
+                    peptide_id = peptide_ids[peptide]
+                    unique_keys[peptide_id] = keys[int(record.id)]
+                    source = peptide_sources[peptide_id - 1]
+                    if source not in sources:
+                        sources.append(source)
+            with open(self.key_file_path(split_fasta_file), 'w') as key_writer:
+                yaml.dump(unique_keys, key_writer, default_flow_style=False)
+            with open(self.ids_file_path(split_fasta_file), 'w') as ids_writer:
+                yaml.dump(unique_ids, ids_writer, default_flow_style=False)
+            with open(self.sources_file_path(split_fasta_file), 'w') as sources_writer:
+                yaml.dump(sources, sources_writer, default_flow_style=False)
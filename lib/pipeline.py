@@ -4,6 +4,7 @@ import os
 import csv
 import datetime
 import time
+import itertools
 
 try:
     from .. import lib
@@ -14,6 +15,10 @@ from lib.input_file_converter import *
 from lib.fasta_generator import *
 from lib.output_parser import *
 from lib.post_processor import *
+from lib.pre_prediction_filter import *
+from lib.incremental_run import *
+from lib.reference_proteome import *
+from lib.peptide_registry import *
 import shutil
 import yaml
 import pkg_resources
@@ -30,6 +35,63 @@ def status_message_with_lock(msg, lock):
     lock.release()
 
 class Pipeline(metaclass=ABCMeta):
+    #Inputs that change the epitopes predicted for a given variant. Results of
+    #a previous run can only be reused if none of these differ.
+    prediction_parameters = [
+        'alleles',
+        'prediction_algorithms',
+        'peptide_sequence_length',
+        'epitope_lengths',
+        'downstream_sequence_length',
+        'additional_report_columns',
+        'reference_proteome_fasta',
+    ]
+
+    #Inputs that are only used after the binding predictions have been
+    #combined. A restart that only changes these reuses the all_epitopes
+    #report and only reruns the post-processing.
+    post_processing_parameters = [
+        'top_score_metric',
+        'binding_threshold',
+        'allele_specific_binding_thresholds',
+        'minimum_fold_change',
+        'normal_cov',
+        'normal_vaf',
+        'tdna_cov',
+        'tdna_vaf',
+        'trna_cov',
+        'trna_vaf',
+        'expn_val',
+        'maximum_transcript_support_level',
+        'exclude_NAs',
+        'net_chop_method',
+        'net_chop_threshold',
+        'netmhc_stab',
+        'netchop_executable',
+        'netmhcstabpan_executable',
+        'annotation_cache',
+        'keep_tmp_files',
+        'n_threads',
+        'output_format',
+        'intermediate_format',
+        'bgzip_reports',
+    ]
+
+    #Post-processing inputs that are also used by the early filter. With
+    #--early-filter they decide which variants are predicted, so a restart
+    #can't reuse the all_epitopes report if they change.
+    pre_prediction_filter_parameters = [
+        'normal_cov',
+        'normal_vaf',
+        'tdna_cov',
+        'tdna_vaf',
+        'trna_cov',
+        'trna_vaf',
+        'expn_val',
+        'maximum_transcript_support_level',
+        'exclude_NAs',
+    ]
+
     def __init__(self, **kwargs):
         self.input_file                  = kwargs['input_file']
         self.input_file_type             = kwargs['input_file_type']
@@ -52,6 +114,9 @@ class Pipeline(metaclass=ABCMeta):
         self.net_chop_method             = kwargs.pop('net_chop_method', None)
         self.net_chop_threshold          = kwargs.pop('net_chop_threshold', 0.5)
         self.netmhc_stab                 = kwargs.pop('netmhc_stab', False)
+        self.netchop_executable          = kwargs.pop('netchop_executable', None)
+        self.netmhcstabpan_executable    = kwargs.pop('netmhcstabpan_executable', None)
+        self.annotation_cache            = kwargs.pop('annotation_cache', None)
         self.top_score_metric            = kwargs.pop('top_score_metric', 'median')
         self.binding_threshold           = kwargs.pop('binding_threshold', 500)
         self.allele_specific_binding_thresholds = kwargs.pop('allele_specific_cutoffs', False)
@@ -71,9 +136,17 @@ class Pipeline(metaclass=ABCMeta):
         self.keep_tmp_files              = kwargs.pop('keep_tmp_files', False)
         self.exclude_NAs                 = kwargs.pop('exclude_NAs', False)
         self.pass_only                   = kwargs.pop('pass_only', False)
+        self.early_filter                = kwargs.pop('early_filter', False)
+        self.best_transcript_only        = kwargs.pop('best_transcript_only', False)
+        self.previous_run_dir            = kwargs.pop('previous_run_dir', None)
+        self.reference_proteome_fasta    = kwargs.pop('reference_proteome_fasta', None)
+        self.overlapping_epitopes_only   = kwargs.pop('overlapping_epitopes_only', False)
         self.normal_sample_name          = kwargs.pop('normal_sample_name', False)
         self.n_threads                   = kwargs.pop('n_threads', 1)
         self.spacers                     = kwargs.pop('spacers', None)
+        self.output_format               = kwargs.pop('output_format', 'tsv')
+        self.intermediate_format         = kwargs.pop('intermediate_format', 'tsv')
+        self.bgzip_reports               = kwargs.pop('bgzip_reports', False)
         self.proximal_variants_file      = None
         tmp_dir = os.path.join(self.output_dir, 'tmp')
         os.makedirs(tmp_dir, exist_ok=True)
@@ -84,8 +157,16 @@ class Pipeline(metaclass=ABCMeta):
         os.makedirs(dir, exist_ok=True)
         return dir
 
+    def restartable_parameters(self):
+        #The inputs a restart may change. early_filter and best_transcript_only
+        #themselves are never in this list.
+        if self.pre_prediction_filtering_enabled() and self.early_filter:
+            return [key for key in self.post_processing_parameters if key not in self.pre_prediction_filter_parameters]
+        return self.post_processing_parameters
+
     def print_log(self):
         log_file = os.path.join(self.log_dir(), 'inputs.yml')
+        changed_post_processing_inputs = []
         if os.path.exists(log_file):
             with open(log_file, 'r') as log_fh:
                 past_inputs = yaml.load(log_fh)
@@ -97,35 +178,64 @@ class Pipeline(metaclass=ABCMeta):
                         "Past version: %s\n" % past_inputs['pvactools_version'] +
                         "Current version: %s" % current_inputs['pvactools_version']
                     )
+                restartable_parameters = self.restartable_parameters()
                 for key in current_inputs.keys():
                     if key == 'pvactools_version' or key == 'pvacseq_version':
                         continue
-                    if key not in past_inputs.keys() and current_inputs[key] is not None:
+                    if key in restartable_parameters:
+                        if current_inputs[key] != past_inputs.get(key):
+                            changed_post_processing_inputs.append(key)
+                    elif key not in past_inputs.keys() and current_inputs[key] is not None:
                         sys.exit(
                             "Restart inputs are different from past inputs: \n" +
                             "Additional input: %s - %s\n" % (key, current_inputs[key]) +
                             "Aborting."
                         )
-                    elif current_inputs[key] != past_inputs[key]:
+                    elif current_inputs[key] != past_inputs.get(key):
                         sys.exit(
                             "Restart inputs are different from past inputs: \n" +
-                            "Past input: %s - %s\n" % (key, past_inputs[key]) +
+                            "Past input: %s - %s\n" % (key, past_inputs.get(key)) +
                             "Current input: %s - %s\n" % (key, current_inputs[key]) +
                             "Aborting."
                         )
+            if len(changed_post_processing_inputs) > 0:
+                status_message(
+                    "Restart to be executed with different post-processing inputs:\n" +
+                    "\n".join(["%s - Past: %s, Current: %s" % (key, past_inputs.get(key), current_inputs[key]) for key in changed_post_processing_inputs])
+                )
+                with open(log_file, 'w') as log_fh:
+                    yaml.dump(current_inputs, log_fh, default_flow_style=False)
         else:
             with open(log_file, 'w') as log_fh:
                 inputs = self.__dict__
                 inputs['pvactools_version'] = pkg_resources.get_distribution("pvactools").version
                 yaml.dump(inputs, log_fh, default_flow_style=False)
+        return changed_post_processing_inputs
 
-    def tsv_file_path(self):
+    def converted_tsv_file_path(self):
         if self.input_file_type == 'pvacvector_input_fasta':
             return self.input_file
         else:
             tsv_file = self.sample_name + '.tsv'
             return os.path.join(self.output_dir, tsv_file)
 
+    def pre_prediction_filtering_enabled(self):
+        return self.input_file_type == 'vcf' and (self.early_filter or self.best_transcript_only)
+
+    def candidate_tsv_file_path(self):
+        if self.pre_prediction_filtering_enabled():
+            tsv_file = self.sample_name + '.prefiltered.tsv'
+            return os.path.join(self.output_dir, tsv_file)
+        else:
+            return self.converted_tsv_file_path()
+
+    def tsv_file_path(self):
+        if self.previous_run_dir is not None:
+            tsv_file = self.sample_name + '.changed_variants.tsv'
+            return os.path.join(self.output_dir, tsv_file)
+        else:
+            return self.candidate_tsv_file_path()
+
     def converter(self, params):
         converter_types = {
             'vcf'  : 'VcfConverter',
@@ -155,15 +265,43 @@ class Pipeline(metaclass=ABCMeta):
         parser = getattr(sys.modules[__name__], parser_type)
         return parser(**params)
 
+    def split_tsv_entries(self, tsv_chunk):
+        #The variant table of a chunk is loaded once and shared by the parsers
+        #of all alleles and epitope lengths of the chunk
+        if self.input_file_type == 'pvacvector_input_fasta':
+            return None
+        return OutputParser.load_tsv_entries(self.split_tsv_file_path(tsv_chunk))
+
+    def intermediate_tables_enabled(self):
+        return self.intermediate_format == 'arrow' and self.input_file_type != 'pvacvector_input_fasta'
+
+    def intermediate_extension(self):
+        if self.intermediate_tables_enabled():
+            return lib.intermediate_table.extension
+        return ''
+
+    def split_tsv_file_path(self, tsv_chunk):
+        return "%s_%s%s" % (self.tsv_file_path(), tsv_chunk, self.intermediate_extension())
+
+    def split_parsed_file_path(self, allele, epitope_length, fasta_chunk):
+        split_parsed_file = ".".join([self.sample_name, allele, str(epitope_length), "parsed", "tsv_%s" % fasta_chunk])
+        return os.path.join(self.tmp_dir, split_parsed_file + self.intermediate_extension())
+
+    def write_intermediate_tsv_copy(self, intermediate_file):
+        #The Arrow intermediates aren't human readable so a TSV copy of each
+        #is kept for debugging
+        if self.keep_tmp_files and lib.intermediate_table.is_intermediate(intermediate_file):
+            lib.intermediate_table.write_tsv(intermediate_file, lib.intermediate_table.tsv_path(intermediate_file))
+
     def convert_vcf(self):
         status_message("Converting .%s to TSV" % self.input_file_type)
-        if os.path.exists(self.tsv_file_path()):
+        if os.path.exists(self.converted_tsv_file_path()):
             status_message("TSV file already exists. Skipping.")
             return
 
         convert_params = {
             'input_file' : self.input_file,
-            'output_file': self.tsv_file_path(),
+            'output_file': self.converted_tsv_file_path(),
             'sample_name': self.sample_name,
             'pass_only': self.pass_only,
         }
@@ -193,6 +331,79 @@ class Pipeline(metaclass=ABCMeta):
         converter.execute()
         print("Completed")
 
+    def pre_prediction_filter(self):
+        status_message("Filtering variants before binding predictions")
+        if os.path.exists(self.candidate_tsv_file_path()):
+            status_message("Filtered TSV file already exists. Skipping.")
+            return
+
+        filter_criteria = []
+        if self.early_filter:
+            filter_criteria.append({'column': 'normal_depth', 'operator': '>=', 'threshold': self.normal_cov})
+            filter_criteria.append({'column': 'normal_vaf', 'operator': '<=', 'threshold': self.normal_vaf})
+            filter_criteria.append({'column': 'tdna_depth', 'operator': '>=', 'threshold': self.tdna_cov})
+            filter_criteria.append({'column': 'tdna_vaf', 'operator': '>=', 'threshold': self.tdna_vaf})
+            filter_criteria.append({'column': 'trna_depth', 'operator': '>=', 'threshold': self.trna_cov})
+            filter_criteria.append({'column': 'trna_vaf', 'operator': '>=', 'threshold': self.trna_vaf})
+            filter_criteria.append({'column': 'gene_expression', 'operator': '>=', 'threshold': self.expn_val})
+            filter_criteria.append({'column': 'transcript_expression', 'operator': '>=', 'threshold': self.expn_val})
+            filter_criteria.append({'column': 'transcript_support_level', 'operator': '<=', 'threshold': self.maximum_transcript_support_level})
+        PrePredictionFilter(
+            self.converted_tsv_file_path(),
+            self.candidate_tsv_file_path(),
+            filter_criteria,
+            self.exclude_NAs,
+            self.best_transcript_only,
+        ).execute()
+        status_message("Completed")
+
+    def previous_run(self):
+        previous_log_file = os.path.join(self.previous_run_dir, 'log', 'inputs.yml')
+        if not os.path.exists(previous_log_file):
+            sys.exit("No inputs.yml log file found in previous run directory %s" % self.previous_run_dir)
+        with open(previous_log_file, 'r') as log_fh:
+            previous_inputs = yaml.load(log_fh)
+        for key in self.prediction_parameters:
+            if previous_inputs.get(key) != getattr(self, key):
+                sys.exit(
+                    "Results of the previous run can't be reused because the prediction inputs differ: \n" +
+                    "Previous input: %s - %s\n" % (key, previous_inputs.get(key)) +
+                    "Current input: %s - %s\n" % (key, getattr(self, key)) +
+                    "Aborting."
+                )
+        previous_sample_name = previous_inputs['sample_name']
+        previous_all_epitopes_file = lib.bgzip_report.report_path(os.path.join(self.previous_run_dir, "%s.all_epitopes.tsv" % previous_sample_name))
+        if not os.path.exists(previous_all_epitopes_file):
+            sys.exit("No all_epitopes file found in previous run directory %s" % self.previous_run_dir)
+        #The candidate TSV of the previous run lists every variant that it
+        #reported results for
+        previous_tsv_file = os.path.join(self.previous_run_dir, "%s.prefiltered.tsv" % previous_sample_name)
+        if not os.path.exists(previous_tsv_file):
+            previous_tsv_file = os.path.join(self.previous_run_dir, "%s.tsv" % previous_sample_name)
+        return IncrementalRun(
+            tsv_file=self.candidate_tsv_file_path(),
+            proximal_variants_file=os.path.join(self.output_dir, self.sample_name + '.proximal_variants.tsv'),
+            previous_tsv_file=previous_tsv_file,
+            previous_proximal_variants_file=os.path.join(self.previous_run_dir, "%s.proximal_variants.tsv" % previous_sample_name),
+            previous_all_epitopes_file=previous_all_epitopes_file,
+        )
+
+    def find_changed_variants(self, previous_run):
+        status_message("Finding variants that changed since the previous run")
+        if os.path.exists(self.tsv_file_path()):
+            status_message("Changed variants TSV file already exists. Skipping.")
+            return
+        previous_run.write_changed_variants(self.tsv_file_path())
+        status_message("Completed")
+
+    def reused_parsed_path(self):
+        return os.path.join(self.tmp_dir, "%s.reused.parsed.tsv" % self.sample_name)
+
+    def reuse_previous_epitopes(self, previous_run):
+        status_message("Reusing epitopes of unchanged variants from the previous run")
+        previous_run.write_reused_epitopes(self.reused_parsed_path())
+        status_message("Completed")
+
     def tsv_entry_count(self):
         with open(self.tsv_file_path()) as tsv_file:
             reader  = csv.DictReader(tsv_file, delimiter='\t')
@@ -203,52 +414,28 @@ class Pipeline(metaclass=ABCMeta):
 
     def split_tsv_file(self, total_row_count):
         status_message("Splitting TSV into smaller chunks")
-        tsv_size = self.fasta_size / 2
+        tsv_size = int(self.fasta_size / 2)
         chunks = []
         with open(self.tsv_file_path(), 'r') as tsv_file:
-            reader      = csv.DictReader(tsv_file, delimiter='\t')
-            row_count   = 1
-            split_start = row_count
-            split_end   = split_start + tsv_size - 1
-            if split_end > total_row_count:
-                split_end = total_row_count
-            status_message("Splitting TSV into smaller chunks - Entries %d-%d" % (split_start, split_end))
-            split_tsv_file_path = "%s_%d-%d" % (self.tsv_file_path(), split_start, split_end)
-            chunks.append([split_start, split_end])
-            if os.path.exists(split_tsv_file_path):
-                status_message("Split TSV file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
-                skip = 1
-            else:
-                split_tsv_file      = open(split_tsv_file_path, 'w')
-                split_tsv_writer    = csv.DictWriter(split_tsv_file, delimiter='\t', fieldnames = reader.fieldnames)
-                split_tsv_writer.writeheader()
-                skip = 0
-            for row in reader:
-                if skip == 0:
-                    split_tsv_writer.writerow(row)
-                if row_count == total_row_count:
-                    break
-                if row_count % tsv_size == 0:
-                    if skip == 0:
-                        split_tsv_file.close()
-                    split_start = row_count + 1
-                    split_end   = split_start + tsv_size - 1
-                    if split_end > total_row_count:
-                        split_end = total_row_count
-                    status_message("Splitting TSV into smaller chunks - Entries %d-%d" % (split_start, split_end))
-                    split_tsv_file_path = "%s_%d-%d" % (self.tsv_file_path(), split_start, split_end)
-                    chunks.append([split_start, split_end])
-                    if os.path.exists(split_tsv_file_path):
-                        status_message("Split TSV file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
-                        skip = 1
-                    else:
-                        split_tsv_file      = open(split_tsv_file_path, 'w')
-                        split_tsv_writer    = csv.DictWriter(split_tsv_file, delimiter='\t', fieldnames = reader.fieldnames)
+            reader = csv.DictReader(tsv_file, delimiter='\t')
+            for split_start in range(1, total_row_count + 1, tsv_size):
+                split_end = min(split_start + tsv_size - 1, total_row_count)
+                rows = itertools.islice(reader, split_end - split_start + 1)
+                status_message("Splitting TSV into smaller chunks - Entries %d-%d" % (split_start, split_end))
+                split_tsv_file_path = self.split_tsv_file_path("%d-%d" % (split_start, split_end))
+                chunks.append([split_start, split_end])
+                if os.path.exists(split_tsv_file_path):
+                    status_message("Split TSV file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
+                    for row in rows:
+                        pass
+                elif lib.intermediate_table.is_intermediate(split_tsv_file_path):
+                    lib.intermediate_table.write(list(rows), reader.fieldnames, split_tsv_file_path)
+                    self.write_intermediate_tsv_copy(split_tsv_file_path)
+                else:
+                    with open(split_tsv_file_path, 'w') as split_tsv_file:
+                        split_tsv_writer = csv.DictWriter(split_tsv_file, delimiter='\t', fieldnames = reader.fieldnames)
                         split_tsv_writer.writeheader()
-                        skip = 0
-                row_count += 1
-            if skip == 0:
-                split_tsv_file.close()
+                        split_tsv_writer.writerows(rows)
         status_message("Completed")
         return chunks
 
@@ -257,31 +444,71 @@ class Pipeline(metaclass=ABCMeta):
         for (split_start, split_end) in chunks:
             tsv_chunk = "%d-%d" % (split_start, split_end)
             fasta_chunk = "%d-%d" % (split_start*2-1, split_end*2)
-            generate_fasta_params = {
-                'peptide_sequence_length'   : self.peptide_sequence_length,
-                'downstream_sequence_length': self.downstream_sequence_length,
-                'proximal_variants_file'    : self.proximal_variants_file,
-            }
-            split_fasta_file_path = "%s_%s" % (self.split_fasta_basename(), fasta_chunk)
-            if os.path.exists(split_fasta_file_path):
-                status_message("Split FASTA file for Entries %s already exists. Skipping." % (fasta_chunk))
-                continue
-            if self.input_file_type == 'pvacvector_input_fasta':
-                generate_fasta_params['input_file'] = self.tsv_file_path()
-                generate_fasta_params['output_file_prefix'] = split_fasta_file_path
-                generate_fasta_params['epitope_lengths'] = self.epitope_lengths
-                generate_fasta_params['spacers'] = self.spacers
-            else:
-                split_fasta_key_file_path = split_fasta_file_path + '.key'
-                generate_fasta_params['input_file'] = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
-                generate_fasta_params['epitope_length'] = max(self.epitope_lengths)
-                generate_fasta_params['output_file'] = split_fasta_file_path
-                generate_fasta_params['output_key_file'] = split_fasta_key_file_path
-            status_message("Generating Variant Peptide FASTA and Key Files - Entries %s" % (fasta_chunk))
-            fasta_generator = self.fasta_generator(generate_fasta_params)
-            fasta_generator.execute()
+            for epitope_length in self.fasta_epitope_lengths():
+                generate_fasta_params = {
+                    'peptide_sequence_length'   : self.peptide_sequence_length,
+                    'downstream_sequence_length': self.downstream_sequence_length,
+                    'proximal_variants_file'    : self.proximal_variants_file,
+                }
+                split_fasta_file_path = self.split_fasta_file_path(fasta_chunk, epitope_length)
+                if os.path.exists(split_fasta_file_path):
+                    status_message("Split FASTA file for Entries %s already exists. Skipping." % (fasta_chunk))
+                    continue
+                if self.input_file_type == 'pvacvector_input_fasta':
+                    generate_fasta_params['input_file'] = self.tsv_file_path()
+                    generate_fasta_params['output_file_prefix'] = split_fasta_file_path
+                    generate_fasta_params['epitope_lengths'] = self.epitope_lengths
+                    generate_fasta_params['spacers'] = self.spacers
+                else:
+                    split_fasta_key_file_path = split_fasta_file_path + '.key'
+                    generate_fasta_params['input_file'] = self.split_tsv_file_path(tsv_chunk)
+                    generate_fasta_params['epitope_length'] = epitope_length
+                    generate_fasta_params['minimum_subsequence_length'] = max(self.epitope_lengths)
+                    generate_fasta_params['output_file'] = split_fasta_file_path
+                    generate_fasta_params['output_key_file'] = split_fasta_key_file_path
+                    generate_fasta_params['reference_proteome'] = self.reference_proteome()
+                    generate_fasta_params['overlapping_epitopes_only'] = self.overlapping_epitopes_enabled()
+                status_message("Generating Variant Peptide FASTA and Key Files - Entries %s" % (fasta_chunk))
+                fasta_generator = self.fasta_generator(generate_fasta_params)
+                fasta_generator.execute()
         status_message("Completed")
 
+    def peptide_registry_enabled(self):
+        return self.input_file_type != 'pvacvector_input_fasta'
+
+    def register_peptides(self, chunks):
+        status_message("Registering Unique Peptides")
+        for epitope_length in self.fasta_epitope_lengths():
+            split_fasta_files = []
+            for (split_start, split_end) in chunks:
+                fasta_chunk = "%d-%d" % (split_start*2-1, split_end*2)
+                split_fasta_files.append((fasta_chunk, self.split_fasta_file_path(fasta_chunk, epitope_length)))
+            PeptideRegistry(split_fasta_files).execute()
+        status_message("Completed")
+
+    def overlapping_epitopes_enabled(self):
+        return self.overlapping_epitopes_only and self.input_file_type == 'vcf'
+
+    def fasta_epitope_lengths(self):
+        #Epitopes are emitted separately for each length so each length needs
+        #its own FASTA. Otherwise one FASTA of subsequences is used for all
+        #lengths.
+        if self.overlapping_epitopes_enabled():
+            return self.epitope_lengths
+        else:
+            return [max(self.epitope_lengths)]
+
+    def split_fasta_file_path(self, fasta_chunk, epitope_length):
+        if self.overlapping_epitopes_enabled():
+            return "%s_%s.%smers" % (self.split_fasta_basename(), fasta_chunk, epitope_length)
+        else:
+            return "%s_%s" % (self.split_fasta_basename(), fasta_chunk)
+
+    def reference_proteome(self):
+        if self.reference_proteome_fasta is None:
+            return None
+        return ReferenceProteome.load(self.reference_proteome_fasta, self.epitope_lengths)
+
     def split_fasta_basename(self):
         return os.path.join(self.tmp_dir, self.sample_name + "_" + str(self.peptide_sequence_length) + ".fa.split")
 
@@ -336,12 +563,27 @@ class Pipeline(metaclass=ABCMeta):
         }
         iteration_info = self.balance_multithreads(iteration_info)
 
-        split_parsed_output_files = []
         lock = Lock()
+        self.call_iedb(chunks, iteration_info, lock)
+        return self.parse_outputs(chunks, iteration_info, lock)
+
+    def iedb_method(self, method):
+        prediction = globals()[method]()
+        if hasattr(prediction, 'iedb_prediction_method'):
+            return prediction.iedb_prediction_method
+        else:
+            return method
+
+    def split_iedb_output_path(self, iedb_method, allele, epitope_length, fasta_chunk):
+        return os.path.join(self.tmp_dir, ".".join([self.sample_name, iedb_method, allele, str(epitope_length), "tsv_%s" % fasta_chunk]))
+
+    def call_iedb(self, chunks, iteration_info, lock):
+        alleles = self.alleles
+        epitope_lengths = self.epitope_lengths
+        prediction_algorithms = self.prediction_algorithms
         with pymp.Parallel(iteration_info['file']['threads']) as p:
             for i in p.range(len(chunks)):
                 (split_start, split_end) = chunks[i]
-                tsv_chunk = "%d-%d" % (split_start, split_end)
                 fasta_chunk = "%d-%d" % (split_start*2-1, split_end*2)
                 with pymp.Parallel(iteration_info['allele']['threads']) as p2:
                     for j in p2.range(len(alleles)):
@@ -349,11 +591,10 @@ class Pipeline(metaclass=ABCMeta):
                         with pymp.Parallel(iteration_info['length']['threads']) as p3:
                             for k in p3.range(len(epitope_lengths)):
                                 epl = epitope_lengths[k]
-                                if self.input_file_type == 'pvacvector_input_fasta':
-                                    split_fasta_file_path = "{}_1-2.{}.tsv".format(self.split_fasta_basename(), epl)
+                                if self.peptide_registry_enabled():
+                                    split_fasta_file_path = PeptideRegistry.unique_fasta_file_path(self.split_fasta_file_path(fasta_chunk, epl))
                                 else:
-                                    split_fasta_file_path = "%s_%s"%(self.split_fasta_basename(), fasta_chunk)
-                                split_iedb_output_files = []
+                                    split_fasta_file_path = "{}_1-2.{}.tsv".format(self.split_fasta_basename(), epl)
                                 status_message_with_lock("Processing entries for Allele %s and Epitope Length %s - Entries %s" % (a, epl, fasta_chunk), lock)
                                 if os.path.getsize(split_fasta_file_path) == 0:
                                     status_message_with_lock("Fasta file is empty. Skipping", lock)
@@ -364,10 +605,7 @@ class Pipeline(metaclass=ABCMeta):
                                         method = prediction_algorithms[m]
                                         prediction_class = globals()[method]
                                         prediction = prediction_class()
-                                        if hasattr(prediction, 'iedb_prediction_method'):
-                                            iedb_method = prediction.iedb_prediction_method
-                                        else:
-                                            iedb_method = method
+                                        iedb_method = self.iedb_method(method)
                                         valid_alleles = prediction.valid_allele_names()
                                         if a not in valid_alleles:
                                             status_message_with_lock("Allele %s not valid for Method %s. Skipping." % (a, method), lock)
@@ -377,10 +615,9 @@ class Pipeline(metaclass=ABCMeta):
                                             status_message_with_lock("Epitope Length %s is not valid for Method %s and Allele %s. Skipping." % (epl, method, a), lock)
                                             continue
 
-                                        split_iedb_out = os.path.join(self.tmp_dir, ".".join([self.sample_name, iedb_method, a, str(epl), "tsv_%s" % fasta_chunk]))
+                                        split_iedb_out = self.split_iedb_output_path(iedb_method, a, epl, fasta_chunk)
                                         if os.path.exists(split_iedb_out):
                                             status_message_with_lock("IEDB file for Allele %s and Epitope Length %s with Method %s (Entries %s) already exists. Skipping." % (a, epl, method, fasta_chunk), lock)
-                                            split_iedb_output_files.append(split_iedb_out)
                                             continue
                                         status_message_with_lock("Running IEDB on Allele %s and Epitope Length %s with Method %s - Entries %s" % (a, epl, method, fasta_chunk), lock)
 
@@ -404,25 +641,69 @@ class Pipeline(metaclass=ABCMeta):
                                         lib.call_iedb.main(arguments)
                                         last_execute_timestamp = datetime.datetime.now()
                                         status_message_with_lock("Running IEDB on Allele %s and Epitope Length %s with Method %s - Entries %s - Completed" % (a, epl, method, fasta_chunk), lock)
-                                        split_iedb_output_files.append(split_iedb_out)
                                 #end of per-algorithm processing
 
+    def parse_outputs(self, chunks, iteration_info, lock):
+        alleles = self.alleles
+        epitope_lengths = self.epitope_lengths
+        split_parsed_output_files = []
+        with pymp.Parallel(iteration_info['file']['threads']) as p:
+            for i in p.range(len(chunks)):
+                (split_start, split_end) = chunks[i]
+                tsv_chunk = "%d-%d" % (split_start, split_end)
+                fasta_chunk = "%d-%d" % (split_start*2-1, split_end*2)
+                split_tsv_entries = self.split_tsv_entries(tsv_chunk)
+                with pymp.Parallel(iteration_info['allele']['threads']) as p2:
+                    for j in p2.range(len(alleles)):
+                        a = alleles[j]
+                        with pymp.Parallel(iteration_info['length']['threads']) as p3:
+                            for k in p3.range(len(epitope_lengths)):
+                                epl = epitope_lengths[k]
+                                if self.peptide_registry_enabled():
+                                    split_fasta_file_path = self.split_fasta_file_path(fasta_chunk, epl)
+                                    split_fasta_key_file_path = PeptideRegistry.key_file_path(split_fasta_file_path)
+                                else:
+                                    split_fasta_file_path = "{}_1-2.{}.tsv".format(self.split_fasta_basename(), epl)
+                                    split_fasta_key_file_path = split_fasta_file_path + '.key'
+                                if os.path.getsize(split_fasta_file_path) == 0:
+                                    continue
+
                                 #parse all output files for one allele, epitope, and file chunk over all algorithms into one file
-                                split_parsed_file_path = os.path.join(self.tmp_dir, ".".join([self.sample_name, a, str(epl), "parsed", "tsv_%s" % fasta_chunk]))
+                                split_parsed_file_path = self.split_parsed_file_path(a, epl, fasta_chunk)
                                 if os.path.exists(split_parsed_file_path):
                                     status_message_with_lock("Parsed Output File for Allele %s and Epitope Length %s (Entries %s) already exists. Skipping" % (a, epl, fasta_chunk), lock)
                                     split_parsed_output_files.append(split_parsed_file_path)
                                     continue
-                                split_fasta_key_file_path = split_fasta_file_path + '.key'
+
+                                #the predictions for the peptides of this chunk may have been made
+                                #with the peptides of the chunks they first occurred in
+                                if self.peptide_registry_enabled():
+                                    source_chunks = PeptideRegistry.sources(split_fasta_file_path)
+                                else:
+                                    source_chunks = [fasta_chunk]
+                                split_iedb_output_files = []
+                                registry_ids = {}
+                                for method in self.prediction_algorithms:
+                                    iedb_method = self.iedb_method(method)
+                                    for source_chunk in source_chunks:
+                                        split_iedb_out = self.split_iedb_output_path(iedb_method, a, epl, source_chunk)
+                                        if os.path.exists(split_iedb_out):
+                                            split_iedb_output_files.append(split_iedb_out)
+                                            if self.peptide_registry_enabled():
+                                                registry_ids[split_iedb_out] = PeptideRegistry.ids(self.split_fasta_file_path(source_chunk, epl))
 
                                 if len(split_iedb_output_files) > 0:
                                     status_message_with_lock("Parsing IEDB Output for Allele %s and Epitope Length %s - Entries %s" % (a, epl, fasta_chunk), lock)
-                                    split_tsv_file_path = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
+                                    split_tsv_file_path = self.split_tsv_file_path(tsv_chunk)
                                     params = {
                                         'input_iedb_files'       : split_iedb_output_files,
                                         'input_tsv_file'         : split_tsv_file_path,
                                         'key_file'               : split_fasta_key_file_path,
                                         'output_file'            : split_parsed_file_path,
+                                        'reference_proteome'     : self.reference_proteome(),
+                                        'tsv_entries'            : split_tsv_entries,
+                                        'top_score_metric'       : self.top_score_metric,
+                                        'registry_ids'           : registry_ids,
                                     }
                                     if self.additional_report_columns and 'sample_name' in self.additional_report_columns:
                                         params['sample_name'] = self.sample_name
@@ -430,6 +711,7 @@ class Pipeline(metaclass=ABCMeta):
                                         params['sample_name'] = None
                                     parser = self.output_parser(params)
                                     parser.execute()
+                                    self.write_intermediate_tsv_copy(split_parsed_file_path)
                                     status_message_with_lock("Parsing IEDB Output for Allele %s and Epitope Length %s - Entries %s - Completed" % (a, epl, fasta_chunk), lock)
                                     split_parsed_output_files.append(split_parsed_file_path)
         return split_parsed_output_files
@@ -453,27 +735,7 @@ class Pipeline(metaclass=ABCMeta):
     def ranked_final_path(self):
         return os.path.join(self.output_dir, self.sample_name+".filtered.condensed.ranked.tsv")
 
-    def execute(self):
-        self.print_log()
-        self.convert_vcf()
-
-        total_row_count = self.tsv_entry_count()
-        if total_row_count == 0:
-            if self.input_file_type == 'vcf':
-                sys.exit("The TSV file is empty. Please check that the input VCF contains missense, inframe indel, or frameshift mutations.")
-            elif self.input_file_type == 'bedpe':
-                sys.exit("The TSV file is empty. Please check that the input bedpe file contains fusion entries.")
-        chunks = self.split_tsv_file(total_row_count)
-
-        self.generate_fasta(chunks)
-        split_parsed_output_files = self.call_iedb_and_parse_outputs(chunks)
-
-        if len(split_parsed_output_files) == 0:
-            status_message("No output files were created. Aborting.")
-            return
-
-        self.combined_parsed_outputs(split_parsed_output_files)
-
+    def execute_post_processing(self):
         post_processing_params = vars(self)
         post_processing_params['input_file'] = self.combined_parsed_path()
         post_processing_params['filtered_report_file'] = self.final_path()
@@ -494,7 +756,68 @@ class Pipeline(metaclass=ABCMeta):
             post_processing_params['run_netmhc_stab'] = False
         PostProcessor(**post_processing_params).execute()
 
-        status_message("\nDone: Pipeline finished successfully. File {} contains list of filtered putative neoantigens.\n".format(self.ranked_final_path()))
+        status_message("\nDone: Pipeline finished successfully. File {} contains list of filtered putative neoantigens.\n".format(lib.bgzip_report.report_path(self.ranked_final_path())))
 
         if self.keep_tmp_files is False:
             shutil.rmtree(self.tmp_dir)
+
+    def execute(self):
+        changed_post_processing_inputs = self.print_log()
+        combined_parsed_report = lib.bgzip_report.report_path(self.combined_parsed_path())
+        if len(changed_post_processing_inputs) > 0 and os.path.exists(combined_parsed_report):
+            status_message("Only post-processing inputs changed. Reusing existing %s" % combined_parsed_report)
+            bgzipped = lib.bgzip_report.is_bgzipped(combined_parsed_report)
+            if 'top_score_metric' in changed_post_processing_inputs or bgzipped:
+                #The all_epitopes report is sorted by the top score metric.
+                #Compressed reports are sorted by position instead.
+                resorted_file = self.combined_parsed_path() + '.tmp'
+                lib.combine_parsed_outputs.main([
+                    combined_parsed_report,
+                    resorted_file,
+                    '--top-score-metric', self.top_score_metric,
+                    '--sort-inputs',
+                ])
+                os.replace(resorted_file, self.combined_parsed_path())
+                if bgzipped:
+                    os.remove(combined_parsed_report)
+                    if os.path.exists(lib.bgzip_report.index_path(combined_parsed_report)):
+                        os.remove(lib.bgzip_report.index_path(combined_parsed_report))
+            self.execute_post_processing()
+            return
+
+        self.convert_vcf()
+        if self.pre_prediction_filtering_enabled():
+            self.pre_prediction_filter()
+        if self.previous_run_dir is not None:
+            previous_run = self.previous_run()
+            self.find_changed_variants(previous_run)
+
+        total_row_count = self.tsv_entry_count()
+        if total_row_count == 0 and self.previous_run_dir is None:
+            if self.pre_prediction_filtering_enabled():
+                sys.exit("The filtered TSV file is empty. No variants passed the pre-prediction filters.")
+            elif self.input_file_type == 'vcf':
+                sys.exit("The TSV file is empty. Please check that the input VCF contains missense, inframe indel, or frameshift mutations.")
+            elif self.input_file_type == 'bedpe':
+                sys.exit("The TSV file is empty. Please check that the input bedpe file contains fusion entries.")
+
+        if total_row_count > 0:
+            chunks = self.split_tsv_file(total_row_count)
+
+            self.generate_fasta(chunks)
+            self.register_peptides(chunks)
+            split_parsed_output_files = self.call_iedb_and_parse_outputs(chunks)
+        else:
+            status_message("No new or changed variants since the previous run.")
+            split_parsed_output_files = []
+
+        if self.previous_run_dir is not None:
+            self.reuse_previous_epitopes(previous_run)
+            split_parsed_output_files.append(self.reused_parsed_path())
+
+        if len(split_parsed_output_files) == 0:
+            status_message("No output files were created. Aborting.")
+            return
+
+        self.combined_parsed_outputs(split_parsed_output_files)
+        self.execute_post_processing()
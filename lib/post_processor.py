@@ -1,4 +1,5 @@
 import tempfile
+import csv
 import shutil
 from lib.binding_filter import *
 from lib.filter import *
@@ -8,47 +9,95 @@ from lib.rank_epitopes import *
 from lib.post_processor import *
 import lib.net_chop
 import lib.netmhc_stab
+import lib.parquet_report
+import lib.bgzip_report
 
 class PostProcessor:
     def __init__(self, **kwargs):
         for (k,v) in kwargs.items():
            setattr(self, k, v)
-        self.binding_filter_fh = tempfile.NamedTemporaryFile()
-        self.coverage_filter_fh = tempfile.NamedTemporaryFile()
-        self.transcript_support_level_filter_fh = tempfile.NamedTemporaryFile()
         self.top_score_filter_fh = tempfile.NamedTemporaryFile()
         self.net_chop_fh = tempfile.NamedTemporaryFile()
         self.netmhc_stab_fh = tempfile.NamedTemporaryFile()
-        self.condensed_report_fh = tempfile.NamedTemporaryFile()
-        self.ranked_epitopes_fh = tempfile.NamedTemporaryFile()
 
     def execute(self):
-        self.execute_binding_filter()
-        self.execute_coverage_filter()
-        self.execute_transcript_support_level_filter()
-        self.execute_top_score_filter()
-        self.call_net_chop()
-        self.call_netmhc_stab()
-        self.condense_report()
-        self.rank_epitopes()
-        shutil.copy(self.netmhc_stab_fh.name, self.filtered_report_file)
-        shutil.copy(self.ranked_epitopes_fh.name, self.condensed_report_file)
+        #The report is loaded once and every enabled stage is applied to the
+        #data in memory. Only the external annotators work on files.
+        data = Filter.read_report(self.input_file)
+        self.write_parquet_report(data, self.input_file)
+        data = self.execute_binding_filter(data)
+        data = self.execute_coverage_filter(data)
+        data = self.execute_transcript_support_level_filter(data)
+        data = self.execute_top_score_filter(data)
+        if self.run_net_chop or self.run_netmhc_stab:
+            self.write_filtered_report(data, self.top_score_filter_fh.name)
+            self.call_net_chop()
+            self.call_netmhc_stab()
+            shutil.copy(self.netmhc_stab_fh.name, self.filtered_report_file)
+            data = Filter.read_report(self.filtered_report_file)
+        else:
+            self.write_filtered_report(data, self.filtered_report_file)
+        self.write_parquet_report(data, self.filtered_report_file)
+        condensed_data = self.condense_report(data)
+        self.rank_epitopes(condensed_data)
+        self.compress_reports()
         self.close_filehandles()
 
-    def execute_binding_filter(self):
+    def reformats_values(self):
+        #The pandas based filters write the values in pandas' formatting.
+        #Without them the values of the input report are kept as they are.
+        return not self.allele_specific_binding_thresholds or self.run_coverage_filter or self.run_transcript_support_level_filter
+
+    def write_filtered_report(self, data, output_file):
+        #The filtered report has always been written with the csv module's
+        #default \r\n line terminator
+        if self.reformats_values():
+            with open(output_file, 'w', newline='\r\n') as output_fh:
+                data.to_csv(output_fh, sep='\t', index=False, na_rep='NA')
+        else:
+            self.write_input_rows(data.index, output_file)
+
+    def write_parquet_report(self, data, report_file):
+        #With the parquet output format, each report is also written as a
+        #.parquet file next to its .tsv file
+        if getattr(self, 'output_format', 'tsv') == 'parquet':
+            lib.parquet_report.write(data, lib.parquet_report.parquet_path(report_file))
+
+    def compress_reports(self):
+        #With bgzip_reports, the reports are replaced by BGZF compressed and,
+        #if they have positions, tabix indexed copies
+        if getattr(self, 'bgzip_reports', False):
+            for report_file in [self.input_file, self.filtered_report_file, self.condensed_report_file]:
+                if not lib.bgzip_report.is_bgzipped(report_file):
+                    lib.bgzip_report.compress(report_file)
+
+    def write_input_rows(self, row_numbers, output_file):
+        selected_row_numbers = set(row_numbers)
+        with lib.bgzip_report.open_report(self.input_file) as input_fh, open(output_file, 'w') as output_fh:
+            reader = csv.DictReader(input_fh, delimiter = "\t")
+            writer = csv.DictWriter(output_fh, delimiter = "\t", fieldnames = reader.fieldnames)
+            writer.writeheader()
+            rows = {}
+            for (row_number, row) in enumerate(reader):
+                if row_number in selected_row_numbers:
+                    rows[row_number] = row
+            writer.writerows(rows[row_number] for row_number in row_numbers)
+
+    def execute_binding_filter(self, data):
         print("Running Binding Filters")
-        BindingFilter(
+        data = BindingFilter(
             self.input_file,
-            self.binding_filter_fh.name,
+            self.filtered_report_file,
             self.binding_threshold,
             self.minimum_fold_change,
             self.top_score_metric,
             self.exclude_NAs,
             self.allele_specific_binding_thresholds,
-        ).execute()
+        ).filter_data(data)
         print("Completed")
+        return data
 
-    def execute_coverage_filter(self):
+    def execute_coverage_filter(self, data):
         if self.run_coverage_filter:
             print("Running Coverage Filters")
             filter_criteria = []
@@ -60,42 +109,57 @@ class PostProcessor:
             filter_criteria.append({'column': "Tumor_RNA_VAF", 'operator': '>=', 'threshold': self.trna_vaf})
             filter_criteria.append({'column': "Gene_Expression", 'operator': '>=', 'threshold': self.expn_val})
             filter_criteria.append({'column': "Transcript_Expression", 'operator': '>=', 'threshold': self.expn_val})
-            Filter(self.binding_filter_fh.name, self.coverage_filter_fh.name, filter_criteria, self.exclude_NAs).execute()
+            data = Filter(self.input_file, self.filtered_report_file, filter_criteria, self.exclude_NAs).filter_data(data)
             print("Completed")
-        else:
-            shutil.copy(self.binding_filter_fh.name, self.coverage_filter_fh.name)
+        return data
 
-    def execute_transcript_support_level_filter(self):
+    def execute_transcript_support_level_filter(self, data):
         if self.run_transcript_support_level_filter:
             print("Running Transcript Support Level Filter")
             filter_criteria = [{'column': 'Transcript Support Level', 'operator': '<=', 'threshold': self.maximum_transcript_support_level}]
-            Filter(
-                self.coverage_filter_fh.name,
-                self.transcript_support_level_filter_fh.name,
+            data = Filter(
+                self.input_file,
+                self.filtered_report_file,
                 filter_criteria,
                 self.exclude_NAs,
                 ['Transcript Support Level'],
-            ).execute()
+            ).filter_data(data)
             print("Complete")
-        else:
-            shutil.copy(self.coverage_filter_fh.name, self.transcript_support_level_filter_fh.name)
+        return data
 
-    def execute_top_score_filter(self):
+    def execute_top_score_filter(self, data):
         print("Running Top Score Filter")
-        TopScoreFilter(self.transcript_support_level_filter_fh.name, self.top_score_filter_fh.name, self.top_score_metric).execute()
+        data = TopScoreFilter(self.input_file, self.filtered_report_file, self.top_score_metric).filter_data(data)
         print("Completed")
+        return data
+
+    def local_executable_arguments(self, option, attribute):
+        #Local executables are run in as many processes as the pipeline uses threads
+        executable = getattr(self, attribute, None)
+        if executable is None:
+            return []
+        return [option, executable, '--n-threads', str(getattr(self, 'n_threads', 1))]
+
+    def annotation_cache_arguments(self):
+        annotation_cache = getattr(self, 'annotation_cache', None)
+        if annotation_cache is None:
+            return []
+        return ['--annotation-cache', annotation_cache]
 
     def call_net_chop(self):
         if self.run_net_chop:
             print("Submitting remaining epitopes to NetChop")
-            lib.net_chop.main([
+            arguments = [
                 self.top_score_filter_fh.name,
                 self.net_chop_fh.name,
                 '--method',
                 self.net_chop_method,
                 '--threshold',
-                str(self.net_chop_threshold)
-            ])
+                str(self.net_chop_threshold),
+            ]
+            arguments.extend(self.local_executable_arguments('--netchop-executable', 'netchop_executable'))
+            arguments.extend(self.annotation_cache_arguments())
+            lib.net_chop.main(arguments)
             print("Completed")
         else:
             shutil.copy(self.top_score_filter_fh.name, self.net_chop_fh.name)
@@ -103,30 +167,32 @@ class PostProcessor:
     def call_netmhc_stab(self):
         if self.run_netmhc_stab:
             print("Running NetMHCStabPan")
-            lib.netmhc_stab.main([
+            arguments = [
                 self.net_chop_fh.name,
                 self.netmhc_stab_fh.name,
-            ])
+            ]
+            arguments.extend(self.local_executable_arguments('--netmhcstabpan-executable', 'netmhcstabpan_executable'))
+            arguments.extend(self.annotation_cache_arguments())
+            lib.netmhc_stab.main(arguments)
             print("Completed")
         else:
             shutil.copy(self.net_chop_fh.name, self.netmhc_stab_fh.name)
 
-    def condense_report(self):
+    def condense_report(self, data):
         print("Creating Condensed Report")
-        CondenseFinalReport(self.netmhc_stab_fh.name, self.condensed_report_fh.name, self.top_score_metric).execute()
+        condensed_data = CondenseFinalReport(self.filtered_report_file, self.condensed_report_file, self.top_score_metric).condense_data(data)
         print("Completed")
+        return condensed_data
 
-    def rank_epitopes(self):
+    def rank_epitopes(self, condensed_data):
         print("Ranking neoepitopes")
-        RankEpitopes(self.condensed_report_fh.name, self.ranked_epitopes_fh.name).execute()
+        ranked_epitopes = RankEpitopes(self.filtered_report_file, self.condensed_report_file)
+        ranked_data = ranked_epitopes.rank_data(condensed_data)
+        ranked_data.to_csv(self.condensed_report_file, sep='\t', na_rep='NA', columns=ranked_epitopes.headers(), index=False)
+        self.write_parquet_report(ranked_data[ranked_epitopes.headers()], self.condensed_report_file)
         print("Completed")
 
     def close_filehandles(self):
-        self.binding_filter_fh.close()
-        self.coverage_filter_fh.close()
-        self.transcript_support_level_filter_fh.close()
         self.top_score_filter_fh.close()
         self.net_chop_fh.close()
         self.netmhc_stab_fh.close()
-        self.condensed_report_fh.close()
-        self.ranked_epitopes_fh.close()
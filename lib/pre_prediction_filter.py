@@ -0,0 +1,79 @@
+import csv
+import sys
+import operator
+from math import inf
+
+csv.field_size_limit(sys.maxsize)
+
+class PrePredictionFilter:
+    #The report writer rounds these columns to three decimals. We round them
+    #the same way so that a variant is only removed here if the corresponding
+    #filter would remove all of its epitopes after prediction.
+    rounded_columns = [
+        'gene_expression',
+        'transcript_expression',
+        'normal_vaf',
+        'tdna_vaf',
+        'trna_vaf',
+    ]
+
+    operators = {
+        '<' : operator.lt,
+        '<=': operator.le,
+        '==': operator.eq,
+        '>=': operator.ge,
+        '>' : operator.gt,
+    }
+
+    def __init__(self, input_file, output_file, filter_criteria, exclude_nas, best_transcript_only=False):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.filter_criteria = [criteria for criteria in filter_criteria if criteria['threshold'] is not None]
+        self.exclude_nas = exclude_nas
+        self.best_transcript_only = best_transcript_only
+
+    def value(self, line, column):
+        value = line.get(column, 'NA')
+        if value is None or value == 'NA' or value == '':
+            return None
+        value = float(value)
+        if column in self.rounded_columns:
+            value = round(value, 3)
+        return value
+
+    def passes_filters(self, line):
+        for criteria in self.filter_criteria:
+            value = self.value(line, criteria['column'])
+            if value is None:
+                if self.exclude_nas:
+                    return False
+                continue
+            if not self.operators[criteria['operator']](value, float(criteria['threshold'])):
+                return False
+        return True
+
+    def transcript_rank(self, line):
+        #Lower is better: prefer well-supported, highly expressed transcripts
+        transcript_support_level = self.value(line, 'transcript_support_level')
+        transcript_expression = self.value(line, 'transcript_expression')
+        return (
+            inf if transcript_support_level is None else transcript_support_level,
+            inf if transcript_expression is None else -transcript_expression,
+        )
+
+    def execute(self):
+        with open(self.input_file, 'r') as input_fh, open(self.output_file, 'w') as output_fh:
+            reader = csv.DictReader(input_fh, delimiter='\t')
+            writer = csv.DictWriter(output_fh, delimiter='\t', fieldnames=reader.fieldnames)
+            writer.writeheader()
+            best_transcripts = {}
+            for line in reader:
+                if not self.passes_filters(line):
+                    continue
+                if not self.best_transcript_only:
+                    writer.writerow(line)
+                    continue
+                variant = (line['chromosome_name'], line['start'], line['stop'], line['reference'], line['variant'])
+                if variant not in best_transcripts or self.transcript_rank(line) < self.transcript_rank(best_transcripts[variant]):
+                    best_transcripts[variant] = line
+            writer.writerows(best_transcripts.values())
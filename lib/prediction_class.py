@@ -14,7 +14,11 @@ import pandas as pd
 import time
 from subprocess import run, PIPE
 import tempfile
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from types import MappingProxyType
+
+#The report naming of the predictions made with one IEDB prediction method
+PredictionMethod = namedtuple('PredictionMethod', ['iedb_method', 'class_name', 'mhc_class', 'wt_score_column', 'mt_score_column'])
 
 class IEDB(metaclass=ABCMeta):
     @classmethod
@@ -135,6 +139,7 @@ class MHCnuggets(metaclass=ABCMeta):
 class PredictionClass(metaclass=ABCMeta):
     valid_allele_names_dict = {}
     allele_cutoff_dict = {}
+    prediction_method_registry = None
 
     @classmethod
     def prediction_classes(cls):
@@ -159,9 +164,31 @@ class PredictionClass(metaclass=ABCMeta):
         module = getattr(sys.modules[__name__], method)
         return module()
 
+    @classmethod
+    def build_prediction_method_registry(cls):
+        registry = {}
+        for prediction_class in PredictionClass.prediction_classes():
+            if issubclass(prediction_class, IEDBMHCI) or issubclass(prediction_class, IEDBMHCII):
+                method = prediction_class().iedb_prediction_method
+            else:
+                method = prediction_class.__name__
+            class_name = prediction_class.__name__
+            mhc_class = 'I' if issubclass(prediction_class, MHCI) else 'II'
+            registry[method] = PredictionMethod(method, class_name, mhc_class, "%s WT Score" % class_name, "%s MT Score" % class_name)
+        return MappingProxyType(registry)
+
+    @classmethod
+    def prediction_method(cls, method):
+        if PredictionClass.prediction_method_registry is None:
+            PredictionClass.prediction_method_registry = cls.build_prediction_method_registry()
+        return PredictionClass.prediction_method_registry[method]
+
     @classmethod
     def prediction_class_name_for_iedb_prediction_method(cls, method):
-        return cls.prediction_class_for_iedb_prediction_method(method).__class__.__name__
+        try:
+            return cls.prediction_method(method).class_name
+        except KeyError:
+            return cls.prediction_class_for_iedb_prediction_method(method).__class__.__name__
 
     @classmethod
     def allele_info(cls, prediction_algorithms, name_filter):
@@ -212,17 +239,19 @@ class PredictionClass(metaclass=ABCMeta):
         return cutoffs
 
     @classmethod
-    def print_all_allele_cutoffs(cls):
+    def allele_cutoffs(cls):
         if not cls.allele_cutoff_dict:
             cls.allele_cutoff_dict = cls.parse_allele_cutoff_file()
-        for allele, cutoff in sorted(cls.allele_cutoff_dict.items()):
+        return cls.allele_cutoff_dict
+
+    @classmethod
+    def print_all_allele_cutoffs(cls):
+        for allele, cutoff in sorted(cls.allele_cutoffs().items()):
             print("%s\t%s" % (allele, cutoff))
 
     @classmethod
     def cutoff_for_allele(cls, allele):
-        if not cls.allele_cutoff_dict:
-            cls.allele_cutoff_dict = cls.parse_allele_cutoff_file()
-        return cls.allele_cutoff_dict.get(allele, None)
+        return cls.allele_cutoffs().get(allele, None)
 
     @abstractmethod
     def valid_allele_names(self):
@@ -1,12 +1,57 @@
 import vcf
 import sys
 import os
+from collections import deque
 from lib.csq_parser import CsqParser
 from Bio.Seq import translate
 import lib.utils
 
+class SortedVcfWindow:
+    #Walks a sorted, tabix-indexed VCF alongside another sorted VCF, keeping a
+    #sliding window of records so that each record is read and decoded once.
+    #Queries for a region that lies before the current window fall back to a
+    #fresh tabix fetch starting at that region.
+    def __init__(self, vcf_reader):
+        self.vcf_reader  = vcf_reader
+        self.chromosome  = None
+        self.window      = deque()
+        self.records     = None
+        self.query_start = None
+
+    def record_end(self, record):
+        if 'END' in record.INFO and record.INFO['END'] is not None:
+            return max(record.end, int(record.INFO['END']))
+        return record.end
+
+    def reset(self, chromosome, start):
+        self.records     = self.vcf_reader.fetch(chromosome, start)
+        self.chromosome  = chromosome
+        self.window      = deque()
+        self.query_start = start
+
+    def fetch(self, chromosome, start, end):
+        #tabix truncates fractional coordinates so we do the same
+        start = max(int(start), 0)
+        end   = int(end)
+        if chromosome != self.chromosome or start < self.query_start:
+            self.reset(chromosome, start)
+        self.query_start = start
+
+        while len(self.window) > 0 and self.record_end(self.window[0][0]) <= start:
+            self.window.popleft()
+
+        while self.records is not None and (len(self.window) == 0 or self.window[-1][0].start < end):
+            try:
+                record = next(self.records)
+            except StopIteration:
+                self.records = None
+                break
+            self.window.append((record, {}))
+
+        return [(record, cache) for (record, cache) in self.window if record.start < end and self.record_end(record) > start]
+
 class ProximalVariant:
-    def __init__(self, proximal_variants_vcf, pass_only):
+    def __init__(self, proximal_variants_vcf, pass_only, sweep=False):
         if not os.path.exists(proximal_variants_vcf + '.tbi'):
             sys.exit('No .tbi file found for proximal variants VCF. Proximal variants VCF needs to be tabix indexed.')
 
@@ -25,6 +70,28 @@ class ProximalVariant:
         self.csq_parser = CsqParser(info_fields['CSQ'].desc)
 
         self.pass_only = pass_only
+        #In sweep mode the somatic variants need to be queried in sorted order.
+        #Each phased record is then decoded once instead of once per tabix fetch.
+        if sweep:
+            self.window = SortedVcfWindow(self.proximal_variants_vcf)
+        else:
+            self.window = None
+
+    def fetch(self, chromosome, start, end):
+        if self.window is not None:
+            return self.window.fetch(chromosome, start, end)
+        else:
+            return [(entry, {}) for entry in self.proximal_variants_vcf.fetch(chromosome, start, end)]
+
+    def csq_entries_for_allele(self, entry, alt, csq_cache):
+        if str(alt) not in csq_cache:
+            alleles_dict = self.csq_parser.resolve_alleles(entry)
+            csq_entries = self.csq_parser.parse_csq_entries_for_allele(entry.INFO['CSQ'], alt)
+            if len(csq_entries) == 0:
+                csq_allele = alleles_dict[str(alt)]
+                csq_entries = self.csq_parser.parse_csq_entries_for_allele(entry.INFO['CSQ'], csq_allele)
+            csq_cache[str(alt)] = csq_entries
+        return csq_cache[str(alt)]
 
     def extract(self, somatic_variant, alt, transcript, peptide_size):
         (phased_somatic_variant, potential_proximal_variants) = self.find_phased_somatic_variant_and_potential_proximal_variants(somatic_variant, alt, transcript, peptide_size)
@@ -74,7 +141,7 @@ class ProximalVariant:
         flanking_length = peptide_size * 3 / 2
         potential_proximal_variants = []
         phased_somatic_variant = None
-        for entry in self.proximal_variants_vcf.fetch(somatic_variant.CHROM, somatic_variant.start - flanking_length, somatic_variant.end + flanking_length):
+        for (entry, csq_cache) in self.fetch(somatic_variant.CHROM, somatic_variant.start - flanking_length, somatic_variant.end + flanking_length):
             if self.pass_only:
                 filt = entry.FILTER
                 if not (filt is None or len(filt) == 0):
@@ -89,15 +156,10 @@ class ProximalVariant:
                     print("Warning: Proximal variant is not VEP annotated and will be skipped: {}".format(entry))
                     continue
 
-                alleles_dict = self.csq_parser.resolve_alleles(entry)
-                csq_entries = self.csq_parser.parse_csq_entries_for_allele(entry.INFO['CSQ'], proximal_alt)
+                csq_entries = self.csq_entries_for_allele(entry, proximal_alt, csq_cache)
                 if len(csq_entries) == 0:
-                    csq_allele = alleles_dict[str(proximal_alt)]
-                    csq_entries = self.csq_parser.parse_csq_entries_for_allele(entry.INFO['CSQ'], csq_allele)
-
-                    if len(csq_entries) == 0:
-                        print("Warning: Proximal variant does not contain any VEP annotations for alternate allele and will be skipped: {}".format(entry))
-                        continue
+                    print("Warning: Proximal variant does not contain any VEP annotations for alternate allele and will be skipped: {}".format(entry))
+                    continue
 
                 #We assume that there is only one CSQ entry because the PICK option was used but we should double check that
                 if len(csq_entries) > 1:
@@ -1,9 +1,16 @@
+import tempfile
+from array import array
+import numpy as np
 import pandas as pd
+from lib.filter import Filter
+import lib.parquet_report
 
 class RankEpitopes:
-    def __init__(self, input_file, output_file):
+    def __init__(self, input_file, output_file, chunk_size=None):
         self.input_file = input_file
         self.output_file = output_file
+        #If set, the report is processed in batches of this many rows
+        self.chunk_size = chunk_size
 
     def headers(self):
         return [
@@ -26,7 +33,58 @@ class RankEpitopes:
         ]
 
     def execute(self):
-        df = pd.read_csv(self.input_file, sep='\t', index_col=False)
+        if self.chunk_size is not None:
+            return self.execute_in_chunks()
+        if lib.parquet_report.is_parquet(self.input_file):
+            df = Filter.read_report(self.input_file)
+        else:
+            df = pd.read_csv(self.input_file, sep='\t', index_col=False)
+        df = self.rank_data(df)
+        if lib.parquet_report.is_parquet(self.output_file):
+            lib.parquet_report.write(df[self.headers()], self.output_file)
+        else:
+            df.to_csv(self.output_file, sep='\t', na_rep='NA', columns=self.headers(), index=False)
+
+    def rank_columns(self, df):
+        #The values that are ranked and whether higher values rank higher
+        return {
+            'mt_score_rank'     : (df['MT IC50'], False),
+            'fold_change_rank'  : (df['Fold Change'], True),
+            'mt_allele_exp_rank': (df['Tumor RNA VAF'] * df['Gene Expression'], True),
+            'tumor_dna_vaf_rank': (df['Tumor DNA VAF'], True),
+        }
+
+    def execute_in_chunks(self):
+        #The first pass collects the distinct values of each ranked column.
+        #The second pass scores the rows and writes them to a temporary file.
+        #The rows are then copied to the output file in the order of their scores.
+        if lib.parquet_report.is_parquet(self.output_file):
+            raise Exception("Ranking in chunks only supports writing .tsv output files")
+        distinct_values = {}
+        for chunk in Filter.read_report_chunks(self.input_file, self.chunk_size):
+            for (rank_column, (values, ascending)) in self.rank_columns(chunk).items():
+                distinct_values[rank_column] = np.union1d(distinct_values.get(rank_column, []), values.dropna().unique())
+
+        scores = array('d')
+        offsets = array('q')
+        with tempfile.TemporaryFile() as rows_fh:
+            for chunk in Filter.read_report_chunks(self.input_file, self.chunk_size):
+                for (rank_column, (values, ascending)) in self.rank_columns(chunk).items():
+                    chunk[rank_column] = dense_rank(values, distinct_values[rank_column], ascending)
+                chunk['Score'] = chunk['mt_score_rank'] + chunk['fold_change_rank'] + (chunk['mt_allele_exp_rank'] * 2) + (chunk['tumor_dna_vaf_rank'] / 2)
+                scores.extend(chunk['Score'])
+                rows = chunk.to_csv(sep='\t', na_rep='NA', columns=self.headers(), index=False, header=False)
+                for row in rows.encode().splitlines(keepends=True):
+                    offsets.append(rows_fh.tell())
+                    rows_fh.write(row)
+
+            with open(self.output_file, 'wb') as output_fh:
+                output_fh.write(pd.DataFrame(columns=self.headers()).to_csv(sep='\t', index=False).encode())
+                for row_number in pd.Series(scores, dtype=float).sort_values(ascending=False).index:
+                    rows_fh.seek(offsets[row_number])
+                    output_fh.write(rows_fh.readline())
+
+    def rank_data(self, df):
         df['mt_score_rank'] = df['MT IC50'].rank(numeric_only=True, ascending=False, method='dense').fillna(value=0.0)
         df['fold_change_rank'] = df['Fold Change'].rank(numeric_only=True, ascending=True, method='dense').fillna(value=0.0)
         df['mt_allele_exp'] = df['Tumor RNA VAF'] * df['Gene Expression']
@@ -34,4 +92,15 @@ class RankEpitopes:
         df['tumor_dna_vaf_rank'] = df['Tumor DNA VAF'].rank(numeric_only=True, ascending=True, method='dense').fillna(value=0.0)
         df['Score'] = df['mt_score_rank'] + df['fold_change_rank'] + (df['mt_allele_exp_rank'] * 2) + (df['tumor_dna_vaf_rank'] / 2)
         df.sort_values(by=['Score'], inplace=True, ascending=False)
-        df.to_csv(self.output_file, sep='\t', na_rep='NA', columns=self.headers(), index=False)
+        return df
+
+def dense_rank(values, distinct_values, ascending):
+    #Same as values.rank(method='dense') when distinct_values are all the
+    #distinct values of the column
+    ranks = pd.Series(np.searchsorted(distinct_values, values), index=values.index, dtype=float)
+    if ascending:
+        ranks += 1
+    else:
+        ranks = len(distinct_values) - ranks
+    ranks[values.isna()] = 0.0
+    return ranks
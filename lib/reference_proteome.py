@@ -0,0 +1,105 @@
+import os
+import numpy as np
+from Bio import SeqIO
+
+class ReferenceProteome:
+    #Peptides are packed into unsigned 64 bit integers. Amino acids are
+    #encoded in 5 bits each so peptides of up to 12 amino acids are packed
+    #losslessly. Longer peptides are packed with a polynomial hash instead.
+    max_exact_length = 12
+    exact_base       = 32
+    hash_base        = 0x100000001B3
+    mask             = (1 << 64) - 1
+
+    loaded_indexes = {}
+
+    def __init__(self, reference_proteome_fasta, epitope_lengths):
+        self.reference_proteome_fasta = reference_proteome_fasta
+        self.epitope_lengths          = sorted(set(epitope_lengths))
+        self.kmers                    = {}
+        sequence = None
+        for epitope_length in self.epitope_lengths:
+            index_file = self.index_file_path(epitope_length)
+            if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(reference_proteome_fasta):
+                self.kmers[epitope_length] = np.load(index_file, mmap_mode='r')
+                continue
+            if sequence is None:
+                sequence = self.encode_proteome()
+            print("Building reference proteome index for epitope length %s" % epitope_length)
+            self.kmers[epitope_length] = self.build_index(sequence, epitope_length)
+            try:
+                np.save(index_file, self.kmers[epitope_length])
+            except OSError:
+                print("Warning: Unable to save reference proteome index to %s" % index_file)
+
+    @classmethod
+    def load(cls, reference_proteome_fasta, epitope_lengths):
+        key = (os.path.abspath(reference_proteome_fasta), tuple(sorted(set(epitope_lengths))))
+        if key not in cls.loaded_indexes:
+            cls.loaded_indexes[key] = cls(reference_proteome_fasta, epitope_lengths)
+        return cls.loaded_indexes[key]
+
+    def index_file_path(self, epitope_length):
+        return "%s.%smers.npy" % (self.reference_proteome_fasta, epitope_length)
+
+    def encode_proteome(self):
+        sequences = [str(record.seq) for record in SeqIO.parse(self.reference_proteome_fasta, 'fasta')]
+        return self.encode("*".join(sequences))
+
+    @classmethod
+    def encode(cls, sequence):
+        #Letters are encoded as 1-26, everything else (e.g. stops and the
+        #separators between proteins) as 0 which ends a peptide
+        characters = np.frombuffer(sequence.upper().encode('ascii', 'replace'), dtype=np.uint8)
+        is_letter = (characters >= ord('A')) & (characters <= ord('Z'))
+        return np.where(is_letter, characters & 31, 0).astype(np.uint64)
+
+    @classmethod
+    def base(cls, epitope_length):
+        if epitope_length <= cls.max_exact_length:
+            return cls.exact_base
+        else:
+            return cls.hash_base
+
+    @classmethod
+    def build_index(cls, sequence, epitope_length):
+        kmer_count = len(sequence) - epitope_length + 1
+        if kmer_count <= 0:
+            return np.array([], dtype=np.uint64)
+        base = np.uint64(cls.base(epitope_length))
+        packed = np.zeros(kmer_count, dtype=np.uint64)
+        for offset in range(epitope_length):
+            packed = packed * base + sequence[offset:offset + kmer_count]
+        #Drop k-mers that span a separator
+        separators = np.concatenate([[0], np.cumsum(sequence == 0)])
+        valid = separators[epitope_length:] == separators[:kmer_count]
+        return np.unique(packed[valid])
+
+    @classmethod
+    def pack(cls, peptide):
+        base = cls.base(len(peptide))
+        packed = 0
+        for amino_acid in peptide.upper():
+            packed = (packed * base + (ord(amino_acid) & 31)) & cls.mask
+        return packed
+
+    def contains(self, peptide):
+        kmers = self.kmers.get(len(peptide))
+        if kmers is None or len(kmers) == 0:
+            return False
+        packed = np.uint64(self.pack(peptide))
+        position = np.searchsorted(kmers, packed)
+        return position < len(kmers) and kmers[position] == packed
+
+    def contains_all_kmers(self, sequence):
+        for epitope_length in self.epitope_lengths:
+            if len(sequence) < epitope_length:
+                continue
+            packed = self.build_index(self.encode(sequence), epitope_length)
+            kmers = self.kmers[epitope_length]
+            if len(kmers) == 0:
+                return False
+            positions = np.minimum(np.searchsorted(kmers, packed), len(kmers) - 1)
+            if not np.all(kmers[positions] == packed):
+                return False
+        return True
@@ -2,6 +2,8 @@ from abc import ABCMeta
 import argparse
 from .prediction_class import *
 import lib
+import lib.parquet_report
+import lib.intermediate_table
 
 class RunArgumentParser(metaclass=ABCMeta):
     def __init__(self, tool_name, input_file_help):
@@ -112,6 +114,23 @@ class PredictionRunArgumentParser(RunArgumentParser):
             default=0.5,
             help="NetChop prediction threshold (increasing the threshold results in better specificity, but worse sensitivity).",
         )
+        self.parser.add_argument(
+            '--netchop-executable',
+            default=None,
+            help="Path to a local netchop executable. If set, NetChop is run locally instead of on the CBS web server.",
+        )
+        self.parser.add_argument(
+            '--netmhcstabpan-executable',
+            default=None,
+            help="Path to a local netMHCstabpan executable. If set, NetMHCStabPan is run locally instead of on the CBS web server.",
+        )
+        self.parser.add_argument(
+            '--annotation-cache',
+            default=None,
+            help="Path to an SQLite database of NetChop and NetMHCStabPan predictions. "
+                 + "Epitopes that are already in the database aren't submitted again and new predictions are added to it. "
+                 + "The same database can be used for multiple samples and runs.",
+        )
         self.parser.add_argument(
             '-a', '--additional-report-columns',
             choices=['sample_name'],
@@ -136,6 +155,30 @@ class PredictionRunArgumentParser(RunArgumentParser):
             default=False,
             action='store_true'
         )
+        self.parser.add_argument(
+            '--output-format',
+            choices=lib.parquet_report.output_formats,
+            default='tsv',
+            help="tsv: Write the reports as .tsv files. "
+                 + "parquet: Additionally write each report as a typed and compressed .parquet file next to its .tsv file, "
+                 + "with the same rows in the same order. Requires pyarrow."
+        )
+        self.parser.add_argument(
+            '--intermediate-format',
+            choices=lib.intermediate_table.intermediate_formats,
+            default='tsv',
+            help="Format of the split variant tables and parsed prediction tables in the tmp directory. "
+                 + "tsv: Write them as .tsv files. "
+                 + "arrow: Write them as memory-mapped Arrow files so that they are read without re-parsing numbers. "
+                 + "With --keep-tmp-files a .tsv copy of each is also kept. Requires pyarrow."
+        )
+        self.parser.add_argument(
+            '--bgzip-reports',
+            default=False,
+            action='store_true',
+            help="Replace the all_epitopes, filtered and condensed ranked reports with BGZF compressed .tsv.gz files. "
+                 + "Reports with chromosome and start positions are sorted by position and get a tabix index."
+        )
 
 class PvacseqRunArgumentParser(PredictionRunArgumentParser):
     def __init__(self):
@@ -211,6 +254,44 @@ class PvacseqRunArgumentParser(PredictionRunArgumentParser):
             default=False,
             action='store_true'
         )
+        self.parser.add_argument(
+            '--early-filter',
+            help="Apply the coverage, VAF, expression, and transcript support level filters to the variants "
+                 + "before running the binding predictions instead of only to the final report. "
+                 + "Variants failing these filters will not be predicted.",
+            default=False,
+            action='store_true'
+        )
+        self.parser.add_argument(
+            '--overlapping-epitopes-only',
+            help="For missense variants, only submit the epitopes that overlap the mutated positions, "
+                 + "together with their matching wildtype epitopes, to the prediction algorithms "
+                 + "instead of the full mutant and wildtype subsequences. "
+                 + "This reduces the number of predictions without changing the results.",
+            default=False,
+            action='store_true'
+        )
+        self.parser.add_argument(
+            '--reference-proteome-fasta',
+            help="A reference proteome FASTA, e.g. the Ensembl pep.all FASTA. "
+                 + "Mutant epitopes that occur anywhere in the reference proteome are not novel "
+                 + "and will be excluded before and after running the binding predictions. "
+                 + "An index of the proteome is saved next to this file for reuse by later runs."
+        )
+        self.parser.add_argument(
+            '--previous-run-dir',
+            help="Output directory of a previous pVACseq run on an earlier version of the input VCF. "
+                 + "Only variants that are new or whose protein sequence changed since that run will be predicted. "
+                 + "The results of all other variants are taken from the previous run and the reports are rebuilt. "
+                 + "The previous run needs to have used the same alleles, prediction algorithms, and epitope lengths."
+        )
+        self.parser.add_argument(
+            '--best-transcript-only',
+            help="Only run binding predictions on the best transcript of each variant, "
+                 + "i.e. the one with the lowest transcript support level and, among those, the highest transcript expression.",
+            default=False,
+            action='store_true'
+        )
 
 class PvacfuseRunArgumentParser(PredictionRunArgumentParser):
     def __init__(self):
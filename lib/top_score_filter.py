@@ -1,5 +1,9 @@
 import csv
 import argparse
+import pandas as pd
+from lib.filter import Filter
+import lib.parquet_report
+import lib.bgzip_report
 
 class TopScoreFilter:
     def __init__(self, input_file, output_file, top_score_metric):
@@ -8,7 +12,11 @@ class TopScoreFilter:
         self.top_score_metric = top_score_metric
 
     def execute(self):
-        with open(self.input_file) as input_fh, open(self.output_file, 'w') as output_fh:
+        if lib.parquet_report.is_parquet(self.input_file) or lib.parquet_report.is_parquet(self.output_file):
+            data = self.filter_data(Filter.read_report(self.input_file))
+            Filter.write_report(data, self.output_file)
+            return
+        with lib.bgzip_report.open_report(self.input_file) as input_fh, open(self.output_file, 'w') as output_fh:
             reader = csv.DictReader(input_fh, delimiter = "\t")
             writer = csv.DictWriter(output_fh, delimiter = "\t", fieldnames = reader.fieldnames)
             writer.writeheader()
@@ -29,6 +37,25 @@ class TopScoreFilter:
 
             writer.writerows(filtered_results.values())
 
+    def filter_data(self, data):
+        if self.top_score_metric == 'median':
+            score_column = 'Median MT Score'
+        elif self.top_score_metric == 'lowest':
+            score_column = 'Best MT Score'
+        variants = data['Chromosome'].astype(str)
+        for column in ['Start', 'Stop', 'Reference', 'Variant']:
+            variants = variants + '.' + data[column].astype(str)
+        scores = pd.DataFrame({
+            'variant': variants.values,
+            'score'  : data[score_column].astype(float).values,
+        })
+        #The first row with the lowest score of each variant, with the variants
+        #in the order they first occur in
+        first_rows = scores.drop_duplicates('variant').reset_index().set_index('variant')['index']
+        top_scores = scores.sort_values('score', kind='mergesort').drop_duplicates('variant')
+        top_rows = top_scores['variant'].map(first_rows).sort_values(kind='mergesort').index
+        return data.iloc[top_rows]
+
     @classmethod
     def parser(cls, tool):
         parser = argparse.ArgumentParser('%s top_score_filter' % tool, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
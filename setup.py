@@ -101,6 +101,9 @@ setup(
         'tornado==5.0.2',
         'swagger-spec-validator==2.1.0',
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     package_data={
         'tools.pvacseq': pvacseq_data_files,
         'tools.pvacfuse': pvacfuse_data_files,
@@ -0,0 +1,89 @@
+import re
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+#A local stand-in for the NetChop web server. Submissions are redirected to
+#a job page that reports the job as queued the first time it is requested
+#and returns the predictions afterwards. A position is a cleavage site if
+#its amino acid is one of cleavage_amino_acids.
+
+cleavage_amino_acids = 'LRKF'
+separator = '-' * 38
+
+def predictions(sequences):
+    lines = ["NetChop 3.0 predictions using version C-term. Threshold 0.500000", ""]
+    for (sequence_id, sequence) in sequences:
+        lines.extend([separator, " pos  AA  C      score      Ident", separator])
+        cleavage_sites = 0
+        for (position, amino_acid) in enumerate(sequence, 1):
+            if amino_acid in cleavage_amino_acids:
+                cleavage = 'S'
+                score = 0.5 + position / 100
+                cleavage_sites += 1
+            else:
+                cleavage = '.'
+                score = position / 100
+            lines.append("%4d   %s  %s   %f %s" % (position, amino_acid, cleavage, score, sequence_id))
+        lines.extend([
+            separator,
+            "",
+            "Number of cleavage sites %d. Number of amino acids %d. Protein name %s" % (cleavage_sites, len(sequence), sequence_id),
+            "",
+            separator,
+        ])
+    return "<html><body><pre>\n%s\n</pre></body></html>" % "\n".join(lines)
+
+class NetChopRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, content):
+        body = content.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        sequences = re.findall(r'^>(\w+)\r?\n(\w+)\r?$', body, re.MULTILINE)
+        server = self.server
+        with server.lock:
+            job_id = len(server.jobs)
+            server.jobs.append({'sequences': sequences, 'polls': 0})
+        self.send_response(303)
+        self.send_header('Location', '/job/%d' % job_id)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        job = self.server.jobs[int(self.path.split('/')[-1])]
+        with self.server.lock:
+            job['polls'] += 1
+            polls = job['polls']
+        if polls == 1:
+            self.respond("<html><!-- jobid: 5c0ffee status: queued --></html>")
+        else:
+            self.respond(predictions(job['sequences']))
+
+class MockNetChopServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), NetChopRequestHandler)
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def url(self):
+        return "http://127.0.0.1:%d/cgi-bin/webface2.fcgi" % self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
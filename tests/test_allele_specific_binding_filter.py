@@ -1,10 +1,41 @@
 import unittest
 import os
+import csv
+import itertools
 import tempfile
 from filecmp import cmp
 import sys
 import py_compile
 from lib.allele_specific_binding_filter import *
+from lib.binding_filter import BindingFilter
+
+def row_by_row_filter(input_file, output_file, default_threshold, minimum_fold_change, top_score_metric, exclude_nas):
+    #The filter as it was before the thresholds were applied as columnar
+    #masks. It compared the fold change with None if no minimum fold change
+    #was given, so that case is treated as having no fold change criterion.
+    if top_score_metric == 'median':
+        score_column = 'Median MT Score'
+        fold_change_column = 'Median Fold Change'
+    elif top_score_metric == 'lowest':
+        score_column = 'Best MT Score'
+        fold_change_column = 'Corresponding Fold Change'
+    with open(input_file, 'r') as input_fh, open(output_file, 'w') as output_fh:
+        reader = csv.DictReader(input_fh, delimiter='\t')
+        writer = csv.DictWriter(output_fh, reader.fieldnames, delimiter='\t', lineterminator='\n')
+        writer.writeheader()
+        for entry in reader:
+            score = float(entry[score_column])
+            if minimum_fold_change is not None:
+                if exclude_nas and entry[fold_change_column] == 'NA':
+                    continue
+                fold_change = sys.maxsize if entry[fold_change_column] == 'NA' else float(entry[fold_change_column])
+                if fold_change < minimum_fold_change:
+                    continue
+            threshold = PredictionClass.cutoff_for_allele(entry['HLA Allele'])
+            threshold = default_threshold if threshold is None else float(threshold)
+            if score > threshold:
+                continue
+            writer.writerow(entry)
 
 #python -m unittest tests/test_binding_filter.py
 class BindingFilterTests(unittest.TestCase):
@@ -36,3 +67,44 @@ class BindingFilterTests(unittest.TestCase):
             os.path.join(self.test_data_path, "Test.filtered.binding.tsv"),
             False
         ))
+
+    def write_varied_report(self, path):
+        #Copies of each test row with scores around the allele-specific and
+        #default thresholds and with missing, low and high fold changes
+        with open(os.path.join(self.test_data_path, 'Test.combined.parsed.tsv'), 'r') as input_fh, open(path, 'w') as output_fh:
+            reader = csv.DictReader(input_fh, delimiter='\t')
+            writer = csv.DictWriter(output_fh, reader.fieldnames, delimiter='\t', lineterminator='\n')
+            writer.writeheader()
+            for entry in reader:
+                writer.writerow(entry)
+                for (score, fold_change) in itertools.product(['100', '255', '300', '500.5', '884', '900'], ['NA', '0.5', '1', '2.25']):
+                    entry.update({
+                        'Median MT Score': score,
+                        'Best MT Score': score,
+                        'Median Fold Change': fold_change,
+                        'Corresponding Fold Change': fold_change,
+                    })
+                    writer.writerow(entry)
+
+    def test_binding_filter_matches_row_by_row_filter(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            input_file = os.path.join(output_dir, 'input.tsv')
+            self.write_varied_report(input_file)
+            expected_file = os.path.join(output_dir, 'expected.tsv')
+            output_file = os.path.join(output_dir, 'output.tsv')
+            for (top_score_metric, exclude_nas, minimum_fold_change, chunk_size) in itertools.product(['median', 'lowest'], [False, True], [None, 0, 1], [None, 7]):
+                row_by_row_filter(input_file, expected_file, 500, minimum_fold_change, top_score_metric, exclude_nas)
+                AlleleSpecificBindingFilter(
+                    input_file,
+                    output_file,
+                    500,
+                    minimum_fold_change,
+                    top_score_metric,
+                    exclude_nas,
+                    chunk_size=chunk_size,
+                ).execute()
+                self.assertTrue(cmp(output_file, expected_file, False), (top_score_metric, exclude_nas, minimum_fold_change, chunk_size))
+
+    def test_binding_filter_passes_chunk_size(self):
+        binding_filter = BindingFilter('input.tsv', 'output.tsv', 500, 0, 'median', False, True, chunk_size=7)
+        self.assertEqual(binding_filter.allele_specific_binding_filter().chunk_size, 7)
@@ -0,0 +1,71 @@
+import unittest
+import unittest.mock
+import os
+import tempfile
+import py_compile
+import lib.bgzip_report
+
+class BgzipReportTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+        cls.executable = os.path.join(base_dir, 'lib', 'bgzip_report.py')
+        cls.test_data_dir = os.path.join(base_dir, 'tests', 'test_data', 'combine_parsed_outputs')
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(self.executable))
+
+    def write_report(self, path, header, lines):
+        with open(path, 'w', newline='') as fh:
+            fh.write(header)
+            fh.writelines(lines)
+
+    def test_compress_sorts_report_in_batches(self):
+        with open(os.path.join(self.test_data_dir, 'Test.combined.parsed.tsv'), 'r', newline='') as fh:
+            header = fh.readline()
+            lines = fh.readlines()
+        #Rows of several chromosomes, with ties, out of order and without a
+        #final line break
+        unsorted_lines = []
+        for (chromosome, start) in [('3', '200'), ('22', '41895790'), ('3', '1000'), ('3', '200'), ('X', '5'), ('22', '17')]:
+            for line in lines[:4]:
+                fields = line.split('\t')
+                fields[0] = chromosome
+                fields[1] = start
+                fields[2] = str(int(start) + 1)
+                unsorted_lines.append('\t'.join(fields))
+        unsorted_lines[-1] = unsorted_lines[-1].rstrip('\n')
+        expected_lines = sorted(
+            [line if line.endswith('\n') else line + '\n' for line in unsorted_lines],
+            key=lambda line: (line.split('\t')[0], int(line.split('\t')[1]))
+        )
+        with tempfile.TemporaryDirectory() as output_dir:
+            for sort_batch_size in [5, len(unsorted_lines)]:
+                tsv_file = os.path.join(output_dir, 'Test.all_epitopes.tsv')
+                self.write_report(tsv_file, header, unsorted_lines)
+                with unittest.mock.patch.object(lib.bgzip_report, 'sort_batch_size', sort_batch_size):
+                    output_file = lib.bgzip_report.compress(tsv_file)
+                self.assertFalse(os.path.exists(tsv_file))
+                self.assertTrue(os.path.exists(lib.bgzip_report.index_path(output_file)))
+                with lib.bgzip_report.open_report(output_file) as fh:
+                    self.assertEqual(fh.readline(), header)
+                    self.assertEqual(fh.readlines(), expected_lines)
+                self.assertEqual(
+                    sorted(os.listdir(output_dir)),
+                    sorted([os.path.basename(output_file), os.path.basename(lib.bgzip_report.index_path(output_file))])
+                )
+                os.remove(output_file)
+                os.remove(lib.bgzip_report.index_path(output_file))
+
+    def test_compress_keeps_order_of_reports_without_integer_positions(self):
+        header = 'Chromosome\tStart\tStop\tGene Name\n'
+        lines = ['2\t10\t11\tB\n', '1\tNA\tNA\tA\n', '1\t5\t6\tC\n']
+        with tempfile.TemporaryDirectory() as output_dir:
+            tsv_file = os.path.join(output_dir, 'Test.all_epitopes.tsv')
+            self.write_report(tsv_file, header, lines)
+            with unittest.mock.patch.object(lib.bgzip_report, 'sort_batch_size', 1):
+                output_file = lib.bgzip_report.compress(tsv_file)
+            self.assertFalse(os.path.exists(lib.bgzip_report.index_path(output_file)))
+            with lib.bgzip_report.open_report(output_file) as fh:
+                self.assertEqual(fh.read(), header + ''.join(lines))
+            self.assertEqual(os.listdir(output_dir), [os.path.basename(output_file)])
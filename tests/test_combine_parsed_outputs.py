@@ -1,10 +1,45 @@
 import unittest
+import unittest.mock
 import sys
 import os
 import tempfile
 import py_compile
 from subprocess import call
 from filecmp import cmp
+import csv
+import lib.combine_parsed_outputs
+import lib.intermediate_table
+import lib.bgzip_report
+
+def typed_value(value):
+    for number_type in [int, float]:
+        try:
+            if str(number_type(value)) == value:
+                return number_type(value)
+        except ValueError:
+            pass
+    return value
+
+def previous_combine_parsed_outputs(input_files, output_file, top_score_metric):
+    #combine_parsed_outputs as it was before the inputs were merged: all rows
+    #are sorted in memory with one stable sort per key
+    fieldnames = []
+    rows = []
+    for input_file in input_files:
+        with open(input_file, 'r') as input_file_handle:
+            reader = csv.DictReader(input_file_handle, delimiter='\t')
+            for fieldname in reader.fieldnames:
+                if fieldname not in fieldnames:
+                    fieldnames.append(fieldname)
+            rows.extend(reader)
+    rows = sorted(rows, key=lambda row: (int(row['Sub-peptide Position'])))
+    rows = sorted(rows, key=lambda row: (float(row['Corresponding Fold Change']) if row['Corresponding Fold Change'].isdigit() else float('inf')), reverse=True)
+    score_column = 'Median MT Score' if top_score_metric == 'median' else 'Best MT Score'
+    rows = sorted(rows, key=lambda row: (row['Gene Name'], row['Mutation'], float(row[score_column])))
+    with open(output_file, 'w') as output_file_handle:
+        tsv_writer = csv.DictWriter(output_file_handle, fieldnames, restval='NA', delimiter='\t', lineterminator='\n')
+        tsv_writer.writeheader()
+        tsv_writer.writerows(rows)
 
 class CombineParsedOutputsTests(unittest.TestCase):
     @classmethod
@@ -26,8 +61,114 @@ class CombineParsedOutputsTests(unittest.TestCase):
             os.path.join(self.test_data_dir, 'Test.HLA-E*01:01.9.parsed.tsv'),
             os.path.join(self.test_data_dir, 'Test.HLA-G*01:09.9.parsed.tsv'),
             combine_parsed_outputs_output_file.name,
+            '--sort-inputs',
         ]
         self.assertFalse(call(combine_parsed_outputs_command))
 
         expected_output_file  = os.path.join(self.test_data_dir, "Test.combined.parsed.tsv")
         self.assertTrue(cmp(combine_parsed_outputs_output_file.name, expected_output_file))
+
+    @unittest.skipUnless(lib.intermediate_table.available(), "pyarrow is not installed")
+    def test_combine_parsed_outputs_reads_intermediate_files(self):
+        input_files = []
+        for parsed_file in ['Test.HLA-E*01:01.9.parsed.tsv', 'Test.HLA-G*01:09.9.parsed.tsv']:
+            with open(os.path.join(self.test_data_dir, parsed_file), 'r') as fh:
+                reader = csv.DictReader(fh, delimiter='\t')
+                #The output parser passes numbers, not their text, to the writer
+                rows = [{key: typed_value(value) for (key, value) in row.items()} for row in reader]
+            #The pipeline writes its parsed outputs sorted
+            rows.sort(key=lib.combine_parsed_outputs.sort_key('median'))
+            intermediate_file = tempfile.NamedTemporaryFile(suffix=lib.intermediate_table.extension)
+            lib.intermediate_table.write(rows, reader.fieldnames, intermediate_file.name)
+            schema = lib.intermediate_table.pyarrow.ipc.open_file(intermediate_file.name).schema
+            self.assertEqual(schema.field('Start').type, lib.intermediate_table.pyarrow.int64())
+            self.assertEqual(schema.field('Median MT Score').type, lib.intermediate_table.pyarrow.float64())
+            #Corresponding WT Score is a float column with NA values
+            self.assertEqual(schema.field('Corresponding WT Score').type, lib.intermediate_table.pyarrow.float64())
+            input_files.append(intermediate_file)
+        combine_parsed_outputs_output_file = tempfile.NamedTemporaryFile()
+        lib.combine_parsed_outputs.main([
+            *[input_file.name for input_file in input_files],
+            combine_parsed_outputs_output_file.name,
+        ])
+
+        expected_output_file  = os.path.join(self.test_data_dir, "Test.combined.parsed.tsv")
+        self.assertTrue(cmp(combine_parsed_outputs_output_file.name, expected_output_file))
+
+    def test_combine_parsed_outputs_writes_bgzipped_output(self):
+        output_dir = tempfile.TemporaryDirectory()
+        output_file = os.path.join(output_dir.name, 'Test.combined.parsed.tsv.gz')
+        lib.combine_parsed_outputs.main([
+            os.path.join(self.test_data_dir, 'Test.HLA-E*01:01.9.parsed.tsv'),
+            os.path.join(self.test_data_dir, 'Test.HLA-G*01:09.9.parsed.tsv'),
+            output_file,
+            '--sort-inputs',
+        ])
+        self.assertTrue(os.path.exists(lib.bgzip_report.index_path(output_file)))
+
+        with open(os.path.join(self.test_data_dir, "Test.combined.parsed.tsv"), 'r') as fh:
+            expected_rows = list(csv.DictReader(fh, delimiter='\t'))
+        expected_rows.sort(key=lambda row: (row['Chromosome'], int(row['Start'])))
+        with lib.bgzip_report.open_report(output_file) as fh:
+            self.assertEqual(list(csv.DictReader(fh, delimiter='\t')), expected_rows)
+
+    def sorted_input_files(self, output_dir, top_score_metric):
+        #The test inputs sorted like the parsed outputs written by the pipeline
+        input_files = []
+        for parsed_file in ['Test.HLA-E*01:01.9.parsed.tsv', 'Test.HLA-G*01:09.9.parsed.tsv']:
+            input_file = os.path.join(output_dir, parsed_file)
+            previous_combine_parsed_outputs([os.path.join(self.test_data_dir, parsed_file)], input_file, top_score_metric)
+            input_files.append(input_file)
+        return input_files
+
+    def test_combine_parsed_outputs_merges_sorted_inputs(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            input_files = self.sorted_input_files(output_dir, 'median')
+            output_file = os.path.join(output_dir, 'Test.combined.parsed.tsv')
+            lib.combine_parsed_outputs.main([*input_files, output_file])
+            self.assertTrue(cmp(output_file, os.path.join(self.test_data_dir, "Test.combined.parsed.tsv")))
+
+    def test_combine_parsed_outputs_rejects_unsorted_inputs(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            output_file = os.path.join(output_dir, 'Test.combined.parsed.tsv')
+            with self.assertRaises(SystemExit) as context:
+                lib.combine_parsed_outputs.main([
+                    os.path.join(self.test_data_dir, 'Test.HLA-E*01:01.9.parsed.tsv'),
+                    os.path.join(self.test_data_dir, 'Test.HLA-G*01:09.9.parsed.tsv'),
+                    output_file,
+                ])
+            self.assertIn("Test.HLA-E*01:01.9.parsed.tsv isn't sorted", str(context.exception.code))
+            self.assertFalse(os.path.exists(output_file))
+
+    def test_combine_parsed_outputs_sorts_unsorted_inputs_in_batches(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            output_file = os.path.join(output_dir, 'Test.combined.parsed.tsv')
+            with unittest.mock.patch.object(lib.combine_parsed_outputs, 'sort_batch_size', 100):
+                lib.combine_parsed_outputs.main([
+                    os.path.join(self.test_data_dir, 'Test.HLA-E*01:01.9.parsed.tsv'),
+                    os.path.join(self.test_data_dir, 'Test.HLA-G*01:09.9.parsed.tsv'),
+                    output_file,
+                    '--sort-inputs',
+                ])
+            self.assertTrue(cmp(output_file, os.path.join(self.test_data_dir, "Test.combined.parsed.tsv")))
+            self.assertEqual(os.listdir(output_dir), ['Test.combined.parsed.tsv'])
+
+    def test_combine_parsed_outputs_matches_previous_output(self):
+        input_files = [
+            os.path.join(self.test_data_dir, 'Test.HLA-E*01:01.9.parsed.tsv'),
+            os.path.join(self.test_data_dir, 'Test.HLA-G*01:09.9.parsed.tsv'),
+        ]
+        for top_score_metric in ['median', 'lowest']:
+            with tempfile.TemporaryDirectory() as output_dir:
+                expected_file = os.path.join(output_dir, 'expected.tsv')
+                previous_combine_parsed_outputs(input_files, expected_file, top_score_metric)
+                sorted_output_file = os.path.join(output_dir, 'sorted.tsv')
+                lib.combine_parsed_outputs.main([*input_files, sorted_output_file, '--top-score-metric', top_score_metric, '--sort-inputs'])
+                self.assertTrue(cmp(sorted_output_file, expected_file), top_score_metric)
+                merged_output_file = os.path.join(output_dir, 'merged.tsv')
+                lib.combine_parsed_outputs.main([
+                    *self.sorted_input_files(output_dir, top_score_metric),
+                    merged_output_file,
+                    '--top-score-metric', top_score_metric,
+                ])
+                self.assertTrue(cmp(merged_output_file, expected_file), top_score_metric)
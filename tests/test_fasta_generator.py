@@ -4,12 +4,15 @@ import unittest
 import tempfile
 from filecmp import cmp
 import py_compile
+import shutil
 from lib.fasta_generator import *
+from lib.reference_proteome import *
 
 class FastaGeneratorTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+        cls.base_dir       = base_dir
         cls.executable_dir = os.path.join(base_dir, 'lib')
         cls.executable     = os.path.join(cls.executable_dir, 'fasta_generator.py')
         cls.test_data_dir  = os.path.join(base_dir, 'tests', 'test_data', 'fasta_generator')
@@ -41,6 +44,75 @@ class FastaGeneratorTests(unittest.TestCase):
         expected_key_output_file = os.path.join(self.test_data_dir, 'output_peptide_sequence_length_17.key')
         self.assertTrue(cmp(generate_fasta_key_output_file.name, expected_key_output_file))
 
+    def test_input_file_with_reference_proteome_skips_non_novel_peptides(self):
+        generate_fasta_input_file      = os.path.join(self.test_data_dir, 'input.tsv')
+        generate_fasta_output_file     = tempfile.NamedTemporaryFile()
+        generate_fasta_key_output_file = tempfile.NamedTemporaryFile()
+        reference_proteome_dir         = tempfile.TemporaryDirectory()
+        reference_proteome_fasta       = os.path.join(reference_proteome_dir.name, 'proteome.fa')
+        shutil.copy(os.path.join(self.base_dir, 'tests', 'test_data', 'reference_proteome', 'proteome.fa'), reference_proteome_fasta)
+
+        generate_fasta_params = {
+            'input_file'                : generate_fasta_input_file,
+            'peptide_sequence_length'   : self.peptide_sequence_length,
+            'epitope_length'            : self.epitope_length,
+            'output_file'               : generate_fasta_output_file.name,
+            'output_key_file'           : generate_fasta_key_output_file.name,
+            'downstream_sequence_length': None,
+            'reference_proteome'        : ReferenceProteome(reference_proteome_fasta, [self.epitope_length]),
+        }
+        generator = FastaGenerator(**generate_fasta_params)
+
+        self.assertFalse(generator.execute())
+        self.assertEqual(os.path.getsize(generate_fasta_output_file.name), 0)
+        self.assertEqual(os.path.getsize(generate_fasta_key_output_file.name), 0)
+        reference_proteome_dir.cleanup()
+
+    def test_input_file_with_overlapping_epitopes_only_generates_expected_file(self):
+        generate_fasta_input_file      = os.path.join(self.test_data_dir, 'input.tsv')
+        generate_fasta_output_file     = tempfile.NamedTemporaryFile()
+        generate_fasta_key_output_file = tempfile.NamedTemporaryFile()
+
+        generate_fasta_params = {
+            'input_file'                : generate_fasta_input_file,
+            'peptide_sequence_length'   : self.peptide_sequence_length,
+            'epitope_length'            : self.epitope_length,
+            'output_file'               : generate_fasta_output_file.name,
+            'output_key_file'           : generate_fasta_key_output_file.name,
+            'downstream_sequence_length': None,
+            'overlapping_epitopes_only' : True,
+        }
+        generator = FastaGenerator(**generate_fasta_params)
+
+        self.assertFalse(generator.execute())
+        expected_output_file = os.path.join(self.test_data_dir, 'output_overlapping_epitopes_only.fasta')
+        self.assertTrue(cmp(generate_fasta_output_file.name, expected_output_file))
+        expected_key_output_file = os.path.join(self.test_data_dir, 'output_overlapping_epitopes_only.key')
+        self.assertTrue(cmp(generate_fasta_key_output_file.name, expected_key_output_file))
+
+    def test_overlapping_epitopes_only_skips_subsequences_shorter_than_minimum_length(self):
+        #The 9 amino acid subsequences are long enough for 8mers but the entries
+        #are skipped like they would be for a single FASTA of 10mers
+        generate_fasta_input_file      = os.path.join(self.test_data_dir, 'input.tsv')
+        generate_fasta_params = {
+            'input_file'                : generate_fasta_input_file,
+            'peptide_sequence_length'   : 9,
+            'epitope_length'            : self.epitope_length,
+            'downstream_sequence_length': None,
+            'overlapping_epitopes_only' : True,
+        }
+        for (minimum_subsequence_length, expect_epitopes) in [(self.epitope_length, True), (10, False)]:
+            generate_fasta_output_file     = tempfile.NamedTemporaryFile()
+            generate_fasta_key_output_file = tempfile.NamedTemporaryFile()
+            generator = FastaGenerator(
+                output_file                = generate_fasta_output_file.name,
+                output_key_file            = generate_fasta_key_output_file.name,
+                minimum_subsequence_length = minimum_subsequence_length,
+                **generate_fasta_params
+            )
+            self.assertFalse(generator.execute())
+            self.assertEqual(os.path.getsize(generate_fasta_output_file.name) > 0, expect_epitopes)
+
     def test_input_file_with_peptide_sequence_length_21_generates_expected_file(self):
         peptide_sequence_length        = 21
         generate_fasta_input_file      = os.path.join(self.test_data_dir, 'input.tsv')
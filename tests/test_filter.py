@@ -4,6 +4,7 @@ import tempfile
 from filecmp import cmp
 import py_compile
 from lib.filter import *
+import lib.parquet_report
 
 class FilterTests(unittest.TestCase):
     @classmethod
@@ -182,3 +183,49 @@ class FilterTests(unittest.TestCase):
             os.path.join(self.test_data_path, "output.inf.tsv"),
             False
         ))
+
+    def test_less_than_in_chunks(self):
+        output_file = tempfile.NamedTemporaryFile()
+        self.assertFalse(Filter(
+            os.path.join(
+                self.test_data_path,
+                'Test.combined.parsed.tsv'
+            ),
+            output_file.name,
+            [{
+                'column': "Median MT Score",
+                'operator': "<",
+                'threshold': "500",
+            }],
+            False,
+            chunk_size=2,
+        ).execute())
+        self.assertTrue(cmp(
+            output_file.name,
+            os.path.join(self.test_data_path, "Test.filtered.lt.tsv"),
+            False
+        ))
+
+    @unittest.skipUnless(lib.parquet_report.available(), "pyarrow is not installed")
+    def test_less_than_parquet(self):
+        parquet_file = tempfile.NamedTemporaryFile(suffix='.parquet')
+        lib.parquet_report.write(
+            Filter.read_report(os.path.join(self.test_data_path, 'Test.combined.parsed.tsv')),
+            parquet_file.name
+        )
+        output_file = tempfile.NamedTemporaryFile()
+        self.assertFalse(Filter(
+            parquet_file.name,
+            output_file.name,
+            [{
+                'column': "Median MT Score",
+                'operator': "<",
+                'threshold': "500",
+            }],
+            False,
+        ).execute())
+        self.assertTrue(cmp(
+            output_file.name,
+            os.path.join(self.test_data_path, "Test.filtered.lt.tsv"),
+            False
+        ))
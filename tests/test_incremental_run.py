@@ -0,0 +1,34 @@
+import unittest
+import os
+import sys
+import tempfile
+import py_compile
+from lib.incremental_run import *
+from .test_utils import *
+
+class IncrementalRunTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+        cls.executable = os.path.join(base_dir, 'lib', 'incremental_run.py')
+        cls.test_data_dir = os.path.join(base_dir, 'tests', 'test_data', 'incremental_run')
+
+    def incremental_run(self):
+        return IncrementalRun(
+            tsv_file=os.path.join(self.test_data_dir, 'input.tsv'),
+            previous_tsv_file=os.path.join(self.test_data_dir, 'previous.tsv'),
+            previous_all_epitopes_file=os.path.join(self.test_data_dir, 'previous.all_epitopes.tsv'),
+        )
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(self.executable))
+
+    def test_changed_and_new_variants_are_predicted(self):
+        output_file = tempfile.NamedTemporaryFile()
+        self.incremental_run().write_changed_variants(output_file.name)
+        self.assertTrue(compare(output_file.name, os.path.join(self.test_data_dir, 'output_changed_variants.tsv')))
+
+    def test_unchanged_variants_reuse_previous_epitopes(self):
+        output_file = tempfile.NamedTemporaryFile()
+        self.incremental_run().write_reused_epitopes(output_file.name)
+        self.assertTrue(compare(output_file.name, os.path.join(self.test_data_dir, 'output_reused.parsed.tsv')))
@@ -437,3 +437,23 @@ class InputFileConverterTests(unittest.TestCase):
         self.assertFalse(converter.execute())
         expected_proximal_variants_tsv = os.path.join(self.test_data_dir, 'output_proximal_variants.tsv')
         self.assertTrue(cmp(convert_output_proximal_variants_file.name, expected_proximal_variants_tsv))
+
+    def test_input_vcf_with_expressions_and_encoded_hgvs_generates_expected_tsv(self):
+        #Gene FPKMs of several loci are summed, the last TX and GX entry of a
+        #transcript or gene is used and only HGVS strings with a '%' are decoded
+        convert_vcf_input_file              = os.path.join(self.test_data_dir, 'input_expressions_and_hgvs.vcf')
+        convert_vcf_output_file             = tempfile.NamedTemporaryFile()
+        convert_vcf_cufflinks_genes_file    = os.path.join(self.test_data_dir, 'genes_expressions_and_hgvs.fpkm_tracking')
+        convert_vcf_cufflinks_isoforms_file = os.path.join(self.test_data_dir, 'isoforms_expressions_and_hgvs.fpkm_tracking')
+
+        convert_vcf_params = {
+            'input_file'                 : convert_vcf_input_file,
+            'output_file'                : convert_vcf_output_file.name,
+            'gene_expn_file'             : convert_vcf_cufflinks_genes_file,
+            'transcript_expn_file'       : convert_vcf_cufflinks_isoforms_file,
+        }
+        converter = VcfConverter(**convert_vcf_params)
+
+        self.assertFalse(converter.execute())
+        expected_output_file = os.path.join(self.test_data_dir, 'output_expressions_and_hgvs.tsv')
+        self.assertTrue(cmp(convert_vcf_output_file.name, expected_output_file))
@@ -6,7 +6,13 @@ import sys
 import tempfile
 import py_compile
 from filecmp import cmp
+import csv
+import requests
 import lib
+from .mock_net_chop_server import MockNetChopServer
+
+#The other tests replace requests.post with a mock
+requests_post = requests.post
 
 def make_response(data, files, path):
     reader = open(os.path.join(
@@ -90,3 +96,99 @@ class NetChopTest(unittest.TestCase):
             os.path.join(self.test_data_directory, 'output_no_cleavage_score.tsv'),
             output_file.name
         ))
+
+    def test_net_chop_submits_each_peptide_once(self):
+        input_file = tempfile.NamedTemporaryFile(mode='w', suffix='.tsv')
+        with open(os.path.join(self.test_data_directory, 'Test_filtered.tsv'), 'r') as fh:
+            header = fh.readline()
+            rows = fh.readlines()
+        input_file.write(header)
+        input_file.writelines(rows + rows)
+        input_file.flush()
+        output_file = tempfile.NamedTemporaryFile()
+        with MockNetChopServer() as server, \
+                unittest.mock.patch.object(lib.net_chop.requests, 'post', requests_post), \
+                unittest.mock.patch.object(lib.net_chop, 'url', server.url()):
+            lib.net_chop.main([
+                input_file.name,
+                output_file.name,
+                '--chunk-size', '1',
+                '--poll-interval', '0',
+                '--n-threads', '2',
+            ])
+            submitted_peptides = [sequence for job in server.jobs for (sequence_id, sequence) in job['sequences']]
+        self.assertEqual(sorted(submitted_peptides), ['ATLSRTLLL', 'RMPGDRPTL'])
+
+        with open(output_file.name, 'r') as fh:
+            output_rows = list(csv.DictReader(fh, delimiter='\t'))
+        self.assertEqual(len(output_rows), 4)
+        self.assertEqual(output_rows[:2], output_rows[2:])
+        self.assertEqual(output_rows[0]['MT Epitope Seq'], 'ATLSRTLLL')
+        self.assertEqual(output_rows[0]['Best Cleavage Position'], '9')
+        self.assertEqual(output_rows[0]['Cleavage Sites'], '3:0.53,5:0.55,7:0.57,8:0.58,9:0.59')
+
+    def test_net_chop_runs_local_executable(self):
+        for method in ['cterm', '20s']:
+            output_file = tempfile.NamedTemporaryFile()
+            lib.net_chop.main([
+                os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                output_file.name,
+                '--method', method,
+                '--netchop-executable', os.path.join(self.test_data_directory, 'netchop'),
+            ])
+            self.assertTrue(cmp(
+                os.path.join(self.test_data_directory, 'output_%s.tsv'%method),
+                output_file.name
+            ))
+
+    def test_net_chop_reuses_cached_predictions(self):
+        for method in ['cterm', '20s']:
+            with tempfile.TemporaryDirectory() as cache_directory:
+                cache_file = os.path.join(cache_directory, 'cache.sqlite')
+                #The second run can only succeed if none of its epitopes are run again
+                for executable in ['netchop', 'missing_netchop']:
+                    output_file = tempfile.NamedTemporaryFile()
+                    lib.net_chop.main([
+                        os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                        output_file.name,
+                        '--method', method,
+                        '--netchop-executable', os.path.join(self.test_data_directory, executable),
+                        '--annotation-cache', cache_file,
+                    ])
+                    self.assertTrue(cmp(
+                        os.path.join(self.test_data_directory, 'output_%s.tsv'%method),
+                        output_file.name
+                    ))
+
+    def test_net_chop_runs_local_executable_with_expected_arguments(self):
+        executable = os.path.join(self.test_data_directory, 'netchop')
+        peptides = list(lib.net_chop.unique_peptides([
+            {'MT Epitope Seq': 'ATLSRTLLL'},
+            {'MT Epitope Seq': 'RMPGDRPTL'},
+        ]).items())
+        run = lib.net_chop.subprocess.run
+        for (method, version) in [('cterm', '0'), ('20s', '1')]:
+            submitted_sequences = []
+            def run_netchop(arguments, **kwargs):
+                with open(arguments[-1], 'r') as fh:
+                    submitted_sequences.append(fh.read())
+                return run(arguments, **kwargs)
+            run_mock = unittest.mock.Mock(side_effect=run_netchop)
+            with unittest.mock.patch.object(lib.net_chop.subprocess, 'run', run_mock):
+                results = lib.net_chop.run_chunk(peptides, executable, method, 0.5)
+            self.assertEqual(run_mock.call_count, 1)
+            arguments = run_mock.call_args[0][0]
+            self.assertEqual(arguments[:-1], [executable, '-v', version, '-t', '0.500000'])
+            self.assertEqual(submitted_sequences, ['>0000000000\nATLSRTLLL\n>0000000001\nRMPGDRPTL\n'])
+            self.assertEqual(sorted(results), ['0000000000', '0000000001'])
+
+    def test_net_chop_local_executable_failure(self):
+        #The stand-in executable rejects a threshold other than the default
+        with tempfile.NamedTemporaryFile() as output_file, self.assertRaises(SystemExit) as context:
+            lib.net_chop.main([
+                os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                output_file.name,
+                '--threshold', '0.6',
+                '--netchop-executable', os.path.join(self.test_data_directory, 'netchop'),
+            ])
+        self.assertEqual(context.exception.code, 1)
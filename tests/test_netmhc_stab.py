@@ -6,6 +6,7 @@ import sys
 import tempfile
 import py_compile
 from filecmp import cmp
+import csv
 import lib
 
 def make_response(data, files, path):
@@ -55,3 +56,94 @@ class NetChopTest(unittest.TestCase):
             os.path.join(self.test_data_directory, 'Test_filtered.stab.tsv'),
             output_file.name
         ))
+
+    def test_netmhc_stab_submits_each_allele_and_length_separately(self):
+        request_mock = unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+            data,
+            files,
+            self.test_data_directory
+        ))
+        with unittest.mock.patch('lib.netmhc_stab.requests.post', request_mock):
+            output_file = tempfile.NamedTemporaryFile()
+            lib.netmhc_stab.main([
+                os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                output_file.name
+            ])
+        with open(os.path.join(self.test_data_directory, 'Test_filtered.tsv'), 'r') as fh:
+            expected_groups = set(
+                (line['HLA Allele'].replace('*', ''), line['Peptide Length'])
+                for line in csv.DictReader(fh, delimiter='\t')
+            )
+        submitted_groups = [
+            (call[1]['data']['allele'], call[1]['data']['len'])
+            for call in request_mock.call_args_list
+        ]
+        self.assertEqual(sorted(submitted_groups), sorted(expected_groups))
+
+    def test_netmhc_stab_runs_local_executable(self):
+        output_file = tempfile.NamedTemporaryFile()
+        lib.netmhc_stab.main([
+            os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+            output_file.name,
+            '--netmhcstabpan-executable', os.path.join(self.test_data_directory, 'netMHCstabpan'),
+        ])
+        self.assertTrue(cmp(
+            os.path.join(self.test_data_directory, 'Test_filtered.stab.tsv'),
+            output_file.name
+        ))
+
+    def test_netmhc_stab_reuses_cached_predictions(self):
+        with tempfile.TemporaryDirectory() as cache_directory:
+            cache_file = os.path.join(cache_directory, 'cache.sqlite')
+            #The second run can only succeed if none of its epitopes are run again
+            for executable in ['netMHCstabpan', 'missing_netMHCstabpan']:
+                output_file = tempfile.NamedTemporaryFile()
+                lib.netmhc_stab.main([
+                    os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                    output_file.name,
+                    '--netmhcstabpan-executable', os.path.join(self.test_data_directory, executable),
+                    '--annotation-cache', cache_file,
+                ])
+                self.assertTrue(cmp(
+                    os.path.join(self.test_data_directory, 'Test_filtered.stab.tsv'),
+                    output_file.name
+                ))
+
+    def test_netmhc_stab_runs_local_executable_with_expected_arguments(self):
+        executable = os.path.join(self.test_data_directory, 'netMHCstabpan')
+        with open(os.path.join(self.test_data_directory, 'Test_filtered.tsv'), 'r') as fh:
+            groups = lib.netmhc_stab.group_peptides(csv.DictReader(fh, delimiter='\t'))
+        self.assertEqual(groups, [
+            ('HLA-G*01:09', 9, ['KYQDVYVEL']),
+            ('HLA-E*01:01', 9, ['ATLSRTLLL', 'RMPGDRPTL']),
+        ])
+        run = lib.netmhc_stab.subprocess.run
+        for (allele, length, peptides) in groups:
+            submitted_peptides = []
+            def run_netmhcstabpan(arguments, **kwargs):
+                with open(arguments[-1], 'r') as fh:
+                    submitted_peptides.append(fh.read())
+                return run(arguments, **kwargs)
+            run_mock = unittest.mock.Mock(side_effect=run_netmhcstabpan)
+            with unittest.mock.patch.object(lib.netmhc_stab.subprocess, 'run', run_mock):
+                (predictions, allele_map) = lib.netmhc_stab.run_group(allele, length, peptides, executable)
+            self.assertEqual(run_mock.call_count, 1)
+            arguments = run_mock.call_args[0][0]
+            self.assertEqual(arguments[:-1], [executable, '-a', allele.replace('*', ''), '-l', '9', '-p'])
+            self.assertEqual(submitted_peptides, ['\n'.join(peptides)+'\n'])
+            self.assertEqual(sorted(predictions), sorted((allele, peptide) for peptide in peptides))
+            self.assertEqual(list(allele_map), [allele.replace('*', '')])
+
+    def test_netmhc_stab_local_executable_failure(self):
+        #The stand-in executable rejects alleles that it has no predictions for
+        with tempfile.TemporaryDirectory() as input_directory:
+            input_file = os.path.join(input_directory, 'Test_filtered.tsv')
+            with open(os.path.join(self.test_data_directory, 'Test_filtered.tsv'), 'r') as fh, open(input_file, 'w') as input_fh:
+                input_fh.write(fh.read().replace('HLA-G*01:09', 'HLA-A*01:01'))
+            with tempfile.NamedTemporaryFile() as output_file, self.assertRaises(SystemExit) as context:
+                lib.netmhc_stab.main([
+                    input_file,
+                    output_file.name,
+                    '--netmhcstabpan-executable', os.path.join(self.test_data_directory, 'netMHCstabpan'),
+                ])
+        self.assertEqual(context.exception.code, 1)
@@ -2,7 +2,11 @@ import unittest
 import os
 import sys
 import tempfile
+import re
 import py_compile
+import numpy as np
+from math import nan
+from statistics import median
 from lib.output_parser import *
 from .test_utils import *
 
@@ -343,3 +347,77 @@ class OutputParserTests(unittest.TestCase):
         self.assertFalse(parser.execute())
         expected_output_file  = os.path.join(self.test_data_dir, "output_pvacvector.iedb.parsed.tsv")
         self.assertTrue(compare(parse_output_output_file.name, expected_output_file))
+
+    def test_summary_metrics_match_statistics_median_and_min(self):
+        scores = np.array([
+            [5.0, 1.0, 3.0, nan],
+            [2.0, 2.0, 8.0, 4.0],
+            [nan, 7.5, nan, nan],
+            [nan, nan, nan, nan],
+        ])
+        (best_scores, best_columns) = OutputParser.best_scores(scores)
+        self.assertEqual(best_scores[:3].tolist(), [1.0, 2.0, 7.5])
+        self.assertEqual(best_columns[:3].tolist(), [1, 0, 1])
+        median_scores = OutputParser.median_scores(scores)
+        for (row, median_score) in zip(scores[:3], median_scores[:3]):
+            self.assertEqual(median_score, median(row[~np.isnan(row)]))
+        self.assertTrue(np.isnan(median_scores[3]))
+
+    def test_parse_output_with_preloaded_tsv_entries_produces_expected_output(self):
+        parse_output_input_iedb_file = [os.path.join(self.test_data_dir, "input_peptide_sequence_length_21.ann.HLA-A*29:02.9.tsv")]
+        parse_output_input_tsv_file = os.path.join(self.test_data_dir, "input_peptide_sequence_length_21.tsv")
+        parse_output_key_file = os.path.join(self.test_data_dir, "input_peptide_sequence_length_21.key")
+        parse_output_output_file = tempfile.NamedTemporaryFile()
+
+        tsv_entries = OutputParser.load_tsv_entries(parse_output_input_tsv_file)
+        for tsv_entry in tsv_entries.values():
+            self.assertNotIn('wildtype_amino_acid_sequence', tsv_entry)
+            self.assertNotIn('downstream_amino_acid_sequence', tsv_entry)
+
+        parse_output_params = {
+            'input_iedb_files'       : parse_output_input_iedb_file,
+            'input_tsv_file'         : parse_output_input_tsv_file,
+            'key_file'               : parse_output_key_file,
+            'output_file'            : parse_output_output_file.name,
+            'sample_name'            : None,
+            'tsv_entries'            : tsv_entries,
+        }
+        parser = DefaultOutputParser(**parse_output_params)
+
+        self.assertFalse(parser.execute())
+        expected_output_file  = os.path.join(self.test_data_dir, "output_peptide_sequence_length_21.iedb.parsed.tsv")
+        self.assertTrue(compare(parse_output_output_file.name, expected_output_file))
+
+    def test_parse_output_of_non_first_peptide_registry_chunk_produces_expected_output(self):
+        #With a peptide registry the key file of a chunk uses the IDs of the
+        #run while IEDB numbers the sequences of each submitted file from 1
+        parse_output_input_iedb_files = [
+            os.path.join(self.test_data_dir, "input.ann.HLA-A*29:02.9.tsv"),
+            os.path.join(self.test_data_dir, "input.smm.HLA-A*29:02.9.tsv"),
+            os.path.join(self.test_data_dir, "input.smmpmbec.HLA-A*29:02.9.tsv"),
+        ]
+        parse_output_input_tsv_file = os.path.join(self.test_data_dir, "Test.tsv")
+        parse_output_key_file = tempfile.NamedTemporaryFile(mode='w')
+        with open(os.path.join(self.test_data_dir, "Test_21.key"), 'r') as key_file_reader:
+            for line in key_file_reader:
+                match = re.match(r'^(\d+):$', line.rstrip())
+                if match:
+                    line = '%d:\n' % (int(match.group(1)) + 100)
+                parse_output_key_file.write(line)
+        parse_output_key_file.flush()
+        registry_ids = dict((seq_num, seq_num + 100) for seq_num in range(1, 49))
+        parse_output_output_file = tempfile.NamedTemporaryFile()
+
+        parse_output_params = {
+            'input_iedb_files'       : parse_output_input_iedb_files,
+            'input_tsv_file'         : parse_output_input_tsv_file,
+            'key_file'               : parse_output_key_file.name,
+            'output_file'            : parse_output_output_file.name,
+            'sample_name'            : None,
+            'registry_ids'           : dict((input_iedb_file, registry_ids) for input_iedb_file in parse_output_input_iedb_files),
+        }
+        parser = DefaultOutputParser(**parse_output_params)
+
+        self.assertFalse(parser.execute())
+        expected_output_file  = os.path.join(self.test_data_dir, "output_Test_21.iedb.parsed.tsv")
+        self.assertTrue(compare(parse_output_output_file.name, expected_output_file))
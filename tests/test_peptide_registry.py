@@ -0,0 +1,57 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import py_compile
+from filecmp import cmp
+from lib.peptide_registry import *
+
+class PeptideRegistryTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+        cls.executable = os.path.join(base_dir, 'lib', 'peptide_registry.py')
+        cls.test_data_dir = os.path.join(base_dir, 'tests', 'test_data', 'peptide_registry')
+        cls.fasta_chunks = ['1-4', '5-8', '9-12']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.split_fasta_files = []
+        for fasta_chunk in self.fasta_chunks:
+            split_fasta_file = os.path.join(self.tmp_dir.name, 'Test_21.fa.split_%s' % fasta_chunk)
+            shutil.copy(os.path.join(self.test_data_dir, os.path.basename(split_fasta_file)), split_fasta_file)
+            shutil.copy(os.path.join(self.test_data_dir, os.path.basename(split_fasta_file) + '.key'), split_fasta_file + '.key')
+            self.split_fasta_files.append((fasta_chunk, split_fasta_file))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(self.executable))
+
+    def test_peptides_are_registered_once_per_run(self):
+        PeptideRegistry(self.split_fasta_files).execute()
+        for (fasta_chunk, split_fasta_file) in self.split_fasta_files:
+            for output_file in (
+                PeptideRegistry.unique_fasta_file_path(split_fasta_file),
+                PeptideRegistry.key_file_path(split_fasta_file),
+                PeptideRegistry.ids_file_path(split_fasta_file),
+                PeptideRegistry.sources_file_path(split_fasta_file),
+            ):
+                expected_file = os.path.join(self.test_data_dir, 'output', os.path.basename(output_file))
+                self.assertTrue(cmp(output_file, expected_file, False), output_file)
+
+    def test_sources(self):
+        PeptideRegistry(self.split_fasta_files).execute()
+        self.assertEqual(PeptideRegistry.sources(self.split_fasta_files[0][1]), ['1-4'])
+        self.assertEqual(PeptideRegistry.sources(self.split_fasta_files[1][1]), ['1-4', '5-8'])
+        self.assertEqual(PeptideRegistry.sources(self.split_fasta_files[2][1]), [])
+
+    def test_unique_fasta_files_are_numbered_from_one(self):
+        #The prediction tools report the position of each sequence in the
+        #submitted file, not its FASTA header
+        PeptideRegistry(self.split_fasta_files).execute()
+        self.assertEqual(PeptideRegistry.ids(self.split_fasta_files[0][1]), {1: 1, 2: 2})
+        self.assertEqual(PeptideRegistry.ids(self.split_fasta_files[1][1]), {1: 3, 2: 4})
+        self.assertEqual(PeptideRegistry.ids(self.split_fasta_files[2][1]), {})
@@ -0,0 +1,54 @@
+import unittest
+import os
+import sys
+import tempfile
+import py_compile
+from lib.pre_prediction_filter import *
+from .test_utils import *
+
+class PrePredictionFilterTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+        cls.executable = os.path.join(base_dir, 'lib', 'pre_prediction_filter.py')
+        cls.test_data_dir = os.path.join(base_dir, 'tests', 'test_data', 'pre_prediction_filter')
+        cls.filter_criteria = [
+            {'column': 'tdna_depth', 'operator': '>=', 'threshold': 10},
+            {'column': 'tdna_vaf', 'operator': '>=', 'threshold': 0.1},
+            {'column': 'gene_expression', 'operator': '>=', 'threshold': 1},
+            {'column': 'transcript_expression', 'operator': '>=', 'threshold': 1},
+        ]
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(self.executable))
+
+    def test_filter_keeps_NAs(self):
+        output_file = tempfile.NamedTemporaryFile()
+        PrePredictionFilter(
+            os.path.join(self.test_data_dir, 'input_expression.tsv'),
+            output_file.name,
+            self.filter_criteria,
+            False,
+        ).execute()
+        self.assertTrue(compare(output_file.name, os.path.join(self.test_data_dir, 'output_expression.tsv')))
+
+    def test_filter_exclude_NAs(self):
+        output_file = tempfile.NamedTemporaryFile()
+        PrePredictionFilter(
+            os.path.join(self.test_data_dir, 'input_expression.tsv'),
+            output_file.name,
+            self.filter_criteria,
+            True,
+        ).execute()
+        self.assertTrue(compare(output_file.name, os.path.join(self.test_data_dir, 'output_expression_exclude_NAs.tsv')))
+
+    def test_best_transcript_only(self):
+        output_file = tempfile.NamedTemporaryFile()
+        PrePredictionFilter(
+            os.path.join(self.test_data_dir, 'input_tsl.tsv'),
+            output_file.name,
+            [{'column': 'transcript_support_level', 'operator': '<=', 'threshold': 2}],
+            False,
+            True,
+        ).execute()
+        self.assertTrue(compare(output_file.name, os.path.join(self.test_data_dir, 'output_best_transcript.tsv')))
@@ -45,6 +45,21 @@ class ProximalVariantTests(unittest.TestCase):
         proximal_variants = self.klass.extract(somatic_variant, "T", "ENST00000309931", 60)
         self.assertTrue(proximal_variants)
 
+    def test_sweep_finds_same_proximal_variants(self):
+        sweep_klass = ProximalVariant(os.path.join(self.test_data_dir, 'input.vcf.gz'), False, sweep=True)
+        for (chromosome, start, end, alt, transcript) in [
+            ('chr1', 16006133, 16006134, "T", "ENST00000329454"),
+            ('chr2', 227893862, 227893863, "T", "ENST00000309931"),
+        ]:
+            somatic_variant = next(self.somatic_vcf_reader.fetch(chromosome, start, end))
+            proximal_variants = self.klass.extract(somatic_variant, alt, transcript, 60)
+            sweep_proximal_variants = sweep_klass.extract(somatic_variant, alt, transcript, 60)
+            self.assertEqual(
+                [(entry.CHROM, entry.POS, csq_entry) for (entry, csq_entry) in proximal_variants],
+                [(entry.CHROM, entry.POS, csq_entry) for (entry, csq_entry) in sweep_proximal_variants],
+            )
+        sweep_klass.fh.close()
+
     def test_combine_conflicting_variants(self):
         self.assertEqual(self.klass.combine_conflicting_variants(["ttC/ttA", "tTc/tAc"]), '*')
         self.assertEqual(self.klass.combine_conflicting_variants(["Cca/Tca", "cCa/cTa"]), 'L')
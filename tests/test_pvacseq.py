@@ -315,6 +315,64 @@ class PvacseqTests(unittest.TestCase):
         expected_file = os.path.join(self.test_data_directory, 'Test_with_additional_report_columns.final.tsv')
         self.assertTrue(cmp(output_file, expected_file, False))
 
+    def test_pvacseq_pipeline_post_processing_only_restart(self):
+        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+            data,
+            files,
+            test_data_directory()
+        ))) as mock_request:
+            output_dir = tempfile.TemporaryDirectory()
+            params = [
+                os.path.join(self.test_data_directory, "input.vcf"),
+                'Test',
+                'HLA-E*01:01',
+                'NetMHC',
+                output_dir.name,
+                '-e', '9,10',
+                '--keep-tmp-files',
+            ]
+            run.main(params)
+            call_count = mock_request.call_count
+
+            run.main(params + ['--binding-threshold', '50000', '--tdna-vaf', '0'])
+            self.assertEqual(mock_request.call_count, call_count)
+
+            with open(os.path.join(output_dir.name, 'MHC_Class_I', 'log', 'inputs.yml'), 'r') as log_fh:
+                inputs = yaml.load(log_fh)
+            self.assertEqual(inputs['binding_threshold'], 50000)
+            self.assertEqual(inputs['tdna_vaf'], 0)
+            output_dir.cleanup()
+
+    def test_pvacseq_pipeline_early_filter_restart_with_changed_filter_aborts(self):
+        #With --early-filter the coverage and VAF cutoffs decide which variants
+        #are predicted. Loosening them would need predictions for more variants.
+        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+            data,
+            files,
+            test_data_directory()
+        ))) as mock_request:
+            output_dir = tempfile.TemporaryDirectory()
+            params = [
+                os.path.join(self.test_data_directory, "input.vcf"),
+                'Test',
+                'HLA-E*01:01',
+                'NetMHC',
+                output_dir.name,
+                '-e', '9,10',
+                '--early-filter',
+            ]
+            run.main(params)
+            call_count = mock_request.call_count
+
+            with self.assertRaises(SystemExit) as cm:
+                run.main(params + ['--tdna-vaf', '0'])
+            self.assertIn("Restart inputs are different from past inputs", str(cm.exception))
+            self.assertEqual(mock_request.call_count, call_count)
+
+            run.main(params + ['--binding-threshold', '50000'])
+            self.assertEqual(mock_request.call_count, call_count)
+            output_dir.cleanup()
+
     @patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
         data,
         files,
@@ -26,3 +26,10 @@ class CondenseFinalReportTests(unittest.TestCase):
             output_file.name,
             os.path.join(self.test_data_dir, "output.tsv"),
         ))
+
+    def test_rank_epitopes_in_chunks_produces_same_output(self):
+        output_file = tempfile.NamedTemporaryFile()
+        chunked_output_file = tempfile.NamedTemporaryFile()
+        self.assertFalse(RankEpitopes(os.path.join(self.test_data_dir, 'input.tsv'), output_file.name).execute())
+        self.assertFalse(RankEpitopes(os.path.join(self.test_data_dir, 'input.tsv'), chunked_output_file.name, 2).execute())
+        self.assertTrue(cmp(output_file.name, chunked_output_file.name, False))
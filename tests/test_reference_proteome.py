@@ -0,0 +1,48 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import py_compile
+from lib.reference_proteome import *
+
+class ReferenceProteomeTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+        cls.executable = os.path.join(base_dir, 'lib', 'reference_proteome.py')
+        cls.test_data_dir = os.path.join(base_dir, 'tests', 'test_data', 'reference_proteome')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.reference_proteome_fasta = os.path.join(self.tmp_dir.name, 'proteome.fa')
+        shutil.copy(os.path.join(self.test_data_dir, 'proteome.fa'), self.reference_proteome_fasta)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(self.executable))
+
+    def test_contains_reference_epitopes(self):
+        reference_proteome = ReferenceProteome(self.reference_proteome_fasta, [8, 15])
+        self.assertTrue(reference_proteome.contains('SHVWTHSR'))
+        self.assertTrue(reference_proteome.contains('MSDNGPQN'))
+        self.assertFalse(reference_proteome.contains('SHVWTRSR'))
+        self.assertTrue(reference_proteome.contains('GRSGGSHVWTHSRDP'))
+        self.assertFalse(reference_proteome.contains('GRSGGSHVWTRSRDP'))
+        #Epitopes spanning two proteins are not in the reference proteome
+        self.assertFalse(reference_proteome.contains('VPALLMSD'))
+
+    def test_contains_all_kmers(self):
+        reference_proteome = ReferenceProteome(self.reference_proteome_fasta, [8, 9])
+        self.assertTrue(reference_proteome.contains_all_kmers('GRSGGSHVWTHSRDPEGSSRK'))
+        self.assertFalse(reference_proteome.contains_all_kmers('GRSGGSHVWTRSRDPEGSSRK'))
+
+    def test_index_is_saved_and_reused(self):
+        ReferenceProteome(self.reference_proteome_fasta, [8])
+        index_file = os.path.join(self.tmp_dir.name, 'proteome.fa.8mers.npy')
+        self.assertTrue(os.path.exists(index_file))
+        reference_proteome = ReferenceProteome(self.reference_proteome_fasta, [8])
+        self.assertEqual(reference_proteome.kmers[8].filename, index_file)
+        self.assertTrue(reference_proteome.contains('SHVWTHSR'))
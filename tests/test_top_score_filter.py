@@ -3,6 +3,7 @@ import sys
 import os
 import py_compile
 import tempfile
+import csv
 from lib.top_score_filter import *
 from .test_utils import *
 
@@ -44,3 +45,24 @@ class TopScoreFilterTests(unittest.TestCase):
 
         expected_output_file = os.path.join(self.test_data_dir, 'output_fusion.tsv')
         self.assertTrue(compare(output_file.name, expected_output_file))
+
+    @unittest.skipUnless(lib.parquet_report.available(), "pyarrow is not installed")
+    def test_parquet_input_keeps_row_order(self):
+        #The parquet report keeps the row order of the TSV report so the
+        #filtered rows come out in the same order for both
+        input_file = os.path.join(self.test_data_dir, 'input.tsv')
+        parquet_file = tempfile.NamedTemporaryFile(suffix='.parquet')
+        lib.parquet_report.write(Filter.read_report(input_file), parquet_file.name)
+        tsv_output_file = tempfile.NamedTemporaryFile()
+        parquet_output_file = tempfile.NamedTemporaryFile()
+
+        TopScoreFilter(input_file, tsv_output_file.name, 'median').execute()
+        TopScoreFilter(parquet_file.name, parquet_output_file.name, 'median').execute()
+
+        def variants(output_file):
+            with open(output_file, 'r') as fh:
+                return [
+                    (line['Chromosome'], line['Start'], line['Stop'], line['MT Epitope Seq'])
+                    for line in csv.DictReader(fh, delimiter='\t')
+                ]
+        self.assertEqual(variants(parquet_output_file.name), variants(tsv_output_file.name))
@@ -7,6 +7,9 @@ from tools.pvacseq.config_files import additional_input_file_list_options
 from lib.run_argument_parser import *
 from lib.post_processor import *
 import lib.call_iedb
+import lib.parquet_report
+import lib.intermediate_table
+import lib.bgzip_report
 
 def define_parser():
     return PvacfuseRunArgumentParser().parser
@@ -16,7 +19,7 @@ def combine_reports(input_files, output_file):
     with open(output_file, 'w') as fout:
         writer = csv.writer(fout)
         for filename in input_files:
-            with open(filename) as fin:
+            with lib.bgzip_report.open_report(filename) as fin:
                 reader = csv.reader(fin)
                 headers = next(reader)
                 if write_headers:
@@ -28,8 +31,8 @@ def create_combined_reports(base_output_dir, args):
     output_dir = os.path.join(base_output_dir, 'combined')
     os.makedirs(output_dir, exist_ok=True)
 
-    file1 = os.path.join(base_output_dir, 'MHC_Class_I', "{}.all_epitopes.tsv".format(args.sample_name))
-    file2 = os.path.join(base_output_dir, 'MHC_Class_II', "{}.all_epitopes.tsv".format(args.sample_name))
+    file1 = lib.bgzip_report.report_path(os.path.join(base_output_dir, 'MHC_Class_I', "{}.all_epitopes.tsv".format(args.sample_name)))
+    file2 = lib.bgzip_report.report_path(os.path.join(base_output_dir, 'MHC_Class_II', "{}.all_epitopes.tsv".format(args.sample_name)))
     combined_output_file = os.path.join(output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
     combine_reports([file1, file2], combined_output_file)
     filtered_report_file = os.path.join(output_dir, "{}.filtered.tsv".format(args.sample_name))
@@ -46,7 +49,7 @@ def create_combined_reports(base_output_dir, args):
     post_processing_params['run_netmhc_stab'] = False
 
     PostProcessor(**post_processing_params).execute()
-    print("\nDone: Pipeline finished successfully. File {} contains ranked list of filtered putative neoantigens for class I and class II predictions.\n".format(condensed_report_file))
+    print("\nDone: Pipeline finished successfully. File {} contains ranked list of filtered putative neoantigens for class I and class II predictions.\n".format(lib.bgzip_report.report_path(condensed_report_file)))
 
 def main(args_input = sys.argv[1:]):
     parser = define_parser()
@@ -61,6 +64,12 @@ def main(args_input = sys.argv[1:]):
     if args.iedb_retries > 100:
         sys.exit("The number of IEDB retries must be less than or equal to 100")
 
+    if args.output_format == 'parquet' and not lib.parquet_report.available():
+        sys.exit("The parquet output format requires pyarrow. Install it with `pip install pvactools[parquet]`.")
+
+    if args.intermediate_format == 'arrow' and not lib.intermediate_table.available():
+        sys.exit("The arrow intermediate format requires pyarrow. Install it with `pip install pvactools[parquet]`.")
+
     if args.downstream_sequence_length == 'full':
         downstream_sequence_length = None
     elif args.downstream_sequence_length.isdigit():
@@ -106,12 +115,18 @@ def main(args_input = sys.argv[1:]):
         'allele_specific_cutoffs'   : args.allele_specific_binding_thresholds,
         'net_chop_method'           : args.net_chop_method,
         'net_chop_threshold'        : args.net_chop_threshold,
+        'netchop_executable'        : args.netchop_executable,
+        'netmhcstabpan_executable'  : args.netmhcstabpan_executable,
+        'annotation_cache'          : args.annotation_cache,
         'additional_report_columns' : args.additional_report_columns,
         'fasta_size'                : args.fasta_size,
         'iedb_retries'              : args.iedb_retries,
         'downstream_sequence_length': downstream_sequence_length,
         'keep_tmp_files'            : args.keep_tmp_files,
         'n_threads'                 : args.n_threads,
+        'output_format'             : args.output_format,
+        'intermediate_format'       : args.intermediate_format,
+        'bgzip_reports'             : args.bgzip_reports,
     }
 
     if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0:
@@ -56,6 +56,10 @@ def define_parser():
         default=False,
         action='store_true'
     )
+    parser.add_argument(
+        '--chunk-size', type=int,
+        help="Filter the report in batches of this many rows instead of loading the whole report into memory.",
+    )
     return parser
 
 def main(args_input = sys.argv[1:]):
@@ -81,7 +85,7 @@ def main(args_input = sys.argv[1:]):
     filter_criteria.append({'column': "Gene_Expression", 'operator': '>=', 'threshold': args.expn_val})
     filter_criteria.append({'column': "Transcript_Expression", 'operator': '>=', 'threshold': args.expn_val})
 
-    Filter(args.input_file, args.output_file, filter_criteria, args.exclude_NAs).execute()
+    Filter(args.input_file, args.output_file, filter_criteria, args.exclude_NAs, chunk_size=args.chunk_size).execute()
 
 if __name__ == "__main__":
     main()
@@ -23,6 +23,10 @@ def define_parser():
              + "lowest: Use the best MT Score and Corresponding Fold Change (i.e. the lowest MT ic50 binding score and corresponding fold change of all chosen prediction methods). "
              + "median: Use the median MT Score and Median Fold Change (i.e. the median MT ic50 binding score and fold change of all chosen prediction methods)."
     )
+    parser.add_argument(
+        '--chunk-size', type=int,
+        help="Rank the report in batches of this many rows instead of loading the whole report into memory.",
+    )
 
     return parser
 
@@ -37,7 +41,7 @@ def main(args_input = sys.argv[1:]):
     print("Completed")
 
     print("Ranking neoepitopes")
-    RankEpitopes(tmp_fh.name, args.output_file).execute()
+    RankEpitopes(tmp_fh.name, args.output_file, args.chunk_size).execute()
     print("Completed")
 
     tmp_fh.close()
@@ -7,6 +7,9 @@ from config_files import additional_input_file_list_options
 from lib.run_argument_parser import *
 from lib.post_processor import *
 import lib.call_iedb
+import lib.parquet_report
+import lib.intermediate_table
+import lib.bgzip_report
 
 import shutil
 import yaml
@@ -33,7 +36,7 @@ def combine_reports(input_files, output_file):
     with open(output_file, 'w') as fout:
         writer = csv.writer(fout)
         for filename in input_files:
-            with open(filename) as fin:
+            with lib.bgzip_report.open_report(filename) as fin:
                 reader = csv.reader(fin)
                 headers = next(reader)
                 if write_headers:
@@ -45,8 +48,8 @@ def create_combined_reports(base_output_dir, args, additional_input_files):
     output_dir = os.path.join(base_output_dir, 'combined')
     os.makedirs(output_dir, exist_ok=True)
 
-    file1 = os.path.join(base_output_dir, 'MHC_Class_I', "{}.all_epitopes.tsv".format(args.sample_name))
-    file2 = os.path.join(base_output_dir, 'MHC_Class_II', "{}.all_epitopes.tsv".format(args.sample_name))
+    file1 = lib.bgzip_report.report_path(os.path.join(base_output_dir, 'MHC_Class_I', "{}.all_epitopes.tsv".format(args.sample_name)))
+    file2 = lib.bgzip_report.report_path(os.path.join(base_output_dir, 'MHC_Class_II', "{}.all_epitopes.tsv".format(args.sample_name)))
     combined_output_file = os.path.join(output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
     combine_reports([file1, file2], combined_output_file)
     filtered_report_file = os.path.join(output_dir, "{}.filtered.tsv".format(args.sample_name))
@@ -62,7 +65,7 @@ def create_combined_reports(base_output_dir, args, additional_input_files):
     post_processing_params['run_netmhc_stab'] = False
 
     PostProcessor(**post_processing_params).execute()
-    print("\nDone: Pipeline finished successfully. File {} contains ranked list of filtered putative neoantigens for class I and class II predictions.\n".format(condensed_report_file))
+    print("\nDone: Pipeline finished successfully. File {} contains ranked list of filtered putative neoantigens for class I and class II predictions.\n".format(lib.bgzip_report.report_path(condensed_report_file)))
 
 def main(args_input = sys.argv[1:]):
     parser = define_parser()
@@ -77,6 +80,12 @@ def main(args_input = sys.argv[1:]):
     if args.iedb_retries > 100:
         sys.exit("The number of IEDB retries must be less than or equal to 100")
 
+    if args.output_format == 'parquet' and not lib.parquet_report.available():
+        sys.exit("The parquet output format requires pyarrow. Install it with `pip install pvactools[parquet]`.")
+
+    if args.intermediate_format == 'arrow' and not lib.intermediate_table.available():
+        sys.exit("The arrow intermediate format requires pyarrow. Install it with `pip install pvactools[parquet]`.")
+
     if args.downstream_sequence_length == 'full':
         downstream_sequence_length = None
     elif args.downstream_sequence_length.isdigit():
@@ -123,6 +132,9 @@ def main(args_input = sys.argv[1:]):
         'minimum_fold_change'       : args.minimum_fold_change,
         'net_chop_method'           : args.net_chop_method,
         'net_chop_threshold'        : args.net_chop_threshold,
+        'netchop_executable'        : args.netchop_executable,
+        'netmhcstabpan_executable'  : args.netmhcstabpan_executable,
+        'annotation_cache'          : args.annotation_cache,
         'normal_cov'                : args.normal_cov,
         'normal_vaf'                : args.normal_vaf,
         'tdna_cov'                  : args.tdna_cov,
@@ -136,9 +148,16 @@ def main(args_input = sys.argv[1:]):
         'downstream_sequence_length': downstream_sequence_length,
         'keep_tmp_files'            : args.keep_tmp_files,
         'pass_only'                 : args.pass_only,
+        'early_filter'              : args.early_filter,
+        'best_transcript_only'      : args.best_transcript_only,
+        'overlapping_epitopes_only' : args.overlapping_epitopes_only,
+        'reference_proteome_fasta'  : os.path.abspath(args.reference_proteome_fasta) if args.reference_proteome_fasta else None,
         'normal_sample_name'        : args.normal_sample_name,
         'phased_proximal_variants_vcf' : args.phased_proximal_variants_vcf,
         'n_threads'                 : args.n_threads,
+        'output_format'             : args.output_format,
+        'intermediate_format'       : args.intermediate_format,
+        'bgzip_reports'             : args.bgzip_reports,
         'maximum_transcript_support_level': args.maximum_transcript_support_level,
     }
     additional_input_files = parse_additional_input_file_list(args.additional_input_file_list)
@@ -167,6 +186,8 @@ def main(args_input = sys.argv[1:]):
         class_i_arguments['epitope_lengths']         = args.epitope_length
         class_i_arguments['prediction_algorithms']   = class_i_prediction_algorithms
         class_i_arguments['output_dir']              = output_dir
+        if args.previous_run_dir:
+            class_i_arguments['previous_run_dir']    = os.path.join(os.path.abspath(args.previous_run_dir), 'MHC_Class_I')
         class_i_arguments['netmhc_stab']             = args.netmhc_stab
         pipeline = Pipeline(**class_i_arguments)
         pipeline.execute()
@@ -195,6 +216,8 @@ def main(args_input = sys.argv[1:]):
         class_ii_arguments['iedb_executable']         = iedb_mhc_ii_executable
         class_ii_arguments['epitope_lengths']         = [15]
         class_ii_arguments['output_dir']              = output_dir
+        if args.previous_run_dir:
+            class_ii_arguments['previous_run_dir']    = os.path.join(os.path.abspath(args.previous_run_dir), 'MHC_Class_II')
         class_ii_arguments['netmhc_stab']             = False
         pipeline = Pipeline(**class_ii_arguments)
         pipeline.execute()
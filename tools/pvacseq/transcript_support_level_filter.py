@@ -25,6 +25,10 @@ def define_parser():
         default=False,
         action='store_true'
     )
+    parser.add_argument(
+        '--chunk-size', type=int,
+        help="Filter the report in batches of this many rows instead of loading the whole report into memory.",
+    )
     return parser
 
 def main(args_input = sys.argv[1:]):
@@ -38,6 +42,7 @@ def main(args_input = sys.argv[1:]):
         filter_criteria,
         args.exclude_NAs,
         ['Transcript Support Level'],
+        args.chunk_size,
     ).execute()
 
 if __name__ == "__main__":
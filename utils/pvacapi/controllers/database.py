@@ -1,6 +1,7 @@
 import os
 import re
 import csv
+import gzip
 import sys
 import json
 import yaml
@@ -10,7 +11,7 @@ from urllib.parse import urlencode
 from hashlib import md5
 from bokeh.embed import server_document
 from .processes import fetch_process, is_running, process_info
-from .utils import column_filter
+from .utils import column_filter, parquet_rows
 
 float_pattern = re.compile(r'^\d*\.\d+$')
 int_pattern = re.compile(r'^-?\d+$')
@@ -135,20 +136,38 @@ def filterfile(parentID, fileID, count, page, filters, sort, direction):
                     }, 400
                 )
             raw_reader = open(data['visualize'][str(fileID)]['fullname'])
-        if not raw_reader.name.endswith('.tsv'):
-            ext = os.path.splitext(raw_reader.name)[1].lower()
-            if len(ext) and ext[0] == '.':
-                ext = ext[1:]
-            return serve_as(raw_reader, ext)
-        reader = csv.DictReader(raw_reader, delimiter='\t')
+        if raw_reader.name.endswith('.parquet'):
+            #Parquet reports are read by name, not through the text handle
+            raw_reader.close()
+            reader = parquet_rows(raw_reader.name)
+            tmp = parquet_rows(raw_reader.name)
+            try:
+                init = next(tmp)
+            except StopIteration:
+                return []
+            tmp.close()
+        else:
+            if raw_reader.name.endswith('.tsv.gz'):
+                #bgzipped reports are read like uncompressed ones
+                report_open = lambda filename: gzip.open(filename, 'rt')
+                raw_reader.close()
+                raw_reader = report_open(raw_reader.name)
+            elif not raw_reader.name.endswith('.tsv'):
+                ext = os.path.splitext(raw_reader.name)[1].lower()
+                if len(ext) and ext[0] == '.':
+                    ext = ext[1:]
+                return serve_as(raw_reader, ext)
+            else:
+                report_open = open
+            reader = csv.DictReader(raw_reader, delimiter='\t')
 
-        tmp_reader = open(raw_reader.name)
-        tmp = csv.DictReader(tmp_reader, delimiter='\t')
-        try:
-            init = next(tmp)
-        except StopIteration:
-            return []
-        tmp_reader.close()
+            tmp_reader = report_open(raw_reader.name)
+            tmp = csv.DictReader(tmp_reader, delimiter='\t')
+            try:
+                init = next(tmp)
+            except StopIteration:
+                return []
+            tmp_reader.close()
 
         # Get an initial estimate of column datatypes from the first row
         (mapping, column_names) = init_column_mapping(init, current_app.config['schema'])
@@ -1,11 +1,12 @@
 import os
 import csv
+import gzip
 import re
 from flask import current_app
 import subprocess
 from .processes import fetch_process, is_running
 from .database import filterfile
-from .utils import descriptions, is_visualizable, visualization_type, column_filter, filterdata, sort, fullresponse, nav_to_dir
+from .utils import descriptions, is_visualizable, visualization_type, column_filter, parquet_columns, filterdata, sort, fullresponse, nav_to_dir
 
 # details for each file to be appended to the output of results_get
 def resultfile(id, process, file):
@@ -120,19 +121,12 @@ def results_getcols(id, fileID):
                 'message':'The requested file (%d) does not exist'%fileID,
                 'fields':'fileID'
             },400)
-        raw_reader = open(
-            os.path.join(
-                os.path.abspath(current_app.config['files']['data-dir']),
-                'visualize',
-                data['visualize'][str(fileID)]['display_name']
-            )
+        filename = os.path.join(
+            os.path.abspath(current_app.config['files']['data-dir']),
+            'visualize',
+            data['visualize'][str(fileID)]['display_name']
         )
-        reader = csv.DictReader(raw_reader, delimiter='\t')
-        output = {
-            column_filter(field):field for field in reader.fieldnames
-        }
-        raw_reader.close()
-        return output
+        return {column_filter(field):field for field in report_columns(filename)}
     process = fetch_process(id, data, current_app.config['storage']['children'])
     if not process[0]:
         return (
@@ -150,14 +144,21 @@ def results_getcols(id, fileID):
                 "fields":"fileID"
             }, 400
         )
-    raw_reader = open(os.path.join(
+    filename = os.path.join(
         process[0]['output'],
         process[0]['files'][str(fileID)]['display_name']
-    ))
-    reader = csv.DictReader(raw_reader, delimiter='\t')
-    output = {column_filter(field):field for field in reader.fieldnames}
-    raw_reader.close()
-    return output
+    )
+    return {column_filter(field):field for field in report_columns(filename)}
+
+def report_columns(filename):
+    """Get the column names of a report without reading its rows"""
+    if filename.endswith('.parquet'):
+        return parquet_columns(filename)
+    if filename.endswith('.tsv.gz'):
+        with gzip.open(filename, 'rt') as raw_reader:
+            return csv.DictReader(raw_reader, delimiter='\t').fieldnames
+    with open(filename) as raw_reader:
+        return csv.DictReader(raw_reader, delimiter='\t').fieldnames
 
 def visualizefile(file):
     data = current_app.config['storage']['loader']()
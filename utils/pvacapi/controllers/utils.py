@@ -19,6 +19,10 @@ import threading
 from postgresql.exceptions import UndefinedTableError
 from math import ceil
 import operator
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 class dataObj(dict):
     def __init__(self, datafiles, sync):
@@ -100,6 +104,36 @@ _file_info = {
         'visualizable': True,
         'visualization_type': 'condensed',
     },
+    'all_epitopes.parquet': {
+        'description': "Processed data from IEDB, but with no filtering or extra data, in Parquet format",
+        'visualizable': True,
+        'visualization_type': 'full',
+    },
+    'filtered.parquet': {
+        'description': "Processed data with all filters applied, in Parquet format",
+        'visualizable': True,
+        'visualization_type': 'full',
+    },
+    'filtered.condensed.ranked.parquet': {
+        'description': "A condensed report of the processed and filtered data, with ranking score added, in Parquet format",
+        'visualizable': True,
+        'visualization_type': 'condensed',
+    },
+    'all_epitopes.tsv.gz': {
+        'description': "Processed data from IEDB, but with no filtering or extra data, bgzip compressed",
+        'visualizable': True,
+        'visualization_type': 'full',
+    },
+    'filtered.tsv.gz': {
+        'description': "Processed data with all filters applied, bgzip compressed",
+        'visualizable': True,
+        'visualization_type': 'full',
+    },
+    'filtered.condensed.ranked.tsv.gz': {
+        'description': "A condensed report of the processed and filtered data, with ranking score added, bgzip compressed",
+        'visualizable': True,
+        'visualization_type': 'condensed',
+    },
     'tsv': {
         'description': "Raw input data parsed out of the input vcf",
         'visualizable': False,
@@ -143,6 +177,9 @@ def visualization_type(ext):
     return None
 
 def check_size(file, max_tries = 5):
+    if file.endswith('.parquet'):
+        #The row count is stored in the file metadata
+        return pyarrow is not None and pyarrow.parquet.ParquetFile(file).metadata.num_rows > 0
     tries = 1
     while tries <= max_tries:
         try:
@@ -164,6 +201,18 @@ def column_filter(column):
     """standardize column names"""
     return column.replace(' ', '_').replace('-', '_').lower().strip()
 
+def parquet_columns(file):
+    """Read the column names of a Parquet report from its schema"""
+    return pyarrow.parquet.read_schema(file).names
+
+def parquet_rows(file, columns=None):
+    """Read a Parquet report one row group at a time.
+    The values are formatted like the values of a .tsv report"""
+    parquet_file = pyarrow.parquet.ParquetFile(file)
+    for row_group in range(parquet_file.num_row_groups):
+        for row in parquet_file.read_row_group(row_group, columns=columns).to_pylist():
+            yield {k: ('NA' if v is None else str(v)) for (k, v) in row.items()}
+
 def loaddata(datafiles, sync):
     sync.acquire()
     data = dataObj({datafiles[datafile] for datafile in datafiles if not datafile.endswith('-dir')}, sync)